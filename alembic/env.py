@@ -17,10 +17,18 @@ if config.config_file_name is not None:
 # for 'autogenerate' support
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
+import apps.accounts.models  # noqa: F401, the tables of all the apps are in the metadata
 from apps.products.models import FastModel
+from config.database import DatabaseManager
 
 target_metadata = FastModel.metadata
 
+# migrate the database of the app, unless another URL is given
+if not config.get_main_option("sqlalchemy.url"):
+    DatabaseManager()
+    url = DatabaseManager.engine.url.render_as_string(hide_password=False)
+    config.set_main_option("sqlalchemy.url", url.replace("%", "%%"))
+
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
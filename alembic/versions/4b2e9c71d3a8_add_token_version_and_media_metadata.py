@@ -0,0 +1,92 @@
+"""add users.token_version, the image metadata of product_media and the indexes on the media paths
+
+The tables are created by `DatabaseManager.create_database_tables`, which doesn't add the new columns and indexes of a
+table that already exists: this revision adds them to a database created before, and does nothing on a new one.
+
+Revision ID: 4b2e9c71d3a8
+Revises:
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b2e9c71d3a8'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = {
+    'users': [
+        sa.Column('token_version', sa.Integer(), nullable=False, server_default='0'),
+    ],
+    'product_media': [
+        sa.Column('width', sa.Integer(), nullable=True),
+        sa.Column('height', sa.Integer(), nullable=True),
+        sa.Column('size', sa.Integer(), nullable=True),
+        sa.Column('placeholder', sa.String(7), nullable=True),
+    ],
+}
+
+# the lookups of the media by path (garbage collector, attach) and of the thumbnails by media
+INDEXES = {
+    'product_media': [
+        ('ix_product_media_src', ['src']),
+    ],
+    'product_media_thumbnails': [
+        ('ix_product_media_thumbnails_src', ['src']),
+        ('ix_product_media_thumbnails_media_id', ['media_id']),
+    ],
+}
+
+
+def existing_indexes(table: str) -> set[str] | None:
+    """
+    Get the names of the indexes of a table, or None if the table doesn't exist (yet: it's created with its indexes by
+    `create_database_tables`). Offline (`--sql`), the script handles all the indexes.
+    """
+
+    if op.get_context().as_sql:
+        return set()
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(table):
+        return None
+    return {index['name'] for index in inspector.get_indexes(table)}
+
+
+def upgrade() -> None:
+    offline = op.get_context().as_sql
+    for table, columns in COLUMNS.items():
+        # offline (`--sql`), the script adds all the columns
+        existing = set() if offline else {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+        for column in columns:
+            if column.name not in existing:
+                op.add_column(table, column)
+
+    for table, indexes in INDEXES.items():
+        existing = existing_indexes(table)
+        if existing is None:
+            continue
+        for name, columns in indexes:
+            if name not in existing:
+                op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    for table, indexes in INDEXES.items():
+        existing = existing_indexes(table)
+        if existing is None:
+            continue
+        for name, _ in indexes:
+            if op.get_context().as_sql or name in existing:
+                op.drop_index(name, table_name=table)
+
+    for table, columns in COLUMNS.items():
+        # sqlite can't drop a column in place, the batch copies the table
+        with op.batch_alter_table(table) as batch_op:
+            for column in columns:
+                batch_op.drop_column(column.name)
@@ -20,7 +20,7 @@ class FakeAccount(BaseFakeAccount):
     """
 
     @classmethod
-    def register_unverified(cls):
+    async def register_unverified(cls):
         """
         Register a new user and get the OTP code.
         """
@@ -30,15 +30,15 @@ class FakeAccount(BaseFakeAccount):
             "email": cls.random_email(),
             "password": cls.password
         }
-        AccountService.register(**register_payload)
+        await AccountService.register(**register_payload)
 
         # --- read otp code ---
-        user = UserManager.get_user(email=register_payload['email'])
+        user = await UserManager.get_user(email=register_payload['email'])
 
         return user.email, TokenService.create_otp_token()
 
     @classmethod
-    def verified_registration(cls):
+    async def verified_registration(cls):
         """
         Registered a new user and verified their OTP code.
         """
@@ -48,11 +48,11 @@ class FakeAccount(BaseFakeAccount):
             "email": cls.random_email(),
             "password": cls.password
         }
-        AccountService.register(**register_payload)
+        await AccountService.register(**register_payload)
 
         # --- read otp code ---
-        user = UserManager.get_user(email=register_payload['email'])
-        verified = AccountService.verify_registration(**{'email': user.email,
+        user = await UserManager.get_user(email=register_payload['email'])
+        verified = await AccountService.verify_registration(**{'email': user.email,
                                                          'otp': TokenService.create_otp_token()})
         return user, verified['access_token']
 
@@ -60,13 +60,13 @@ class FakeAccount(BaseFakeAccount):
 class FakeUser(BaseFakeAccount):
 
     @classmethod
-    def populate_members(cls):
+    async def populate_members(cls):
         """
         Create an admin and a user.
         """
 
         # --- admin ---
-        user, access_token = FakeAccount.verified_registration()
+        user, access_token = await FakeAccount.verified_registration()
         user_data = {
             'email': 'admin@example.com',
             'first_name': cls.fake.first_name(),
@@ -75,25 +75,25 @@ class FakeUser(BaseFakeAccount):
             'role': 'admin'
         }
 
-        UserManager.update_user(user.id, **user_data)
+        await UserManager.update_user(user.id, **user_data)
 
         # --- user ---
-        user, access_token = FakeAccount.verified_registration()
+        user, access_token = await FakeAccount.verified_registration()
         user_data = {
             'email': 'user@example.com',
             'first_name': cls.fake.first_name(),
             'last_name': cls.fake.last_name()
         }
 
-        UserManager.update_user(user.id, **user_data)
+        await UserManager.update_user(user.id, **user_data)
 
     @classmethod
-    def populate_admin(cls):
+    async def populate_admin(cls):
         """
         Create an admin and generate an access token too.
         """
 
-        user, access_token = FakeAccount.verified_registration()
+        user, access_token = await FakeAccount.verified_registration()
         user_data = {
             'first_name': cls.fake.first_name(),
             'last_name': cls.fake.last_name(),
@@ -101,20 +101,20 @@ class FakeUser(BaseFakeAccount):
             'role': 'admin'
         }
 
-        user = UserManager.update_user(user.id, **user_data)
+        user = await UserManager.update_user(user.id, **user_data)
         return user, access_token
 
     @classmethod
-    def populate_user(cls):
+    async def populate_user(cls):
         """
         Create a new user and generate an access token too.
         """
 
-        user, access_token = FakeAccount.verified_registration()
+        user, access_token = await FakeAccount.verified_registration()
         user_data = {
             'first_name': cls.fake.first_name(),
             'last_name': cls.fake.last_name()
         }
 
-        user = UserManager.update_user(user.id, **user_data)
+        user = await UserManager.update_user(user.id, **user_data)
         return user, access_token
@@ -21,6 +21,8 @@ class User(FastModel):
         date_joined (datetime): Timestamp indicating when the user account was created.
         updated_at (datetime, optional): Timestamp indicating when the user account was last updated. Default is None.
         last_login (datetime, optional): Timestamp indicating the user's last login time. Default is None.
+        token_version (int): Version of the user's access tokens, a token is valid only with the current version. It's
+        incremented to revoke the tokens (login, logout, password change).
         change (relationship): Relationship attribute linking this user to change requests initiated by the user.
     """
 
@@ -43,6 +45,7 @@ class User(FastModel):
     date_joined = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, nullable=True, onupdate=func.now())
     last_login = Column(DateTime, nullable=True)
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     change = relationship("UserVerification", back_populates="user", cascade="all, delete-orphan")
 
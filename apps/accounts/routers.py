@@ -37,7 +37,7 @@ Please note that users cannot log in to their accounts until their email address
 """,
     tags=['Authentication'])
 async def register(payload: schemas.RegisterIn = Body(**schemas.RegisterIn.examples())):
-    return AccountService.register(**payload.model_dump(exclude={"password_confirm"}))
+    return await AccountService.register(**payload.model_dump(exclude={"password_confirm"}))
 
 
 @router.patch(
@@ -48,7 +48,7 @@ async def register(payload: schemas.RegisterIn = Body(**schemas.RegisterIn.examp
     description='Verify a new user registration by confirming the provided OTP.',
     tags=['Authentication'])
 async def verify_registration(payload: schemas.RegisterVerifyIn):
-    return AccountService.verify_registration(**payload.model_dump())
+    return await AccountService.verify_registration(**payload.model_dump())
 
 
 # ---------------------
@@ -64,7 +64,7 @@ async def verify_registration(payload: schemas.RegisterVerifyIn):
     description='Login a user with valid credentials, if user account is active.',
     tags=['Authentication'])
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    return AccountService.login(form_data.username, form_data.password)
+    return await AccountService.login(form_data.username, form_data.password)
 
 
 @router.post(
@@ -75,7 +75,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
                 "Revokes the user's access token and invalidates the session.",
     tags=['Authentication'])
 async def logout(current_user: User = Depends(AccountService.current_user)):
-    AccountService.logout(current_user)
+    await AccountService.logout(current_user)
 
 
 # ------------------------
@@ -92,7 +92,7 @@ async def logout(current_user: User = Depends(AccountService.current_user)):
                 "registered email address.",
     tags=['Authentication'])
 async def reset_password(payload: schemas.PasswordResetIn):
-    return AccountService.reset_password(**payload.model_dump())
+    return await AccountService.reset_password(**payload.model_dump())
 
 
 @router.patch(
@@ -104,7 +104,7 @@ async def reset_password(payload: schemas.PasswordResetIn):
                 "registered email address. If the change is successful, the user will need to login again.",
     tags=['Authentication'])
 async def verify_reset_password(payload: schemas.PasswordResetVerifyIn):
-    return AccountService.verify_reset_password(**payload.model_dump(exclude={"password_confirm"}))
+    return await AccountService.verify_reset_password(**payload.model_dump(exclude={"password_confirm"}))
 
 
 # -------------------
@@ -126,7 +126,7 @@ async def verify_reset_password(payload: schemas.PasswordResetVerifyIn):
 
     tags=['Authentication'])
 async def resend_otp(payload: schemas.OTPResendIn = Body(**schemas.OTPResendIn.examples())):
-    AccountService.resend_otp(**payload.model_dump())
+    await AccountService.resend_otp(**payload.model_dump())
 
 
 # ---------------------
@@ -153,7 +153,7 @@ async def retrieve_me(current_user: User = Depends(AccountService.current_user))
     description='Update current user.',
     tags=['Users'])
 async def update_me(payload: schemas.UpdateUserSchema, current_user: User = Depends(AccountService.current_user)):
-    user = UserManager.update_user(current_user.id, **payload.model_dump())
+    user = await UserManager.update_user(current_user.id, **payload.model_dump())
     return {'user': UserManager.to_dict(user)}
 
 
@@ -167,7 +167,7 @@ async def update_me(payload: schemas.UpdateUserSchema, current_user: User = Depe
     tags=['Users'])
 async def change_password(payload: schemas.PasswordChangeIn = Body(**schemas.PasswordChangeIn.examples()),
                           current_user: User = Depends(AccountService.current_user)):
-    return AccountService.change_password(current_user, **payload.model_dump(exclude={"password_confirm"}))
+    return await AccountService.change_password(current_user, **payload.model_dump(exclude={"password_confirm"}))
 
 
 @router.post(
@@ -181,7 +181,7 @@ After the new email is set, an OTP code will be sent to the new email address fo
 """,
     tags=['Users'])
 async def change_email(email: schemas.EmailChangeIn, current_user: User = Depends(AccountService.current_user)):
-    return AccountService.change_email(current_user, **email.model_dump())
+    return await AccountService.change_email(current_user, **email.model_dump())
 
 
 @router.patch(
@@ -197,7 +197,7 @@ email address will be saved as the user's main email address.
     tags=['Users'])
 async def verify_change_email(otp: schemas.EmailChangeVerifyIn,
                               current_user: User = Depends(AccountService.current_user)):
-    return AccountService.verify_change_email(current_user, **otp.model_dump())
+    return await AccountService.verify_change_email(current_user, **otp.model_dump())
 
 
 @router.get(
@@ -210,7 +210,7 @@ async def verify_change_email(otp: schemas.EmailChangeVerifyIn,
     dependencies=[Depends(Permission.is_admin)]
 )
 async def retrieve_user(user_id: int):
-    return {'user': UserManager.to_dict(UserManager.get_user(user_id))}
+    return {'user': UserManager.to_dict(await UserManager.get_user(user_id))}
 
 # TODO DELETE /accounts/me
 # TODO add docs and examples to endpoints
@@ -21,27 +21,27 @@ class AccountService:
     # ----------------
 
     @classmethod
-    def register(cls, email: str, password: str):
+    async def register(cls, email: str, password: str):
         """
         Create a new user and send an email with OTP code.
         """
 
         # check if user with the given email is exist or not.
-        if UserManager.get_user(email=email):
+        if await UserManager.get_user(email=email):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="This email has already been taken."
             )
 
-        new_user = UserManager.create_user(email=email, password=password)
-        TokenService(new_user.id).request_is_register()
+        new_user = await UserManager.create_user(email=email, password=password)
+        await TokenService(new_user.id).request_is_register()
         EmailService.register_send_verification_email(new_user.email)
 
         return {'email': new_user.email,
                 'message': 'Please check your email for an OTP code to confirm your email address.'}
 
     @classmethod
-    def verify_registration(cls, email: str, otp: str):
+    async def verify_registration(cls, email: str, otp: str):
         """
         Verifies user registration by validating the provided OTP code.
 
@@ -64,7 +64,7 @@ class AccountService:
         """
 
         # --- get user by email ---
-        user = UserManager.get_user(email=email)
+        user = await UserManager.get_user(email=email)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -88,11 +88,11 @@ class AccountService:
             )
 
         # --- Update user data and activate the account ---
-        UserManager.update_user(user.id, is_verified_email=True, is_active=True, last_login=DateTime.now())
+        await UserManager.update_user(user.id, is_verified_email=True, is_active=True, last_login=DateTime.now())
 
-        token.reset_otp_token_type()
+        await token.reset_otp_token_type()
 
-        return {'access_token': token.create_access_token(),
+        return {'access_token': await token.create_access_token(),
                 'message': 'Your email address has been confirmed. Account activated successfully.'}
 
     # -------------
@@ -100,12 +100,12 @@ class AccountService:
     # -------------
 
     @classmethod
-    def login(cls, email: str, password: str):
+    async def login(cls, email: str, password: str):
         """
         Login with given email and password.
         """
 
-        user = cls.authenticate_user(email, password)
+        user = await cls.authenticate_user(email, password)
         token: TokenService = TokenService(user)
 
         if not user:
@@ -129,16 +129,20 @@ class AccountService:
                 headers={"WWW-Authenticate": "Bearer"},
             )
 
-        UserManager.update_last_login(user.id)
-        return {"access_token": token.create_access_token(), "token_type": "bearer"}
+        await UserManager.update_last_login(user.id)
+        return {"access_token": await token.create_access_token(), "token_type": "bearer"}
 
     @classmethod
-    def authenticate_user(cls, email: str, password: str):
-        user = UserManager.get_user(email=email)
+    async def authenticate_user(cls, email: str, password: str):
+        user = await UserManager.get_user(email=email)
         if not user:
             return False
-        if not PasswordManager.verify_password(password, user.password):
+        is_valid, new_hash = await PasswordManager.averify_password(password, user.password)
+        if not is_valid:
             return False
+        if new_hash is not None:
+            # --- the cost of the hashes changed, upgrade the hash while the password is known ---
+            await UserManager.update_password_hash(user.id, new_hash)
         return user
 
     # ----------------------
@@ -146,31 +150,31 @@ class AccountService:
     # ----------------------
 
     @classmethod
-    def reset_password(cls, email: str):
+    async def reset_password(cls, email: str):
         """
         Reset password by user email address.
         """
         # TODO stop resend email until current otp not expired
         user: User | None
 
-        user = UserManager.get_user_or_404(email=email)
+        user = await UserManager.get_user_or_404(email=email)
         UserManager.is_active(user)
         UserManager.is_verified_email(user)
 
         token = TokenService(user.id)
-        token.reset_is_reset_password()
+        await token.reset_is_reset_password()
 
         EmailService.reset_password_send_verification_email(user.email)
 
         return {'message': 'Please check your email for an OTP code to confirm the password reset request.'}
 
     @classmethod
-    def verify_reset_password(cls, email: str, password: str, otp: str):
+    async def verify_reset_password(cls, email: str, password: str, otp: str):
         """
         Verify the request for reset password and if otp is valid then current access-token will expire.
         """
 
-        user = UserManager.get_user_or_404(email=email)
+        user = await UserManager.get_user_or_404(email=email)
         token = TokenService(user.id)
 
         if not token.validate_otp_token(otp):
@@ -179,37 +183,38 @@ class AccountService:
                 detail="Invalid OTP code.Please double-check and try again."
             )
 
-        UserManager.update_user(user.id, password=password)
-        token.reset_otp_token_type()
-        token.reset_access_token()
+        await UserManager.update_user(user.id, password=password)
+        await token.reset_otp_token_type()
+        await token.reset_access_token()
         # TODO send an email and notice user the password is changed.
 
         return {'message': 'Your password has been changed.'}
 
     @classmethod
-    def change_password(cls, user: User, current_password: str, password: str):
+    async def change_password(cls, user: User, current_password: str, password: str):
         """
         Change password for current user, and then current access-token will be expired.
         """
 
-        if not PasswordManager.verify_password(current_password, user.password):
+        is_valid, _ = await PasswordManager.averify_password(current_password, user.password)
+        if not is_valid:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect password.")
 
-        UserManager.update_user(user.id, password=password)
-        TokenService(user.id).reset_access_token()
+        await UserManager.update_user(user.id, password=password)
+        await TokenService(user.id).reset_access_token()
 
         return {'message': 'Your password has been changed.'}
 
     @classmethod
-    def change_email(cls, user, new_email):
+    async def change_email(cls, user, new_email):
         """
         Change password for current user.
         """
 
         # Check if the new email address is not already associated with another user
-        if UserManager.get_user(email=new_email) is None:
+        if await UserManager.get_user(email=new_email) is None:
 
-            TokenService(user.id).request_is_change_email(new_email)
+            await TokenService(user.id).request_is_change_email(new_email)
             EmailService.change_email_send_verification_email(new_email)
 
         else:
@@ -219,7 +224,7 @@ class AccountService:
             'message': f'Please check your email "{new_email}" for an OTP code to confirm the change email request.'}
 
     @classmethod
-    def verify_change_email(cls, user, otp):
+    async def verify_change_email(cls, user, otp):
         """
         Verify change password for current user.
         """
@@ -227,11 +232,11 @@ class AccountService:
         token = TokenService(user.id)
 
         if token.validate_otp_token(otp):
-            new_email = token.get_new_email()
+            new_email = await token.get_new_email()
 
             if new_email:
-                UserManager.update_user(user.id, email=new_email)
-                token.reset_is_change_email()
+                await UserManager.update_user(user.id, email=new_email)
+                await token.reset_is_change_email()
             else:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
@@ -244,23 +249,23 @@ class AccountService:
         return {'message': 'Your email is changed.'}
 
     @classmethod
-    def resend_otp(cls, request_type: str, email: str):
+    async def resend_otp(cls, request_type: str, email: str):
         """
         Resend OTP for registration, password reset, or email change verification.
         """
 
-        user = UserManager.get_user_or_404(email=email)
+        user = await UserManager.get_user_or_404(email=email)
         token = TokenService(user.id)
 
         # --- validate current request type ---
-        current_request_type = token.get_otp_request_type()
+        current_request_type = await token.get_otp_request_type()
         if current_request_type != request_type:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Current requested type is invalid.")
 
         if current_request_type == 'change_email':
-            email = token.get_new_email()
+            email = await token.get_new_email()
 
         # --- resend new OTP ---
         token.check_time_remaining()
@@ -273,7 +278,7 @@ class AccountService:
                 EmailService.reset_password_send_verification_email(email)
 
     @classmethod
-    def logout(cls, current_user):
-        TokenService(current_user).reset_access_token()
+    async def logout(cls, current_user):
+        await TokenService(current_user).reset_access_token()
 
 # TODO add a sessions service to manage sections like telegram app (Devices).
@@ -1,12 +1,17 @@
+import asyncio
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 from fastapi import HTTPException
 from passlib.context import CryptContext
 from starlette import status
 
+from apps.core.services.metrics import password_hashing_calls
+from config.settings import PASSWORD_HASHING
+
 
 class PasswordManager:
-    password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    password_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=PASSWORD_HASHING['rounds'])
     min_length: int = 8
     max_length: int = 24
 
@@ -74,3 +79,64 @@ class PasswordManager:
     @classmethod
     def verify_password(cls, plain_password: str, hashed_password: str):
         return cls.password_context.verify(plain_password, hashed_password)
+
+    # -----------------------------
+    # --- Hash Password (async) ---
+    # -----------------------------
+
+    """
+    Hashing a password with bcrypt takes ~100-300 ms of CPU: in an async handler, it would block all the other
+    requests of the worker. So the handlers hash and verify the passwords in a dedicated pool of
+    `PASSWORD_HASHING['workers']` threads (bcrypt releases the GIL), off the event loop. The calls over the size of the
+    pool wait in its queue, see `stats`.
+    """
+
+    executor: ThreadPoolExecutor | None = None
+    pending: int = 0
+
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        if cls.executor is None:
+            cls.executor = ThreadPoolExecutor(max_workers=PASSWORD_HASHING['workers'],
+                                              thread_name_prefix='password-hashing')
+        return cls.executor
+
+    @classmethod
+    def stats(cls) -> dict:
+        """
+        The number of calls in the pool: running (at most one per worker), and waiting in the queue.
+        """
+
+        workers = PASSWORD_HASHING['workers']
+        return {'workers': workers, 'running': min(cls.pending, workers), 'queued': max(cls.pending - workers, 0)}
+
+    @classmethod
+    async def ahash_password(cls, password: str) -> str:
+        return await cls.__run(cls.password_context.hash, password)
+
+    @classmethod
+    async def averify_password(cls, plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+        """
+        Verify a password, and rehash it if its hash is outdated (e.g. `PASSWORD_HASHING['rounds']` changed).
+
+        Returns:
+            Whether the password is valid, and its new hash (to be saved) or None if the hash is up-to-date.
+        """
+
+        return await cls.__run(cls.password_context.verify_and_update, plain_password, hashed_password)
+
+    @classmethod
+    async def __run(cls, func, *args):
+        cls.pending += 1
+        cls.__export_stats()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(cls.get_executor(), func, *args)
+        finally:
+            cls.pending -= 1
+            cls.__export_stats()
+
+    @classmethod
+    def __export_stats(cls):
+        stats = cls.stats()
+        password_hashing_calls.labels('running').set(stats['running'])
+        password_hashing_calls.labels('queued').set(stats['queued'])
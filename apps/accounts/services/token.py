@@ -1,3 +1,4 @@
+import uuid
 from datetime import timedelta, datetime
 
 from fastapi import HTTPException, status
@@ -45,11 +46,13 @@ class TokenService:
     A user's access token will be expired due to actions such as "resetting the password," "changing the password," or
     even "logging out" (logout mechanism).
 
-    The `access-token` stored in the database serves as a flag for the logout mechanism, ensuring that when a user
-    wants to log out of the system, the current token will no longer be valid.
+    Each token carries the `token_version` of its user (the `ver` claim) and a unique id (`jti`). Logging in, logging
+    out or changing the password increments the version, so the tokens issued before are no longer valid. The users
+    are read from an in-process cache (`UserManager.get_cached_user`), so checking a token usually doesn't query the
+    database. The last issued token is still saved in `UserVerification.active_access_token`, for reference.
     """
 
-    def create_access_token(self) -> str:
+    async def create_access_token(self) -> str:
         """
         Create a new access token for the provided user.
 
@@ -57,8 +60,9 @@ class TokenService:
             str: Access token string.
         """
 
-        # --- set data to encode ---
-        to_encode = {'user_id': self.user_id}
+        # --- set data to encode (a new version revokes the tokens issued before) ---
+        version = await UserManager.increment_token_version(self.user_id)
+        to_encode = {'user_id': self.user_id, 'ver': version, 'jti': uuid.uuid4().hex}
 
         # --- set expire date ---
         to_encode.update({"exp": datetime.utcnow() + timedelta(self.app_config.access_token_expire_minutes)})
@@ -66,16 +70,17 @@ class TokenService:
         # --- generate access token ---
         access_token = jwt.encode(to_encode, self.app_config.secret_key, algorithm=self.ALGORITHM)
 
-        self.update_access_token(access_token)
+        await self.update_access_token(access_token)
         return access_token
 
-    def update_access_token(self, token: str):
-        UserVerification.update(UserVerification.filter(UserVerification.user_id == self.user_id).first().id,
-                                active_access_token=token)
+    async def update_access_token(self, token: str):
+        _change = await UserVerification.afirst(UserVerification.user_id == self.user_id)
+        await UserVerification.aupdate(_change.id, active_access_token=token)
 
-    def reset_access_token(self):
-        UserVerification.update(UserVerification.filter(UserVerification.user_id == self.user_id).first().id,
-                                active_access_token=None)
+    async def reset_access_token(self):
+        await UserManager.increment_token_version(self.user_id)
+        _change = await UserVerification.afirst(UserVerification.user_id == self.user_id)
+        await UserVerification.aupdate(_change.id, active_access_token=None)
 
     @classmethod
     async def fetch_user(cls, token: str) -> User:
@@ -97,20 +102,17 @@ class TokenService:
 
         # --- validate payloads in token ---
         user_id = payload.get("user_id")
-        if user_id is None:
+        version = payload.get("ver")
+        if user_id is None or version is None:
             raise cls.credentials_exception
 
-        # --- get user ---
-        # TODO move user data to token and dont fetch them from database
-        user = UserManager.get_user(user_id)
+        # --- get user (usually from the cache) ---
+        user = await UserManager.get_cached_user(user_id)
         if user is None:
             raise cls.credentials_exception
 
-        UserManager.is_active(user)
-
-        # --- validate access token ---
-        active_access_token = UserVerification.filter(UserVerification.user_id == user_id).first().active_access_token
-        if token != active_access_token:
+        # --- validate access token: it's revoked once the version of the user is incremented ---
+        if version != user.token_version:
             raise cls.credentials_exception
 
         UserManager.is_active(user)
@@ -125,41 +127,41 @@ class TokenService:
         totp = TOTP(cls.app_config.otp_secret_key, interval=cls.app_config.otp_expire_seconds)
         return totp.now()
 
-    def request_is_register(self):
+    async def request_is_register(self):
         """
         Will be used just when a new user is registered.
         """
 
-        UserVerification.create(user_id=self.user_id, request_type='register')
+        await UserVerification.acreate(user_id=self.user_id, request_type='register')
 
-    def get_new_email(self):
-        _change: UserVerification = UserVerification.filter(UserVerification.user_id == self.user_id).first()
+    async def get_new_email(self):
+        _change: UserVerification = await UserVerification.afirst(UserVerification.user_id == self.user_id)
         if _change.request_type == 'change-email':
             return _change.new_email
         return False
 
-    def request_is_change_email(self, new_email: str):
-        _change = UserVerification.filter(UserVerification.user_id == self.user_id).first().id
-        UserVerification.update(_change, new_email=new_email, request_type='change-email')
+    async def request_is_change_email(self, new_email: str):
+        _change = (await UserVerification.afirst(UserVerification.user_id == self.user_id)).id
+        await UserVerification.aupdate(_change, new_email=new_email, request_type='change-email')
 
-    def reset_is_change_email(self):
-        _change = UserVerification.filter(UserVerification.user_id == self.user_id).first().id
-        UserVerification.update(_change, new_email=None, request_type=None)
+    async def reset_is_change_email(self):
+        _change = (await UserVerification.afirst(UserVerification.user_id == self.user_id)).id
+        await UserVerification.aupdate(_change, new_email=None, request_type=None)
 
-    def reset_is_reset_password(self):
-        _change = UserVerification.filter(UserVerification.user_id == self.user_id).first().id
-        UserVerification.update(_change, request_type='reset-password')
+    async def reset_is_reset_password(self):
+        _change = (await UserVerification.afirst(UserVerification.user_id == self.user_id)).id
+        await UserVerification.aupdate(_change, request_type='reset-password')
 
-    def reset_otp_token_type(self):
+    async def reset_otp_token_type(self):
         """
         Remove the request_type for otp token by set it to None.
         """
 
-        _change = UserVerification.filter(UserVerification.user_id == self.user_id).first().id
-        UserVerification.update(_change, request_type=None)
+        _change = (await UserVerification.afirst(UserVerification.user_id == self.user_id)).id
+        await UserVerification.aupdate(_change, request_type=None)
 
-    def get_otp_request_type(self):
-        return UserVerification.filter(UserVerification.user_id == self.user_id).first().request_type
+    async def get_otp_request_type(self):
+        return (await UserVerification.afirst(UserVerification.user_id == self.user_id)).request_type
 
     @classmethod
     def validate_otp_token(cls, token: str):
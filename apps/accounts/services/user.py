@@ -1,20 +1,29 @@
+from datetime import datetime
+
 from fastapi import HTTPException
+from sqlalchemy import update, DateTime as DateTimeType
 from starlette import status
 
 from apps.accounts.models import User
 from apps.accounts.services.password import PasswordManager
 from apps.core.date_time import DateTime
+from apps.core.services.cache import InMemoryCache
+from config.database import DatabaseManager
+from config.settings import AUTH_CACHE
 
 
 class UserManager:
 
+    # the authenticated users, see `get_cached_user`
+    cache = InMemoryCache(ttl=AUTH_CACHE['ttl'], max_entries=AUTH_CACHE['max_entries'])
+
     @classmethod
-    def create_user(cls, email: str, password: str, first_name: str | None = None, last_name: str | None = None,
+    async def create_user(cls, email: str, password: str, first_name: str | None = None, last_name: str | None = None,
                     is_verified_email: bool = False, is_active: bool = False, is_superuser: bool = False,
                     role: str = 'user', updated_at: DateTime = None, last_login: DateTime = None):
         user_data = {
             "email": email,
-            "password": PasswordManager.hash_password(password),
+            "password": await PasswordManager.ahash_password(password),
             "first_name": first_name,
             "last_name": last_name,
             "is_verified_email": is_verified_email,
@@ -24,11 +33,11 @@ class UserManager:
             "updated_at": updated_at,
             "last_login": last_login
         }
-        user = User.create(**user_data)
+        user = await User.acreate(**user_data)
         return user
 
     @staticmethod
-    def get_user(user_id: int | None = None, email: str = None) -> User | None:
+    async def get_user(user_id: int | None = None, email: str = None) -> User | None:
         """
         Retrieve a user based on their ID or email address.
 
@@ -41,9 +50,9 @@ class UserManager:
                          or None if no user is found.
         """
         if user_id:
-            user = User.get(user_id)
+            user = await User.aget(user_id)
         elif email:
-            user = User.filter(User.email == email).first()
+            user = await User.afirst(User.email == email)
         else:
             return None
 
@@ -53,19 +62,19 @@ class UserManager:
         return user
 
     @staticmethod
-    def get_user_or_404(user_id: int | None = None, email: str = None):
+    async def get_user_or_404(user_id: int | None = None, email: str = None):
         user: User | None = None
         if user_id:
-            user = User.get_or_404(user_id)
+            user = await User.aget_or_404(user_id)
         elif email:
-            user = User.filter(User.email == email).first()
+            user = await User.afirst(User.email == email)
             if not user:
                 raise HTTPException(status_code=404, detail="User not found.")
 
         return user
 
     @classmethod
-    def update_user(cls, user_id: int, email: str | None = None, password: str | None = None,
+    async def update_user(cls, user_id: int, email: str | None = None, password: str | None = None,
                     first_name: str | None = None, last_name: str | None = None, is_verified_email: bool | None = None,
                     is_active: bool | None = None, is_superuser: bool | None = None, role: str | None = None,
                     last_login: DateTime | None = None):
@@ -85,7 +94,7 @@ class UserManager:
             user_data["email"] = email
 
         if password is not None:
-            user_data["password"] = PasswordManager.hash_password(password)
+            user_data["password"] = await PasswordManager.ahash_password(password)
 
         if is_verified_email is not None:
             user_data["is_verified_email"] = is_verified_email
@@ -102,14 +111,85 @@ class UserManager:
         if last_login is not None:
             user_data["last_login"] = last_login
 
-        return User.update(user_id, **user_data)
+        user = await User.aupdate(user_id, **user_data)
+        await cls.invalidate_cached_user(user_id)
+        return user
+
+    @classmethod
+    async def update_password_hash(cls, user_id: int, hashed_password: str):
+        """
+        Replace the hash of a user's password (e.g. it was hashed with an older cost), the password doesn't change.
+        """
+        await User.aupdate(user_id, password=hashed_password)
+        await cls.invalidate_cached_user(user_id)
 
     @classmethod
-    def update_last_login(cls, user_id: int):
+    async def update_last_login(cls, user_id: int):
         """
         Update user's last login.
         """
-        User.update(user_id, last_login=DateTime.now())
+        await User.aupdate(user_id, last_login=DateTime.now())
+        await cls.invalidate_cached_user(user_id)
+
+    # -------------------------
+    # --- Cached Users (auth) ---
+    # -------------------------
+
+    @classmethod
+    async def get_cached_user(cls, user_id: int) -> User | None:
+        """
+        Get a user for the authentication of a request, from the in-process cache if possible (no query).
+
+        The cached user is a copy detached from any session: it can be read, not changed or refreshed.
+        """
+
+        cached = await cls.cache.get(cls.__cache_key(user_id))
+        if cached is not None:
+            return cls.__from_snapshot(cached)
+
+        user = await User.aget(user_id)
+        if user is not None:
+            await cls.cache.set(cls.__cache_key(user_id), cls.__to_snapshot(user))
+        return user
+
+    @classmethod
+    async def invalidate_cached_user(cls, user_id: int):
+        await cls.cache.delete(cls.__cache_key(user_id))
+
+    @classmethod
+    async def increment_token_version(cls, user_id: int) -> int:
+        """
+        Revoke the access tokens of a user, and return the version of the next ones.
+        """
+
+        async with DatabaseManager.get_async_session() as session:
+            version = await session.scalar(
+                update(User)
+                .where(User.id == user_id)
+                .values(token_version=User.token_version + 1)
+                .returning(User.token_version))
+            await session.commit()
+        await cls.invalidate_cached_user(user_id)
+        return version
+
+    @staticmethod
+    def __cache_key(user_id: int) -> str:
+        return f'user:{user_id}'
+
+    @staticmethod
+    def __to_snapshot(user: User) -> dict:
+        snapshot = {}
+        for column in User.__table__.columns:
+            value = getattr(user, column.name)
+            snapshot[column.name] = value.isoformat() if isinstance(value, datetime) else value
+        return snapshot
+
+    @staticmethod
+    def __from_snapshot(snapshot: dict) -> User:
+        for column in User.__table__.columns:
+            if isinstance(column.type, DateTimeType) and snapshot[column.name] is not None:
+                snapshot[column.name] = datetime.fromisoformat(snapshot[column.name])
+        return User(**snapshot)
 
     @staticmethod
     def to_dict(user: User):
@@ -129,8 +209,8 @@ class UserManager:
         return _dict
 
     @classmethod
-    def new_user(cls, **user_data):
-        return User.create(**user_data)
+    async def new_user(cls, **user_data):
+        return await User.acreate(**user_data)
 
     @staticmethod
     def is_active(user: User):
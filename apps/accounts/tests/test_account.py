@@ -1,10 +1,15 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
+from passlib.context import CryptContext
 from fastapi import status
 from fastapi.testclient import TestClient
 
 from apps.accounts.faker.data import FakeAccount, FakeUser
 from apps.accounts.models import UserVerification
 from apps.accounts.services.authenticate import AccountService
+from apps.accounts.services import password as password_module
 from apps.accounts.services.password import PasswordManager
 from apps.accounts.services.token import TokenService
 from apps.accounts.services.user import UserManager
@@ -26,6 +31,7 @@ class AccountTestBase(BaseTestCase):
     def setup_class(cls):
         cls.client = TestClient(app)
         DatabaseManager.create_test_database()
+        asyncio.run(UserManager.cache.clear())
 
     @classmethod
     def teardown_class(cls):
@@ -54,7 +60,7 @@ class TestRegisterAccount(AccountTestBase):
         assert expected['email'] == payload['email']
         assert expected['message'] == 'Please check your email for an OTP code to confirm your email address.'
 
-        expected_user = UserManager.get_user(email=payload['email'])
+        expected_user = asyncio.run(UserManager.get_user(email=payload['email']))
         assert expected_user is not None
         assert expected_user.id > 0
 
@@ -72,13 +78,28 @@ class TestRegisterAccount(AccountTestBase):
         assert expected_user.last_login is None
         self.assert_datetime_format(expected_user.date_joined)
 
+    def test_register_query_budget(self):
+        """
+        Test register a user stays within its query budget.
+        """
+
+        payload = {
+            'email': FakeAccount.random_email(),
+            'password': FakeAccount.password,
+            'password_confirm': FakeAccount.password
+        }
+
+        with self.assert_max_queries(5, warn_repeated=True):
+            response = self.client.post(self.register_endpoint, json=payload)
+        assert response.status_code == status.HTTP_201_CREATED
+
     def test_successful_verify_registration(self):
         """
         Test activating the account after verifying the OTP code (verify email).
         """
 
         # --- register a user ---
-        email, otp = FakeAccount.register_unverified()
+        email, otp = asyncio.run(FakeAccount.register_unverified())
 
         # --- payload ---
         verify_payload = {
@@ -96,7 +117,7 @@ class TestRegisterAccount(AccountTestBase):
         assert expected['access_token'] is not None
         assert expected['message'] == 'Your email address has been confirmed. Account activated successfully.'
 
-        expected_user = UserManager.get_user(email=email)
+        expected_user = asyncio.run(UserManager.get_user(email=email))
 
         assert expected_user is not None
         assert expected_user.id > 0
@@ -124,7 +145,7 @@ class TestRegisterAccount(AccountTestBase):
         Test register a new user with an existing verified email address.
         """
 
-        user, _ = FakeAccount.verified_registration()
+        user, _ = asyncio.run(FakeAccount.verified_registration())
         payload = {
             'email': user.email,
             'password': FakeAccount.password,
@@ -137,7 +158,7 @@ class TestRegisterAccount(AccountTestBase):
         """
         Test register a new user with an existing unverified email address.
         """
-        emai, _ = FakeAccount.register_unverified()
+        emai, _ = asyncio.run(FakeAccount.register_unverified())
         payload = {
             'email': emai,
             'password': FakeAccount.password,
@@ -164,7 +185,7 @@ class TestRegisterAccount(AccountTestBase):
         """
 
         # --- register a user ---
-        email, otp = FakeAccount.register_unverified()
+        email, otp = asyncio.run(FakeAccount.register_unverified())
 
         # --- payload ---
         verify_payload = {
@@ -262,7 +283,7 @@ class TestRegisterAccount(AccountTestBase):
         """
         Test register a new user with invalid password.
         """
-        invalid_otp['email'] = FakeAccount.register_unverified()
+        invalid_otp['email'] = asyncio.run(FakeAccount.register_unverified())
         response = self.client.post(self.register_endpoint, json=invalid_otp)
         assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
 
@@ -274,7 +295,7 @@ class TestLoginAccount(AccountTestBase):
         """
 
         # --- register and verify a user ---
-        user, _ = FakeAccount.verified_registration()
+        user, _ = asyncio.run(FakeAccount.verified_registration())
         payload = {
             'username': user.email,
             'password': FakeAccount.password
@@ -289,16 +310,31 @@ class TestLoginAccount(AccountTestBase):
         assert expected_login['access_token'] is not None
         assert expected_login['token_type'] == 'bearer'
 
-        expected_user = UserManager.get_user(email=user.email)
+        expected_user = asyncio.run(UserManager.get_user(email=user.email))
         self.assert_datetime_format(expected_user.last_login)
 
+    def test_login_query_budget(self):
+        """
+        Test login stays within its query budget.
+        """
+
+        user, _ = asyncio.run(FakeAccount.verified_registration())
+        payload = {
+            'username': user.email,
+            'password': FakeAccount.password
+        }
+
+        with self.assert_max_queries(9, warn_repeated=True):
+            response = self.client.post(self.login_endpoint, data=payload)
+        assert response.status_code == status.HTTP_200_OK
+
     def test_login_with_incorrect_password(self):
         """
         Test login with incorrect password.
         """
 
         # --- register and verify a user ---
-        user, _ = FakeAccount.verified_registration()
+        user, _ = asyncio.run(FakeAccount.verified_registration())
         payload = {
             'username': user.email,
             'password': FakeAccount.password + "t"
@@ -314,7 +350,7 @@ class TestLoginAccount(AccountTestBase):
         """
 
         # --- register and verify a user ---
-        email, _ = FakeAccount.register_unverified()
+        email, _ = asyncio.run(FakeAccount.register_unverified())
         payload = {
             'username': email,
             'password': FakeAccount.password
@@ -330,7 +366,7 @@ class TestLoginAccount(AccountTestBase):
         """
 
         # --- register and verify a user ---
-        email, _ = FakeAccount.register_unverified()
+        email, _ = asyncio.run(FakeAccount.register_unverified())
         payload = {
             'username': email,
             'password': FakeAccount.password
@@ -346,7 +382,7 @@ class TestLoginAccount(AccountTestBase):
         """
 
         # --- create a user ---
-        user, access_token = FakeUser.populate_user()
+        user, access_token = asyncio.run(FakeUser.populate_user())
         header = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
@@ -361,7 +397,7 @@ class TestLoginAccount(AccountTestBase):
         """
 
         # --- create a user ---
-        user, access_token = FakeUser.populate_user()
+        user, access_token = asyncio.run(FakeUser.populate_user())
 
         # --- request ---
         passwords = {
@@ -369,8 +405,8 @@ class TestLoginAccount(AccountTestBase):
             'new_password': FakeUser.password + "test"
         }
 
-        AccountService.change_password(user=user, current_password=passwords['old_password'],
-                                       password=passwords['new_password'])
+        asyncio.run(AccountService.change_password(user=user, current_password=passwords['old_password'],
+                                       password=passwords['new_password']))
 
         # --- login with old password ---
         old_password = {
@@ -394,14 +430,14 @@ class TestLoginAccount(AccountTestBase):
         """
 
         # --- create a user ---
-        user, access_token = FakeUser.populate_user()
+        user, access_token = asyncio.run(FakeUser.populate_user())
 
         # --- request ---
         new_password = FakeUser.password + "test"
 
-        AccountService.reset_password(email=user.email)
-        AccountService.verify_reset_password(email=user.email, password=new_password,
-                                             otp=TokenService.create_otp_token())
+        asyncio.run(AccountService.reset_password(email=user.email))
+        asyncio.run(AccountService.verify_reset_password(email=user.email, password=new_password,
+                                             otp=TokenService.create_otp_token()))
 
         # --- login with old password ---
         old_password = {
@@ -447,7 +483,7 @@ class TestResetPassword(AccountTestBase):
         """
 
         # --- create a user ---
-        user, _ = FakeUser.populate_user()
+        user, _ = asyncio.run(FakeUser.populate_user())
 
         # --- request ---
         payload = {
@@ -466,11 +502,11 @@ class TestResetPassword(AccountTestBase):
         """
 
         # --- create a user ---
-        fake_user, access_token = FakeUser.populate_user()
+        fake_user, access_token = asyncio.run(FakeUser.populate_user())
 
         # --- set a reset request ---
-        AccountService.reset_password(fake_user.email)
-        user = UserManager.get_user(fake_user.id)
+        asyncio.run(AccountService.reset_password(fake_user.email))
+        user = asyncio.run(UserManager.get_user(fake_user.id))
         old_password = user.password
 
         # --- request ---
@@ -487,7 +523,7 @@ class TestResetPassword(AccountTestBase):
         expected = response.json()
         assert expected['message'] == 'Your password has been changed.'
 
-        expected_user = UserManager.get_user(user.id)
+        expected_user = asyncio.run(UserManager.get_user(user.id))
         assert PasswordManager.verify_password(payload['password'], expected_user.password) is True
         self.assert_datetime_format(expected_user.updated_at)
         self.assert_datetime_format(user.updated_at)
@@ -518,7 +554,7 @@ class TestResendOTP(AccountTestBase):
         """
 
         # --- register a user ---
-        email, _ = FakeAccount.register_unverified()
+        email, _ = asyncio.run(FakeAccount.register_unverified())
 
         # --- request for resend an OTP ---
         payload = {
@@ -535,11 +571,11 @@ class TestResendOTP(AccountTestBase):
         """
 
         # --- register a user ---
-        user, access_token = FakeUser.populate_user()
+        user, access_token = asyncio.run(FakeUser.populate_user())
         new_email = FakeUser.random_email()
 
         # --- set a change email request ---
-        AccountService.change_email(user, new_email)
+        asyncio.run(AccountService.change_email(user, new_email))
 
         # --- request for resend an OTP ---
         payload = {
@@ -556,10 +592,10 @@ class TestResendOTP(AccountTestBase):
         """
 
         # --- register a user ---
-        user, access_token = FakeUser.populate_user()
+        user, access_token = asyncio.run(FakeUser.populate_user())
 
         # --- set a reset request ---
-        AccountService.reset_password(user.email)
+        asyncio.run(AccountService.reset_password(user.email))
 
         # --- request for resend an OTP ---
         payload = {
@@ -577,11 +613,11 @@ class TestResendOTP(AccountTestBase):
         """
 
         # --- register a user ---
-        user, access_token = FakeUser.populate_user()
+        user, access_token = asyncio.run(FakeUser.populate_user())
         new_email = FakeUser.random_email()
 
         # --- set a change email request ---
-        AccountService.change_email(user, new_email)
+        asyncio.run(AccountService.change_email(user, new_email))
 
         # --- request for resend an OTP ---
         payload = {
@@ -599,10 +635,10 @@ class TestResendOTP(AccountTestBase):
         """
 
         # --- register a user ---
-        user, access_token = FakeUser.populate_user()
+        user, access_token = asyncio.run(FakeUser.populate_user())
 
         # --- set a reset request ---
-        AccountService.reset_password(user.email)
+        asyncio.run(AccountService.reset_password(user.email))
 
         # --- request for resend an OTP ---
         payload = {
@@ -629,3 +665,69 @@ class TestResendOTP(AccountTestBase):
 # TODO tests needs to expired time:
 #  1. JWT `ACCESS_TOKEN_EXPIRE_MINUTES`
 #  2. resend-otp (register, reset-password, change-email)
+
+
+class TestPasswordHashing(AccountTestBase):
+    login_endpoint = "/accounts/login/"
+
+    @pytest.mark.asyncio
+    async def test_hashing_does_not_block_event_loop(self):
+        """
+        Test the event loop keeps serving other tasks while passwords are hashed.
+        """
+
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        task = asyncio.create_task(ticker())
+        hashed_password = await PasswordManager.ahash_password(FakeUser.password)
+        is_valid, new_hash = await PasswordManager.averify_password(FakeUser.password, hashed_password)
+        task.cancel()
+
+        assert is_valid is True
+        assert new_hash is None
+        assert ticks > 2
+        assert PasswordManager.verify_password(FakeUser.password, hashed_password) is True
+
+    @pytest.mark.asyncio
+    async def test_queue_depth(self, monkeypatch):
+        """
+        Test the calls over the size of the pool are reported as queued.
+        """
+
+        monkeypatch.setitem(password_module.PASSWORD_HASHING, 'workers', 1)
+        monkeypatch.setattr(PasswordManager, 'executor', ThreadPoolExecutor(max_workers=1))
+
+        tasks = [asyncio.create_task(PasswordManager.ahash_password(FakeUser.password)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert PasswordManager.stats() == {'workers': 1, 'running': 1, 'queued': 2}
+
+        await asyncio.gather(*tasks)
+        assert PasswordManager.stats() == {'workers': 1, 'running': 0, 'queued': 0}
+        PasswordManager.executor.shutdown()
+
+    def test_rehash_on_login(self):
+        """
+        Test the hash of a password is upgraded at login, once the cost of the hashes changed.
+        """
+
+        user, _ = asyncio.run(FakeAccount.verified_registration())
+        old_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4)
+        asyncio.run(UserManager.update_password_hash(user.id, old_context.hash(FakeAccount.password)))
+
+        response = self.client.post(self.login_endpoint,
+                                    data={'username': user.email, 'password': FakeAccount.password})
+        assert response.status_code == status.HTTP_200_OK
+
+        expected_user = asyncio.run(UserManager.get_user(user.id))
+        assert PasswordManager.password_context.needs_update(expected_user.password) is False
+        assert PasswordManager.verify_password(FakeAccount.password, expected_user.password) is True
+
+        # --- the hash isn't changed at each login ---
+        self.client.post(self.login_endpoint, data={'username': user.email, 'password': FakeAccount.password})
+        assert asyncio.run(UserManager.get_user(user.id)).password == expected_user.password
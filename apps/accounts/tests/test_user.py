@@ -1,5 +1,8 @@
+import asyncio
+
 from fastapi import status
 from fastapi.testclient import TestClient
+from jose import jwt
 
 from apps.accounts.faker.data import FakeUser
 from apps.accounts.models import UserVerification
@@ -10,6 +13,7 @@ from apps.accounts.services.user import UserManager
 from apps.core.base_test_case import BaseTestCase
 from apps.main import app
 from config.database import DatabaseManager
+from config.settings import AppConfig
 
 
 class UserTestBase(BaseTestCase):
@@ -23,6 +27,7 @@ class UserTestBase(BaseTestCase):
     def setup_class(cls):
         cls.client = TestClient(app)
         DatabaseManager.create_test_database()
+        asyncio.run(UserManager.cache.clear())
 
     @classmethod
     def teardown_class(cls):
@@ -37,7 +42,7 @@ class TestRetrieveUser(UserTestBase):
         """
 
         # --- create user and generate token ---
-        user, access_token = FakeUser.populate_user()
+        user, access_token = asyncio.run(FakeUser.populate_user())
         headers = {
             "Authorization": f"Bearer {access_token}"
         }
@@ -74,8 +79,8 @@ class TestRetrieveUser(UserTestBase):
         """
 
         # --- create an admin with access-token ---
-        admin, access_token = FakeUser.populate_admin()
-        user, _ = FakeUser.populate_user()
+        admin, access_token = asyncio.run(FakeUser.populate_admin())
+        user, _ = asyncio.run(FakeUser.populate_user())
         headers = {
             "Authorization": f"Bearer {access_token}"
         }
@@ -90,8 +95,8 @@ class TestRetrieveUser(UserTestBase):
         """
 
         # --- create user with access-token ---
-        user_1, access_token = FakeUser.populate_user()
-        user_2, _ = FakeUser.populate_user()
+        user_1, access_token = asyncio.run(FakeUser.populate_user())
+        user_2, _ = asyncio.run(FakeUser.populate_user())
         headers = {
             "Authorization": f"Bearer {access_token}"
         }
@@ -112,7 +117,7 @@ class TestUpdateUser(UserTestBase):
         """
 
         # --- create user ---
-        user, access_token = FakeUser.populate_user()
+        user, access_token = asyncio.run(FakeUser.populate_user())
         headers = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
@@ -148,7 +153,7 @@ class TestChanges(UserTestBase):
         """
 
         # --- create a user ---
-        user, access_token = FakeUser.populate_user()
+        user, access_token = asyncio.run(FakeUser.populate_user())
         header = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
@@ -168,7 +173,7 @@ class TestChanges(UserTestBase):
         assert expected['message'] == 'Your password has been changed.'
 
         # --- expected user data, ensure other info wasn't changed ---
-        expected_user = UserManager.get_user(user.id)
+        expected_user = asyncio.run(UserManager.get_user(user.id))
         assert PasswordManager.verify_password(payload['password'], expected_user.password) is True
         assert expected_user.email == user.email
         assert expected_user.is_verified_email is True
@@ -201,7 +206,7 @@ class TestChanges(UserTestBase):
         """
 
         # --- create a user ---
-        user, access_token = FakeUser.populate_user()
+        user, access_token = asyncio.run(FakeUser.populate_user())
 
         # --- request ---
         header = {
@@ -229,11 +234,11 @@ class TestChanges(UserTestBase):
         """
 
         # --- create a user ---
-        user, access_token = FakeUser.populate_user()
+        user, access_token = asyncio.run(FakeUser.populate_user())
         new_email = FakeUser.random_email()
 
         # --- set a change email request ---
-        AccountService.change_email(user, new_email)
+        asyncio.run(AccountService.change_email(user, new_email))
 
         # --- request ---
         header = {
@@ -252,7 +257,7 @@ class TestChanges(UserTestBase):
         assert expected['message'] == 'Your email is changed.'
 
         # --- expected user data, ensure other info wasn't changed ---
-        expected_user = UserManager.get_user(user.id)
+        expected_user = asyncio.run(UserManager.get_user(user.id))
         assert expected_user.email == new_email
         assert expected_user.is_verified_email is True
         assert expected_user.role == user.role
@@ -279,3 +284,85 @@ class TestChanges(UserTestBase):
         # ---------------------
         # --- Test Payloads ---
         # ---------------------
+
+
+class TestAuthenticationCache(UserTestBase):
+    logout_endpoint = "/accounts/logout/"
+
+    def test_authenticated_request_without_queries(self):
+        """
+        Test the user of a token is fetched from the cache: an authenticated request doesn't query the database.
+        """
+
+        user, access_token = asyncio.run(FakeUser.populate_user())
+        header = {"Authorization": f"Bearer {access_token}"}
+
+        with self.assert_num_queries(1):
+            response = self.client.get(self.current_user_endpoint, headers=header)
+        assert response.status_code == status.HTTP_200_OK
+
+        with self.assert_num_queries(0):
+            response = self.client.get(self.current_user_endpoint, headers=header)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()['user']['email'] == user.email
+        assert response.json()['user']['date_joined'] == self.convert_datetime_to_string(user.date_joined)
+
+    def test_update_invalidates_cache(self):
+        """
+        Test the cached user is refreshed once the user is updated.
+        """
+
+        user, access_token = asyncio.run(FakeUser.populate_user())
+        header = {"Authorization": f"Bearer {access_token}"}
+        self.client.get(self.current_user_endpoint, headers=header)
+
+        asyncio.run(UserManager.update_user(user.id, first_name='Updated'))
+
+        response = self.client.get(self.current_user_endpoint, headers=header)
+        assert response.json()['user']['first_name'] == 'Updated'
+
+    def test_revoke_token_on_logout(self):
+        """
+        Test a cached token is revoked at once on logout.
+        """
+
+        user, access_token = asyncio.run(FakeUser.populate_user())
+        header = {"Authorization": f"Bearer {access_token}"}
+        assert self.client.get(self.current_user_endpoint, headers=header).status_code == status.HTTP_200_OK
+
+        response = self.client.post(self.logout_endpoint, headers=header)
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+
+        response = self.client.get(self.current_user_endpoint, headers=header)
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_new_token_revokes_old_one(self):
+        """
+        Test only the last token of a user is valid, and each token is unique.
+        """
+
+        user, old_access_token = asyncio.run(FakeUser.populate_user())
+        self.client.get(self.current_user_endpoint, headers={"Authorization": f"Bearer {old_access_token}"})
+
+        access_token = asyncio.run(TokenService(user.id).create_access_token())
+        assert access_token != old_access_token
+        payload = jwt.get_unverified_claims(access_token)
+        assert payload['ver'] == jwt.get_unverified_claims(old_access_token)['ver'] + 1
+        assert payload['jti']
+
+        response = self.client.get(self.current_user_endpoint, headers={"Authorization": f"Bearer {old_access_token}"})
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+        response = self.client.get(self.current_user_endpoint, headers={"Authorization": f"Bearer {access_token}"})
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_token_without_version(self):
+        """
+        Test a token without the `ver` claim (issued before the token versions) isn't valid.
+        """
+
+        user, _ = asyncio.run(FakeUser.populate_user())
+        app_config = AppConfig.get_config()
+        access_token = jwt.encode({'user_id': user.id}, app_config.secret_key, algorithm=TokenService.ALGORITHM)
+
+        response = self.client.get(self.current_user_endpoint, headers={"Authorization": f"Bearer {access_token}"})
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
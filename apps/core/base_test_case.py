@@ -1,10 +1,55 @@
+from contextlib import contextmanager
 from datetime import datetime
 
 from apps.core.date_time import DateTime
+from apps.core.query_counter import QueryCounter
 
 
 class BaseTestCase:
 
+    # ------------------------
+    # --- Query Assertions ---
+    # ------------------------
+
+    @staticmethod
+    def count_queries(warn_repeated: bool | None = None) -> QueryCounter:
+        """
+        Count the queries of a block, e.g. to check which statements it ran.
+
+        Usage:
+            with self.count_queries() as queries:
+                self.client.get('/products/1')
+        """
+
+        return QueryCounter() if warn_repeated is None else QueryCounter(warn_repeated=warn_repeated)
+
+    @classmethod
+    @contextmanager
+    def assert_max_queries(cls, max_queries: int, warn_repeated: bool | None = None):
+        """
+        Fail if a block (e.g. a request to an endpoint) runs more than `max_queries` queries: its query budget.
+        """
+
+        with cls.count_queries(warn_repeated) as queries:
+            yield queries
+        assert queries.count <= max_queries, \
+            f'{queries.count} queries, expected at most {max_queries}:\n{queries}'
+
+    @classmethod
+    @contextmanager
+    def assert_num_queries(cls, num_queries: int, warn_repeated: bool | None = None):
+        """
+        Fail if a block doesn't run exactly `num_queries` queries.
+        """
+
+        with cls.count_queries(warn_repeated) as queries:
+            yield queries
+        assert queries.count == num_queries, f'{queries.count} queries, expected {num_queries}:\n{queries}'
+
+    # ------------------
+    # --- Date Times ---
+    # ------------------
+
     @staticmethod
     def assert_datetime_format(date: str | datetime):
         if isinstance(date, datetime):
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timezone
 
 
 class DateTime:
@@ -25,4 +25,8 @@ class DateTime:
 
     @classmethod
     def now(cls):
-        return datetime.strptime(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), '%Y-%m-%d %H:%M:%S')
+        """
+        The current time in UTC, naive and truncated to seconds, like the `func.now()` defaults of the database.
+        """
+
+        return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
@@ -0,0 +1,66 @@
+import warnings
+from collections import Counter
+
+from sqlalchemy import event
+
+from config.database import DatabaseManager
+from config.settings import DEBUG_QUERIES
+
+
+class RepeatedQueryWarning(UserWarning):
+    """
+    The same statement ran many times in one unit of work (e.g. a request): probably an N+1 query.
+    """
+
+
+class QueryCounter:
+    """
+    Count the SQL statements run on the engines of `DatabaseManager` (sync and async) while it's open.
+
+    With `warn_repeated` (`settings.DEBUG_QUERIES` by default), it warns (`RepeatedQueryWarning`) on the statements
+    that ran more than once with the same SQL, e.g. a query per option of a product instead of one for all of them.
+
+    Usage:
+        with QueryCounter() as queries:
+            response = client.get('/products/1')
+        assert queries.count <= 3
+    """
+
+    def __init__(self, warn_repeated: bool = DEBUG_QUERIES):
+        self.warn_repeated = warn_repeated
+        self.statements: list[str] = []
+        self.__engines = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    @property
+    def repeated(self) -> dict[str, int]:
+        """
+        The statements that ran more than once (with the same SQL, whatever their parameters), and how many times.
+        """
+
+        return {statement: count for statement, count in Counter(self.statements).items() if count > 1}
+
+    def __enter__(self):
+        self.statements = []
+        self.__engines = [DatabaseManager.engine, DatabaseManager.async_engine.sync_engine]
+        for engine in self.__engines:
+            event.listen(engine, 'before_cursor_execute', self.__listener)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for engine in self.__engines:
+            event.remove(engine, 'before_cursor_execute', self.__listener)
+
+        if self.warn_repeated and exc_type is None:
+            for statement, count in self.repeated.items():
+                warnings.warn(f'The same statement ran {count} times (N+1 query?): {statement}',
+                              RepeatedQueryWarning, stacklevel=2)
+
+    def __listener(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __str__(self):
+        return '\n'.join(f'{index}. {statement}' for index, statement in enumerate(self.statements, start=1))
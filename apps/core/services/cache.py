@@ -0,0 +1,146 @@
+import json
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any
+
+from config import settings
+
+
+class BaseCache:
+    """
+    Interface of the cache backends.
+
+    Values are stored as JSON, so every backend returns a fresh copy of the cached value and the callers can change
+    it freely.
+    """
+
+    def __init__(self, ttl: int = 300):
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Any | None:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any, ttl: int | None = None):
+        raise NotImplementedError
+
+    async def delete(self, *keys: str):
+        raise NotImplementedError
+
+    async def clear(self):
+        raise NotImplementedError
+
+    @staticmethod
+    def dumps(value: Any) -> str:
+        return json.dumps(value, default=BaseCache.__default)
+
+    @staticmethod
+    def loads(value: str | bytes | None) -> Any | None:
+        return json.loads(value) if value is not None else None
+
+    @staticmethod
+    def __default(value):
+        if isinstance(value, Decimal):
+            return float(value)
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class InMemoryCache(BaseCache):
+    """
+    An LRU cache with a TTL, in the memory of the current process.
+
+    Each worker has its own copy, so it fits a single worker (development, tests) or data that can be a little stale.
+    """
+
+    def __init__(self, ttl: int = 300, max_entries: int = 1024):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    async def get(self, key: str) -> Any | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return self.loads(value)
+
+    async def set(self, key: str, value: Any, ttl: int | None = None):
+        self.entries[key] = (time.monotonic() + (ttl or self.ttl), self.dumps(value))
+        self.entries.move_to_end(key)
+
+        # evict the least recently used entries
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self.entries.pop(key, None)
+
+    async def clear(self):
+        self.entries.clear()
+
+
+class RedisCache(BaseCache):
+    """
+    A cache on a Redis server (or anything speaking its protocol), shared by all the workers.
+    """
+
+    def __init__(self, url: str | None = None, ttl: int = 300, prefix: str = 'fast-store:', client=None):
+        super().__init__(ttl)
+        if client is None:
+            from redis import asyncio as redis
+            client = redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Any | None:
+        return self.loads(await self.client.get(self.prefix + key))
+
+    async def set(self, key: str, value: Any, ttl: int | None = None):
+        await self.client.set(self.prefix + key, self.dumps(value), ex=ttl or self.ttl)
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.client.delete(*[self.prefix + key for key in keys])
+
+    async def clear(self):
+        keys = [key async for key in self.client.scan_iter(match=f'{self.prefix}*')]
+        if keys:
+            await self.client.delete(*keys)
+
+
+class CacheManager:
+    """
+    Give access to the cache backend configured by `settings.CACHES`.
+
+    Usage:
+        cache = CacheManager.get_backend()
+        await cache.set('key', {'some': 'value'})
+        value = await cache.get('key')
+    """
+
+    backend: BaseCache | None = None
+
+    @classmethod
+    def get_backend(cls) -> BaseCache:
+        if cls.backend is None:
+            config = settings.CACHES
+            if config['backend'] == 'redis':
+                cls.backend = RedisCache(url=config['url'], ttl=config['ttl'])
+            else:
+                cls.backend = InMemoryCache(ttl=config['ttl'], max_entries=config['max_entries'])
+        return cls.backend
+
+    @classmethod
+    def set_backend(cls, backend: BaseCache | None):
+        """
+        Replace the cache backend, e.g. in tests. With `None` the backend is built again from the settings.
+        """
+
+        cls.backend = backend
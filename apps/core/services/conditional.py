@@ -0,0 +1,98 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Request, status
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+from config import settings
+
+
+class ConditionalGet:
+    """
+    Answer the GET requests conditionally, with `ETag` / `Last-Modified` validators and `304 Not Modified`.
+
+    The ETag is a strong validator: the hash of the exact JSON body. So it changes with any field of the response,
+    including the `id`/`updated_at` of every nested variant or media, and not with anything else.
+
+    Usage (in a router):
+        content = {'product': product}
+        return ConditionalGet.response(
+            request, schemas.RetrieveProductOut, content, last_modified=ConditionalGet.latest(product))
+    """
+
+    @classmethod
+    def response(cls, request: Request, schema: type[BaseModel], content: dict, last_modified: datetime | None = None,
+                 cache_control: str | None = None) -> Response:
+        """
+        Serialize the content with its response schema and return it, or a `304` if the client's copy is fresh.
+        """
+
+        body = json.dumps(
+            schema.model_validate(content).model_dump(mode='json'), ensure_ascii=False, separators=(',', ':')
+        ).encode()
+
+        headers = {
+            'ETag': cls.etag(body),
+            'Cache-Control': cache_control or settings.HTTP_CACHE_CONTROL
+        }
+        if last_modified is not None:
+            headers['Last-Modified'] = format_datetime(last_modified, usegmt=True)
+
+        if cls.is_not_modified(request, headers['ETag'], last_modified):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(content=body, media_type='application/json', headers=headers)
+
+    @staticmethod
+    def etag(body: bytes) -> str:
+        return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+    @staticmethod
+    def is_not_modified(request: Request, etag: str, last_modified: datetime | None) -> bool:
+        """
+        Evaluate the `If-None-Match` and `If-Modified-Since` headers of the request (RFC 9110, 13.2.2).
+        """
+
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match is not None:
+            # weak comparison, and `If-Modified-Since` is ignored when `If-None-Match` is sent
+            tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags
+
+        if_modified_since = request.headers.get('if-modified-since')
+        if if_modified_since is not None and last_modified is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            return last_modified <= since
+
+        return False
+
+    @classmethod
+    def latest(cls, *items: dict | list | None) -> datetime | None:
+        """
+        The latest `created_at`/`updated_at` in the given dicts and lists of dicts, in UTC and truncated to seconds.
+        """
+
+        dates = []
+        for item in items:
+            for obj in (item if isinstance(item, list) else [item]):
+                if obj:
+                    dates += [obj.get('created_at'), obj.get('updated_at')]
+
+        dates = [cls.__utc(date) for date in dates if date]
+        return max(dates) if dates else None
+
+    @staticmethod
+    def __utc(date: str | datetime) -> datetime:
+        if isinstance(date, str):
+            date = datetime.strptime(date, '%Y-%m-%d %H:%M:%S')
+        # the database stores naive datetimes in UTC (see `DateTime.now`), `astimezone` would take them as local
+        if date.tzinfo is None:
+            return date.replace(tzinfo=timezone.utc, microsecond=0)
+        return date.astimezone(timezone.utc).replace(microsecond=0)
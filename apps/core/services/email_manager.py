@@ -1,10 +1,7 @@
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-
 from pytest_is_running import is_running
 
 from apps.accounts.services.token import TokenService
+from apps.core.services.email_queue import EmailQueueManager
 from config.settings import EmailServiceConfig, AppConfig
 
 
@@ -14,21 +11,8 @@ class EmailService:
 
     @classmethod
     def __send_email(cls, subject: str, body: str, to_address: str):
-        try:
-            message = MIMEMultipart()
-            message['From'] = cls.config.smtp_username
-            message['To'] = to_address
-            message['Subject'] = subject
-            message.attach(MIMEText(body, 'plain'))
-
-            # Connect to the SMTP server
-            with smtplib.SMTP_SSL(cls.config.smtp_server, cls.config.smtp_port) as server:
-                # server.set_debuglevel(1)
-                server.login(cls.config.smtp_username, cls.config.smtp_password)
-                server.sendmail(cls.config.smtp_username, to_address, message.as_string())
-                # server.quit()
-        except Exception as e:
-            print(f"An error occurred while sending email: {e}")
+        # --- the email is sent in the background, the request doesn't wait for the SMTP server ---
+        EmailQueueManager.get_queue().enqueue(to_address, subject, body)
 
     @classmethod
     def __print_test_otp(cls, otp: str):
@@ -0,0 +1,293 @@
+import asyncio
+import logging
+import smtplib
+import ssl
+import time
+from email.message import EmailMessage
+
+from starlette.concurrency import run_in_threadpool
+
+from config.settings import EMAIL_QUEUE, EmailServiceConfig
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPConnection:
+    """
+    An authenticated SMTP connection, kept open to send many emails: the TCP, TLS and SMTP handshakes and the login are
+    done once, not per email. It's blocking (`smtplib`), `EmailQueue` uses it in a thread.
+    """
+
+    def __init__(self, host: str, port: int, username: str | None = None, password: str | None = None,
+                 security: str = EMAIL_QUEUE['security'], timeout: float = EMAIL_QUEUE['timeout'],
+                 idle_timeout: float = EMAIL_QUEUE['idle_timeout']):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.security = security
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.server: smtplib.SMTP | None = None
+        self.last_used = 0.0
+
+    def connect(self):
+        if self.security == 'ssl':
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout, context=ssl.create_default_context())
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.security == 'starttls':
+                server.starttls(context=ssl.create_default_context())
+            if self.username:
+                server.login(self.username, self.password)
+        except (smtplib.SMTPException, OSError):
+            server.close()
+            raise
+        self.server = server
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            self.server.close()
+        self.server = None
+
+    def send(self, messages: list[EmailMessage]) -> dict[int, Exception]:
+        """
+        Send emails over the connection, (re)connecting if needed.
+
+        Returns:
+            The errors of the emails that couldn't be sent, by their index. An error of the connection itself stops the
+            batch: the remaining emails fail with it.
+        """
+
+        if self.server is not None and time.monotonic() - self.last_used > self.idle_timeout:
+            # the server has probably closed an idle connection already
+            self.close()
+
+        errors = {}
+        for index, message in enumerate(messages):
+            try:
+                self.__send(message)
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                # the server refused this email, the connection is still usable
+                errors[index] = e
+            except OSError as e:
+                # the SMTP errors are `OSError` too
+                self.close()
+                errors.update({i: e for i in range(index, len(messages))})
+                break
+        self.last_used = time.monotonic()
+        return errors
+
+    def __send(self, message: EmailMessage):
+        if self.server is None:
+            self.connect()
+        try:
+            self.server.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # a reused connection was closed by the server: connect again, once
+            self.close()
+            self.connect()
+            self.server.send_message(message)
+
+
+class EmailQueue:
+    """
+    Send the emails in the background, so a request handler only enqueues them (see `enqueue`).
+
+    A single task sends the queued emails in batches of up to `batch_size` over one reused SMTP connection. An email
+    that failed with a temporary error (e.g. the server is unreachable or answered 4xx) is retried after `backoff`,
+    `2 * backoff`, `4 * backoff`... seconds, up to `max_attempts` times; a permanent error (5xx) isn't retried.
+
+    The queue is in memory: the emails that aren't sent yet are lost if the process is killed, `close` sends them on a
+    graceful shutdown. The emails waiting for a retry are sent at once then, and not retried again, so a shutdown
+    doesn't wait through their backoff.
+
+    Usage:
+        queue = EmailQueue(SMTPConnection('smtp.example.com', 465, 'user', 'password'))
+        queue.enqueue(to_address, subject, body)
+        ...
+        await queue.close()
+    """
+
+    def __init__(self, connection: SMTPConnection, sender: str | None = None,
+                 batch_size: int = EMAIL_QUEUE['batch_size'],
+                 max_attempts: int = EMAIL_QUEUE['max_attempts'],
+                 backoff: float = EMAIL_QUEUE['backoff']):
+        self.connection = connection
+        self.sender = sender or connection.username
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.stats = {'sent': 0, 'retried': 0, 'failed': 0}
+        self.closing = False
+        self.__queue: asyncio.Queue | None = None
+        self.__worker: asyncio.Task | None = None
+        # the retries waiting for their backoff, with the email they queue again
+        self.__retries: dict[asyncio.Task, tuple[EmailMessage, int]] = {}
+        # the emails being sent by the worker
+        self.__batch: list[tuple[EmailMessage, int]] = []
+
+    def enqueue(self, to_address: str, subject: str, body: str):
+        """
+        Queue an email, from a coroutine. It doesn't wait: the email is sent in the background.
+        """
+
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = to_address
+        message['Subject'] = subject
+        message.set_content(body)
+        self.__put((message, 1))
+
+    async def join(self):
+        """
+        Wait until all the queued emails are sent (or failed), the retries included.
+        """
+
+        if self.__queue is not None:
+            await self.__queue.join()
+
+    async def close(self):
+        """
+        Send the queued emails, then stop the worker and close the SMTP connection.
+
+        The emails waiting for a retry are queued again at once, and an email that fails now isn't retried.
+        """
+
+        self.closing = True
+        for retry in self.__retries:
+            retry.cancel()
+        await self.join()
+        if self.__worker is not None:
+            self.__worker.cancel()
+            self.__worker = None
+        await run_in_threadpool(self.connection.close)
+        self.closing = False
+
+    def __put(self, item: tuple[EmailMessage, int]):
+        loop = asyncio.get_running_loop()
+        if self.__worker is None or self.__worker.done() or self.__worker.get_loop() is not loop:
+            # the worker is started with the first email of the event loop
+            self.__restart(loop)
+        self.__queue.put_nowait(item)
+
+    def __restart(self, loop: asyncio.AbstractEventLoop):
+        """
+        Start a worker (and its queue) on the event loop, the emails left by the worker of a previous loop (e.g. one
+        that was closed without `close`) are moved to the new queue.
+        """
+
+        pending = []
+        if self.__queue is not None:
+            while not self.__queue.empty():
+                pending.append(self.__queue.get_nowait())
+        # the retries won't queue their emails in the new queue, they're queued now
+        for retry, (message, attempt) in self.__retries.items():
+            pending.append((message, attempt + 1))
+            if not retry.get_loop().is_closed():
+                retry.cancel()
+        self.__retries.clear()
+        for message, _ in self.__batch:
+            # it may have been sent or not, it isn't sent again
+            logger.warning(f"The worker stopped while an email to {message['To']} was sent, it may be lost.")
+        self.__batch = []
+
+        self.__queue = asyncio.Queue()
+        for item in pending:
+            self.__queue.put_nowait(item)
+        self.__worker = loop.create_task(self.__work())
+
+    async def __work(self):
+        while True:
+            batch = [await self.__queue.get()]
+            while len(batch) < self.batch_size and not self.__queue.empty():
+                batch.append(self.__queue.get_nowait())
+
+            self.__batch = batch
+            try:
+                errors = await run_in_threadpool(self.connection.send, [message for message, _ in batch])
+            except Exception as e:
+                # e.g. the login was refused, the whole batch failed
+                errors = dict.fromkeys(range(len(batch)), e)
+            self.__batch = []
+
+            for index, (message, attempt) in enumerate(batch):
+                error = errors.get(index)
+                if error is None:
+                    self.stats['sent'] += 1
+                elif attempt < self.max_attempts and self.is_temporary(error) and not self.closing:
+                    self.stats['retried'] += 1
+                    retry = asyncio.create_task(asyncio.sleep(self.backoff * 2 ** (attempt - 1)))
+                    self.__retries[retry] = (message, attempt)
+                    retry.add_done_callback(self.__retried)
+                    continue
+                else:
+                    self.stats['failed'] += 1
+                    logger.error(f"An error occurred while sending email to {message['To']}: {error}")
+                self.__queue.task_done()
+
+    def __retried(self, retry: asyncio.Task):
+        """
+        Queue an email again once its backoff is over, or at once if it's cancelled by `close`.
+        """
+
+        item = self.__retries.pop(retry, None)
+        if item is None:
+            # already moved to the queue of another worker, see `__restart`
+            return
+        message, attempt = item
+        self.__queue.put_nowait((message, attempt + 1))
+        # the email was unfinished until it's queued again, see `join`
+        self.__queue.task_done()
+
+    @staticmethod
+    def is_temporary(error: Exception) -> bool:
+        """
+        Whether sending an email again may succeed: the SMTP errors with a 4xx code, and the connection errors.
+        """
+
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            return all(400 <= code < 500 for code, _ in error.recipients.values())
+        if isinstance(error, smtplib.SMTPResponseException):
+            return 400 <= error.smtp_code < 500
+        # a connection error (the SMTP errors without a code are `OSError` too)
+        return isinstance(error, OSError)
+
+
+class EmailQueueManager:
+    """
+    Give access to the email queue of the SMTP server configured by `EmailServiceConfig`.
+    """
+
+    queue: EmailQueue | None = None
+
+    @classmethod
+    def get_queue(cls) -> EmailQueue:
+        if cls.queue is None:
+            config = EmailServiceConfig.get_config()
+            connection = SMTPConnection(config.smtp_server, config.smtp_port, config.smtp_username,
+                                        config.smtp_password)
+            cls.queue = EmailQueue(connection)
+        return cls.queue
+
+    @classmethod
+    def set_queue(cls, queue: EmailQueue | None):
+        """
+        Replace the email queue, e.g. in tests. With `None` the queue is built again from the settings.
+        """
+
+        cls.queue = queue
+
+    @classmethod
+    async def close(cls):
+        """
+        Send the queued emails and close the connection, on shutdown.
+        """
+
+        if cls.queue is not None:
+            await cls.queue.close()
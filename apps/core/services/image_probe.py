@@ -0,0 +1,87 @@
+from PIL import ImageFile
+
+# the signature (magic bytes) of each image format, and the offset it's at
+SIGNATURES = (
+    ('jpeg', 0, b'\xff\xd8\xff'),
+    ('png', 0, b'\x89PNG\r\n\x1a\n'),
+    ('gif', 0, b'GIF87a'),
+    ('gif', 0, b'GIF89a'),
+    ('webp', 8, b'WEBP'),
+)
+SIGNATURE_SIZE = 16
+
+# the file extension of each format
+EXTENSIONS = {'jpeg': 'jpg', 'png': 'png', 'gif': 'gif', 'webp': 'webp'}
+CONTENT_TYPES = {'jpeg': 'image/jpeg', 'png': 'image/png', 'gif': 'image/gif', 'webp': 'image/webp'}
+
+
+class ImageProbe:
+    """
+    Learn the real format, the dimensions and the size of an image from its chunks, while it's streamed.
+
+    The format is sniffed from the magic bytes of the first chunk, the client's `Content-Type` and file name are not
+    trusted. The dimensions are read from the header of the image: only the first chunks are parsed (up to
+    `max_header_size`), the image is never decoded.
+
+    Usage:
+        probe = ImageProbe()
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            probe.feed(chunk)
+        probe.format, probe.width, probe.height, probe.size
+    """
+
+    max_header_size = 512 * 1024
+
+    def __init__(self):
+        self.format: str | None = None
+        self.width: int | None = None
+        self.height: int | None = None
+        self.size = 0
+        self.__parser: ImageFile.Parser | None = None
+        self.__head = b''
+
+    @staticmethod
+    def sniff(head: bytes) -> str | None:
+        """
+        The format of an image from its first bytes, or None if it isn't an image of a known format.
+        """
+
+        for image_format, offset, signature in SIGNATURES:
+            if head[offset:offset + len(signature)] == signature:
+                if image_format == 'webp' and not head.startswith(b'RIFF'):
+                    continue
+                return image_format
+        return None
+
+    @property
+    def extension(self) -> str | None:
+        return EXTENSIONS.get(self.format)
+
+    @property
+    def content_type(self) -> str | None:
+        return CONTENT_TYPES.get(self.format)
+
+    def feed(self, chunk: bytes):
+        parsed = self.size
+        self.size += len(chunk)
+
+        if parsed < SIGNATURE_SIZE:
+            # the first bytes are kept until the signature is complete, then parsed with the rest of the header
+            self.__head += chunk
+            self.format = self.sniff(self.__head)
+            if self.format is None:
+                return
+            self.__parser, chunk = ImageFile.Parser(), self.__head
+
+        if self.__parser is None or parsed >= self.max_header_size:
+            return
+
+        try:
+            self.__parser.feed(chunk)
+        except (OSError, SyntaxError, ValueError):
+            self.__parser = None
+            return
+        if self.__parser.image is not None:
+            self.width, self.height = self.__parser.image.size
+            # the header is all we need, the rest of the image isn't parsed (nor decoded)
+            self.__parser = None
@@ -1,45 +1,185 @@
+import asyncio
+import hashlib
 import os
+import tempfile
+import time
 import uuid
-from pathlib import Path
 
 from fastapi import UploadFile, status, HTTPException
+from starlette.concurrency import run_in_threadpool
 
-from config.database import DatabaseManager
-from config.settings import MEDIA_DIR, MAX_FILE_SIZE
+from apps.core.services.image_probe import ImageProbe, SIGNATURE_SIZE
+from apps.core.services.metrics import media_upload_duration, media_upload_size
+from apps.core.services.storage import StorageManager
+from config import settings
+from config.settings import MAX_FILE_SIZE, UPLOAD_CHUNK_SIZE, MEDIA_UPLOAD_CONCURRENCY
 
 
 # TODO set permission to access media-directory and files
 class MediaService:
+    """
+    Store the uploaded files in the storage backend (see `StorageManager`).
+
+    By default, each upload is saved in the directory of the service (e.g. `products/{product_id}`) under a random
+    name. With `settings.MEDIA_CONTENT_ADDRESSED`, each upload is saved once under the SHA-256 of its content, in
+    `blobs/ab/cd/{sha256}.{extension}`: the same file uploaded many times is stored once, and a name never gets
+    another content. The blob is returned as a key relative to the root of the storage (any name with a `/`), that
+    several records can share, so it's never deleted with a record: an upload of the same content may be about to
+    reference it. `MediaGarbageCollector` removes it once no record references it.
+
+    With `settings.MEDIA_SHARDED_LAYOUT`, the directory of the service is spread in a hashed fan-out, e.g.
+    `products/ab/cd/{product_id}` instead of `products/{product_id}`, so no directory gets too large to list. The
+    uploads are then returned as keys too, and the plain names (saved before) are still found in the old directory.
+    """
+
+    blobs_directory = 'blobs'
+    allowed_formats = ('jpeg', 'png', 'gif')
+
     def __init__(self, parent_directory: str = "media", sub_directory: str | int = None):
-        testing = DatabaseManager.get_testing_mode()
-        if not testing:
-            self.path = Path(f"{MEDIA_DIR}/{parent_directory}/{sub_directory}" if sub_directory else parent_directory)
-        else:
-            self.path = Path(
-                f"{MEDIA_DIR}/test/{parent_directory}/{sub_directory}" if sub_directory else parent_directory)
-        # self.path.mkdir(parents=True, exist_ok=True)
-
-    def save_file(self, file: UploadFile):
+        parent_directory = parent_directory.strip('/')
+        self.prefix = f"{parent_directory}/{sub_directory}" if sub_directory else parent_directory
+        # the directory of the new files
+        self.sharded = bool(settings.MEDIA_SHARDED_LAYOUT and sub_directory)
+        self.upload_prefix = self.get_sharded_prefix(parent_directory, sub_directory) if self.sharded else self.prefix
+        self.storage = StorageManager.get_backend()
+
+    async def save_file(self, file: UploadFile):
+        """
+        Stream an upload to the storage.
+
+        The upload is read in chunks of `UPLOAD_CHUNK_SIZE` and written to a temporary file (next to its destination
+        on the local storage), the disk writes run in the thread pool so the event loop isn't blocked. As soon as the
+        upload exceeds `MAX_FILE_SIZE` it's aborted, otherwise the temporary file is moved (atomically on the local
+        storage) to its final key, so a partial file is never visible.
+
+        The chunks go through an `ImageProbe` on their way: an image is saved with the extension of its real format,
+        and its dimensions are known without reading it again.
+
+        Returns:
+            The file name (`src`), extension (`type`), size in bytes, and width and height (None if it isn't an image).
+        """
         # TODO separate exceptions to a module in core app
 
-        file_extension = self.get_file_extension(file)
+        content_addressed = settings.MEDIA_CONTENT_ADDRESSED
+
+        temp_prefix = self.blobs_directory if content_addressed else self.upload_prefix
+        temp_directory = await self.storage.temp_directory(temp_prefix)
+        max_size = self.get_max_file_size()
+        digest = hashlib.sha256()
+        probe = ImageProbe()
+        storage_name = type(self.storage).__name__
+        start = time.perf_counter()
+        fd, temp_path = tempfile.mkstemp(dir=temp_directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                await file.seek(0)
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    probe.feed(chunk)
+                    if probe.size > max_size:
+                        raise self.file_size_exception()
+                    digest.update(chunk)
+                    await run_in_threadpool(temp_file.write, chunk)
+
+            file_extension = probe.extension or self.get_file_extension(file)
+            if content_addressed:
+                file_name = self.get_blob_key(digest.hexdigest(), file_extension)
+            else:
+                # Generate a unique filename with a random string and date
+                file_name = self.get_upload_src(self.generate_unique_filename(file.filename, file_extension))
+
+            key = self.get_key(file_name)
+            if content_addressed and await self.storage.touch(key):
+                # the same content is already stored, it's now as young as a new upload, so the garbage collector
+                # (see `MediaGarbageCollector.min_age`) doesn't remove it before its new record is saved
+                os.remove(temp_path)
+            else:
+                await self.storage.save(key, temp_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            media_upload_duration.labels(storage_name, 'failed').observe(time.perf_counter() - start)
+            raise
+
+        media_upload_duration.labels(storage_name, 'saved').observe(time.perf_counter() - start)
+        media_upload_size.labels(storage_name).observe(probe.size)
+        return {'src': file_name, 'type': file_extension, 'size': probe.size, 'width': probe.width,
+                'height': probe.height}
+
+    async def save_files(self, files: list[UploadFile], concurrency: int = MEDIA_UPLOAD_CONCURRENCY):
+        """
+        Save many uploads at once, at most `concurrency` at a time, so a gallery takes about the time of its slowest
+        file rather than the sum of them.
+
+        Returns:
+            The saved file of each upload (see `save_file`), in the order of the uploads. If one of them fails, the
+            files already saved are deleted (the blobs are left to the garbage collector, they may be shared) and its
+            error is raised.
+        """
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def save(file: UploadFile):
+            async with semaphore:
+                return await self.save_file(file)
+
+        results = await asyncio.gather(*[save(file) for file in files], return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            for result in results:
+                if not isinstance(result, BaseException) and not self.is_blob_key(result['src']):
+                    await self.delete_file(result['src'])
+            raise errors[0]
+        return results
+
+    @classmethod
+    async def validate_files(cls, files: list[UploadFile]):
+        """
+        Check the type and the size of each upload, concurrently.
+        """
+
+        await asyncio.gather(*[cls.is_allowed_type(file) for file in files])
+        await asyncio.gather(*[cls.is_allowed_file_size(file) for file in files])
+        return True
 
-        # Generate a unique filename with a random string and date
-        file_name = self.generate_unique_filename(file.filename)
-        if not os.path.exists(self.path):
-            os.makedirs(self.path, exist_ok=True)
+    @classmethod
+    def get_blob_key(cls, digest: str, file_extension: str) -> str:
+        name = f'{digest}.{file_extension}' if file_extension else digest
+        return f'{cls.blobs_directory}/{digest[:2]}/{digest[2:4]}/{name}'
 
-            # for file in files:
-        new_file = os.path.join(self.path, file_name)
+    @staticmethod
+    def get_sharded_prefix(parent_directory: str, sub_directory: str | int) -> str:
+        """
+        The directory of `sub_directory` in the hashed fan-out of `parent_directory`, e.g. `products/ab/cd/1`.
+        """
 
-        with open(new_file, 'wb') as f:
-            f.write(file.file.read())
+        digest = hashlib.sha256(str(sub_directory).encode()).hexdigest()
+        return f'{parent_directory.strip("/")}/{digest[:2]}/{digest[2:4]}/{sub_directory}'
+
+    @staticmethod
+    def is_blob_key(file_name: str | None) -> bool:
+        return file_name is not None and '/' in file_name
 
-        return file_name, file_extension
+    @classmethod
+    def is_content_addressed(cls, key: str) -> bool:
+        return key.startswith(f'{cls.blobs_directory}/')
 
-    def generate_unique_filename(self, filename: str) -> str:
+    def get_key(self, file_name: str) -> str:
+        """
+        The storage key of a file of this service, or of a blob.
+        """
+
+        return file_name if self.is_blob_key(file_name) else f'{self.prefix}/{file_name}'
+
+    def get_upload_src(self, file_name: str) -> str:
+        """
+        How a new file of this service is referenced: by its name, or by its key in the sharded layout.
+        """
+
+        return f'{self.upload_prefix}/{file_name}' if self.sharded else file_name
+
+    def generate_unique_filename(self, filename: str, file_extension: str | None = None) -> str:
         random_string = str(uuid.uuid4().hex)
-        file_extension = filename.split('.')[-1]
+        file_extension = file_extension or filename.split('.')[-1]
         unique_filename = f"{random_string}.{file_extension}"
         return unique_filename
 
@@ -53,33 +193,51 @@ class MediaService:
         file_size_bytes = file.file.seek(0, 2)
         return file_size_bytes / (1024 * 1024)  # Convert to MB
 
-    @staticmethod
-    def is_allowed_extension(file: UploadFile):
-        if file.content_type not in ["image/jpeg", "image/png", "image/gif"]:
+    @classmethod
+    async def is_allowed_type(cls, file: UploadFile):
+        """
+        Check the real format of an upload, sniffed from its first bytes: the `Content-Type` sent by the client isn't
+        trusted.
+        """
+
+        await file.seek(0)
+        head = await file.read(SIGNATURE_SIZE)
+        await file.seek(0)
+        if ImageProbe.sniff(head) not in cls.allowed_formats:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid file type")
         return True
 
-    @staticmethod
-    async def is_allowed_file_size(file: UploadFile):
-        file_size_in_bytes = MAX_FILE_SIZE * 1024 * 1024  # MB in bytes
+    @classmethod
+    async def is_allowed_file_size(cls, file: UploadFile):
+        """
+        Reject an upload that is too large, without reading it.
 
-        file_size = len(await file.read())
-        if file_size > file_size_in_bytes:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                                detail=f"File size exceeds {file_size_in_bytes}MB limit")
+        It only checks the size of the spooled upload, the limit is enforced again while the file is saved.
+        """
 
-        # to reset the cursor to the beginning of the file.
-        file.file.seek(0)
+        file_size = file.size if file.size is not None else await run_in_threadpool(file.file.seek, 0, 2)
+        if file_size > cls.get_max_file_size():
+            raise cls.file_size_exception()
         return True
 
-    def delete_file(self, file_name: str):
-        file_path = os.path.join(self.path, file_name)
+    @staticmethod
+    def get_max_file_size() -> int:
+        return MAX_FILE_SIZE * 1024 * 1024  # MB in bytes
 
-        # Attempt to delete the file
-        try:
-            os.remove(file_path)
-            return True  # Return True if the file is successfully deleted
-        except OSError as e:
-            # Handle the case where the file could not be deleted
-            print(f"Error: {e}")
-            return False  # Return False if there was an error deleting the file
+    @staticmethod
+    def file_size_exception() -> HTTPException:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                             detail=f"File size exceeds {MAX_FILE_SIZE}MB limit")
+
+    async def delete_blob(self, key: str):
+        """
+        Delete a file referenced by its key and the files made from it (e.g. `{name}_150.webp`), the caller must make
+        sure that nothing references it anymore. The content-addressed blobs are left to the garbage collector.
+        """
+
+        for derived in await self.storage.list(f"{key.rsplit('.', 1)[0]}_"):
+            await self.storage.delete(derived)
+        return await self.storage.delete(key)
+
+    async def delete_file(self, file_name: str):
+        return await self.storage.delete(self.get_key(file_name))
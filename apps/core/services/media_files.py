@@ -0,0 +1,260 @@
+import os
+import re
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from mimetypes import guess_type
+from pathlib import Path
+from typing import Iterable
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.types import Receive, Scope, Send
+
+from apps.core.services.storage import StorageManager
+from config.settings import HTTP_CACHE_CONTROL, MEDIA_GC, MEDIA_SERVING
+
+# a name made of a random (uuid4) or content (sha256) hex digest: a file with such a name never changes
+IMMUTABLE_NAME = re.compile(r'^[0-9a-f]{32,64}(_\d+)?\.\w+$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# the precompressed siblings of a file, e.g. `image.svg.br`, by order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class MediaFiles:
+    """
+    ASGI app that serves the local media files, in place of `StaticFiles`.
+
+    - Files with a unique name (random or content hash) are cached by the clients and CDNs for good
+      (`Cache-Control: immutable`), the others are revalidated with `ETag` / `Last-Modified`.
+    - Byte ranges (`Range`, `If-Range`), e.g. to resume a download or seek in a video.
+    - A precompressed sibling (`.br`, `.gz`) is sent in place of the file if the client accepts its encoding.
+    - The file is sent with zero-copy `sendfile` if the server supports it (the `http.response.zerocopysend`
+      extension), or by the reverse proxy with `X-Accel-Redirect` if `MEDIA_SERVING['accel_redirect']` is set.
+
+    Without a directory, it serves the root of the local storage (the tests have their own). The `private`
+    directories in it aren't served, by default the quarantine of the garbage collector: the files moved there are
+    unreferenced, they must not stay downloadable.
+
+    Usage:
+        app.mount("/media", MediaFiles(), name="media")
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, directory: str | os.PathLike | None = None,
+                 accel_redirect: str | None = MEDIA_SERVING['accel_redirect'],
+                 immutable_max_age: int = MEDIA_SERVING['immutable_max_age'],
+                 private: Iterable[str] = (MEDIA_GC['quarantine'],)):
+        self.__directory = Path(directory).resolve() if directory is not None else None
+        self.private = tuple(directory.strip('/') for directory in private)
+        self.accel_redirect = accel_redirect
+        self.immutable_max_age = immutable_max_age
+
+    @property
+    def directory(self) -> Path:
+        return self.__directory or StorageManager.get_media_root().resolve()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        assert scope['type'] == 'http'
+
+        if scope['method'] not in ('GET', 'HEAD'):
+            return await self.send_empty(send, 405, {'allow': 'GET, HEAD'})
+
+        # the mount leaves the path relative to it, the file system is only touched in a thread (like `StaticFiles`)
+        directory = self.directory
+        path = await anyio.to_thread.run_sync((directory / scope['path'].lstrip('/')).resolve)
+        if not path.is_relative_to(directory) or \
+                any(path.is_relative_to(directory / private) for private in self.private):
+            return await self.send_empty(send, 404)
+        stat_result = await self.stat_file(path)
+        if stat_result is None:
+            return await self.send_empty(send, 404)
+
+        request_headers = Headers(scope=scope)
+        headers = self.file_headers(path, stat_result)
+
+        if self.is_not_modified(request_headers, headers):
+            return await self.send_empty(send, 304, headers)
+
+        # --- precompressed sibling ---
+        content_path, content_size = path, stat_result.st_size
+        headers['vary'] = 'Accept-Encoding'
+        accepted = self.accepted_encodings(request_headers.get('accept-encoding', ''))
+        for encoding, suffix in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            sibling = path.with_name(path.name + suffix)
+            sibling_stat = await self.stat_file(sibling)
+            if sibling_stat is not None:
+                content_path, content_size = sibling, sibling_stat.st_size
+                headers['content-encoding'] = encoding
+                headers['etag'] = f'{headers["etag"][:-1]}-{encoding}"'
+                break
+
+        # --- range (only on the file itself) ---
+        status, offset, count = 200, 0, content_size
+        byte_range = request_headers.get('range')
+        if byte_range and 'content-encoding' not in headers and self.if_range_matches(request_headers, headers):
+            requested = self.parse_range(byte_range, content_size)
+            if requested is None:
+                headers['content-range'] = f'bytes */{content_size}'
+                return await self.send_empty(send, 416, headers)
+            if requested is not ...:
+                status, (offset, count) = 206, requested
+                headers['content-range'] = f'bytes {offset}-{offset + count - 1}/{content_size}'
+        headers['content-length'] = str(count)
+
+        if self.accel_redirect:
+            # the proxy sends the file (and handles the ranges), the app only sent the headers
+            location = content_path.relative_to(directory).as_posix()
+            headers['x-accel-redirect'] = f'{self.accel_redirect.rstrip("/")}/{location}'
+            headers.pop('content-length')
+            headers.pop('content-range', None)
+            return await self.send_empty(send, 200, headers)
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': self.raw(headers)})
+        if scope['method'] == 'HEAD':
+            return await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        await self.send_file(scope, send, content_path, offset, count)
+
+    @staticmethod
+    async def stat_file(path: Path) -> os.stat_result | None:
+        """
+        The `stat` of a regular file, or None if there is no such file.
+        """
+
+        try:
+            stat_result = await anyio.to_thread.run_sync(os.stat, path)
+        except OSError:
+            # missing, or e.g. a name too long
+            return None
+        return stat_result if stat.S_ISREG(stat_result.st_mode) else None
+
+    @staticmethod
+    def accepted_encodings(accept_encoding: str) -> set[str]:
+        """
+        The content codings of `ENCODINGS` an `Accept-Encoding` header accepts: listed (or matched by `*`) with a
+        non-zero quality (RFC 9110, 12.5.3), e.g. `gzip;q=0` refuses gzip.
+        """
+
+        qualities = {}
+        for item in accept_encoding.split(','):
+            coding, *params = [part.strip() for part in item.split(';')]
+            if not coding:
+                continue
+            quality = 1.0
+            for param in params:
+                name, _, value = param.partition('=')
+                if name.strip().lower() == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            qualities[coding.lower()] = quality
+
+        default = qualities.get('*', 0.0)
+        return {encoding for encoding, _ in ENCODINGS if qualities.get(encoding, default) > 0}
+
+    def file_headers(self, path: Path, stat_result: os.stat_result) -> dict[str, str]:
+        if IMMUTABLE_NAME.match(path.name):
+            cache_control = f'public, max-age={self.immutable_max_age}, immutable'
+        else:
+            cache_control = HTTP_CACHE_CONTROL
+
+        return {
+            'content-type': guess_type(path.name)[0] or 'application/octet-stream',
+            'etag': f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"',
+            'last-modified': formatdate(stat_result.st_mtime, usegmt=True),
+            'cache-control': cache_control,
+            'accept-ranges': 'bytes'
+        }
+
+    @staticmethod
+    def is_not_modified(request_headers: Headers, headers: dict) -> bool:
+        if_none_match = request_headers.get('if-none-match')
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+            return '*' in tags or headers['etag'] in tags
+        return MediaFiles.not_modified_since(request_headers.get('if-modified-since'), headers['last-modified'])
+
+    @staticmethod
+    def if_range_matches(request_headers: Headers, headers: dict) -> bool:
+        if_range = request_headers.get('if-range')
+        if if_range is None:
+            return True
+        if if_range.startswith('"'):
+            return if_range == headers['etag']
+        # a date must be the exact `Last-Modified` of the file (RFC 9110, 13.1.5), a later one doesn't match
+        try:
+            return parsedate_to_datetime(if_range) == parsedate_to_datetime(headers['last-modified'])
+        except (TypeError, ValueError):
+            return False
+
+    @staticmethod
+    def not_modified_since(date: str | None, last_modified: str) -> bool:
+        if date is None:
+            return False
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(date)
+        except (TypeError, ValueError):
+            return False
+
+    @staticmethod
+    def parse_range(byte_range: str, size: int):
+        """
+        Parse a single byte range.
+
+        Returns:
+            The offset and the length of the range, None if it can't be satisfied, or `...` to ignore it (e.g. it's
+            malformed, or has many ranges) and send the whole file.
+        """
+
+        match = RANGE.match(byte_range.strip())
+        if match is None:
+            return ...
+
+        start, end = match.groups()
+        if not start:
+            if not end:
+                return ...
+            # the last `end` bytes
+            length = min(int(end), size)
+            return (size - length, length) if length else None
+
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+        if start >= size:
+            return None
+        if end < start:
+            return ...
+        return start, end - start + 1
+
+    async def send_file(self, scope: Scope, send: Send, path: Path, offset: int, count: int):
+        if 'http.response.zerocopysend' in scope.get('extensions', {}):
+            with open(path, 'rb') as file:
+                await send({'type': 'http.response.zerocopysend', 'file': file, 'offset': offset, 'count': count,
+                            'more_body': False})
+            return
+
+        async with await anyio.open_file(path, mode='rb') as file:
+            await file.seek(offset)
+            remaining = count
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+            if remaining > 0 or count == 0:
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    async def send_empty(self, send: Send, status: int, headers: dict | None = None):
+        headers = dict(headers or {})
+        headers['content-length'] = '0'
+        await send({'type': 'http.response.start', 'status': status, 'headers': self.raw(headers)})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    @staticmethod
+    def raw(headers: dict[str, str]) -> list[tuple[bytes, bytes]]:
+        return [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()]
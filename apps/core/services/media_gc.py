@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Iterable
+
+from apps.core.services.storage import BaseStorage, StorageManager
+from config.settings import MEDIA_GC
+
+logger = logging.getLogger(__name__)
+
+
+class MediaGarbageCollector:
+    """
+    Delete (or quarantine) the media files that no database record references anymore.
+
+    The files of the storage are streamed (never listed at once), and checked against the database in batches of
+    `batch_size` keys with the `references` coroutine, which returns the referenced keys of a batch. Unreferenced
+    files are removed at most `rate` per second. Files younger than `min_age` seconds are skipped, so an upload that's
+    in flight (stored, but not saved in the database yet) is never collected.
+
+    Usage:
+        collector = MediaGarbageCollector(ProductService.referenced_media_keys, dry_run=True)
+        report = await collector.run()
+    """
+
+    def __init__(self, references: Callable[[Iterable[str]], Awaitable[set[str]]],
+                 storage: BaseStorage | None = None,
+                 prefixes: Iterable[str] = MEDIA_GC['prefixes'],
+                 batch_size: int = MEDIA_GC['batch_size'],
+                 rate: float | None = MEDIA_GC['rate'],
+                 min_age: int = MEDIA_GC['min_age'],
+                 quarantine: str | None = None,
+                 dry_run: bool = False):
+        self.references = references
+        self.storage = storage or StorageManager.get_backend()
+        self.prefixes = tuple(prefixes)
+        self.batch_size = batch_size
+        self.interval = 1 / rate if rate else 0
+        self.min_age = min_age
+        self.quarantine = quarantine.strip('/') if quarantine else None
+        self.dry_run = dry_run
+        self.report = {}
+        self.__next_removal = 0.0
+
+    async def run(self) -> dict:
+        """
+        Collect the garbage, and return a report: the number and the size of the scanned files, of the orphans, and
+        of the files actually removed (`reclaimed_bytes`), and the number of files that couldn't be removed.
+        """
+
+        self.report = {'scanned': 0, 'scanned_bytes': 0, 'skipped': 0, 'orphans': 0, 'orphan_bytes': 0,
+                       'removed': 0, 'reclaimed_bytes': 0, 'failed': 0}
+        created_before = time.time() - self.min_age
+
+        for prefix in self.prefixes:
+            batch: dict[str, int] = {}
+            async for key, size, modified in self.storage.walk(prefix):
+                self.report['scanned'] += 1
+                self.report['scanned_bytes'] += size
+                if modified > created_before:
+                    self.report['skipped'] += 1
+                    continue
+
+                batch[key] = size
+                if len(batch) >= self.batch_size:
+                    await self.__collect(batch)
+                    batch = {}
+            if batch:
+                await self.__collect(batch)
+
+        return self.report
+
+    async def __collect(self, batch: dict[str, int]):
+        referenced = await self.references(batch.keys())
+        for key, size in batch.items():
+            if key in referenced:
+                continue
+
+            self.report['orphans'] += 1
+            self.report['orphan_bytes'] += size
+            if self.dry_run:
+                continue
+
+            await self.__throttle()
+            if await self.__remove(key):
+                self.report['removed'] += 1
+                self.report['reclaimed_bytes'] += size
+            else:
+                self.report['failed'] += 1
+
+    async def __remove(self, key: str) -> bool:
+        try:
+            if self.quarantine:
+                await self.storage.move(key, f'{self.quarantine}/{key}')
+                return True
+            return await self.storage.delete(key)
+        except Exception as e:
+            # a file that can't be removed doesn't stop the collection, it's reported
+            logger.error(f"The media file {key} could not be removed: {e}")
+            return False
+
+    async def __throttle(self):
+        now = time.monotonic()
+        if self.__next_removal > now:
+            await asyncio.sleep(self.__next_removal - now)
+        self.__next_removal = max(now, self.__next_removal) + self.interval
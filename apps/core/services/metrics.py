@@ -0,0 +1,228 @@
+import os
+import time
+from contextvars import ContextVar
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import AdaptedConnection, Engine
+from sqlalchemy.pool import Pool
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config.database import DatabaseManager
+from config.settings import METRICS
+
+# the metrics of the app, apart from the default ones of `prometheus_client` (process, GC...)
+registry = CollectorRegistry()
+
+# --- HTTP ---
+http_request_duration = Histogram(
+    'http_request_duration_seconds', 'Duration of the HTTP requests, by route template.',
+    ['method', 'route', 'status'], buckets=METRICS['latency_buckets'], registry=registry)
+http_requests_in_progress = Gauge(
+    'http_requests_in_progress', 'HTTP requests being handled.', ['method'], registry=registry,
+    multiprocess_mode='livesum')
+http_response_size = Histogram(
+    'http_response_size_bytes', 'Size of the HTTP response bodies, by route template.',
+    ['method', 'route'], buckets=METRICS['size_buckets'], registry=registry)
+
+# --- Database ---
+db_query_duration = Histogram(
+    'db_query_duration_seconds', 'Duration of the database queries, by statement type.',
+    ['statement'], buckets=METRICS['latency_buckets'], registry=registry)
+db_request_queries = Histogram(
+    'db_request_queries', 'Database queries made by an HTTP request, by route template.',
+    ['route'], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100), registry=registry)
+db_request_query_duration = Histogram(
+    'db_request_query_duration_seconds', 'Time an HTTP request spent in database queries, by route template.',
+    ['route'], buckets=METRICS['latency_buckets'], registry=registry)
+db_pool_checkouts = Counter(
+    'db_pool_checkouts_total', 'Connections checked out of the pools (sync or async).', ['pool'], registry=registry)
+db_pool_checked_out = Gauge(
+    'db_pool_checked_out', 'Connections checked out of the pools, in use.', ['pool'], registry=registry,
+    multiprocess_mode='livesum')
+db_pool_wait = Histogram(
+    'db_pool_wait_seconds', 'Time to get a connection from the pools: waiting for a free one, or opening a new one.',
+    ['pool'], buckets=METRICS['latency_buckets'], registry=registry)
+db_pool_connection_held = Histogram(
+    'db_pool_connection_held_seconds', 'Time the connections are held out of the pools, from checkout to checkin.',
+    ['pool'], buckets=METRICS['latency_buckets'], registry=registry)
+
+# --- Passwords ---
+password_hashing_calls = Gauge(
+    'password_hashing_calls', 'Password hashing calls in the pool of `PasswordManager`, running or queued.',
+    ['state'], registry=registry, multiprocess_mode='livesum')
+
+# --- Media ---
+media_upload_size = Histogram(
+    'media_upload_size_bytes', 'Size of the saved uploads.', ['storage'], buckets=METRICS['size_buckets'],
+    registry=registry)
+media_upload_duration = Histogram(
+    'media_upload_duration_seconds', 'Duration of the uploads, from the first chunk read to the file stored.',
+    ['storage', 'result'], buckets=METRICS['latency_buckets'], registry=registry)
+
+# the queries of the current HTTP request: [count, duration]
+_request_queries: ContextVar[list | None] = ContextVar('request_queries', default=None)
+
+
+def get_route_template(scope: Scope) -> str:
+    """
+    The template of the route a request matched (e.g. `/products/{product_id}`), so the metrics of all the products
+    are grouped, or the mount it went to (e.g. `/media/{path}`).
+    """
+
+    route = scope.get('route')
+    if route is not None:
+        return route.path
+    if scope.get('root_path'):
+        return scope['root_path'] + '/{path}'
+    return '<unmatched>'
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that measures the HTTP requests: their duration and the size of their responses by route template,
+    the requests in progress, and the database queries each of them made.
+
+    Example Usage:
+        app.add_middleware(MetricsMiddleware)
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or scope['path'] == METRICS['path']:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope['method']
+        status = 500
+        size = 0
+
+        async def send_wrapper(message: Message):
+            nonlocal status, size
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            elif message['type'] == 'http.response.zerocopysend':
+                size += message['count']
+            await send(message)
+
+        queries = [0, 0.0]
+        token = _request_queries.set(queries)
+        http_requests_in_progress.labels(method).inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            http_requests_in_progress.labels(method).dec()
+            _request_queries.reset(token)
+
+            route = get_route_template(scope)
+            http_request_duration.labels(method, route, str(status)).observe(duration)
+            http_response_size.labels(method, route).observe(size)
+            db_request_queries.labels(route).observe(queries[0])
+            db_request_query_duration.labels(route).observe(queries[1])
+
+
+class DatabaseMetrics:
+    """
+    Measure the queries and the connection pools of all the SQLAlchemy engines (sync, and the async ones through
+    their sync engine), the engines created later included, e.g. by `DatabaseManager.create_test_database`.
+
+    The wait for a connection is only measured on the engines of `DatabaseManager`, their pools are a subclass of
+    their pool class that times `Pool.connect` (SQLAlchemy has no pool event before a checkout).
+    """
+
+    instrumented = False
+
+    # the timed subclass of each pool class, by engine type
+    timed_pool_classes: dict[tuple[type[Pool], str], type[Pool]] = {}
+
+    @classmethod
+    def instrument(cls):
+        if cls.instrumented:
+            return
+        event.listen(Engine, 'before_cursor_execute', cls.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', cls.after_cursor_execute)
+        event.listen(Pool, 'checkout', cls.checkout)
+        event.listen(Pool, 'checkin', cls.checkin)
+
+        DatabaseManager.pool_class_wrapper = cls.timed_pool_class
+        # the engines created before get a timed pool too
+        if DatabaseManager.engine is not None:
+            DatabaseManager()
+        cls.instrumented = True
+
+    @classmethod
+    def timed_pool_class(cls, pool_class: type[Pool], engine_type: str) -> type[Pool]:
+        """
+        Get a subclass of `pool_class` that measures the time `connect` waits, labelled with `engine_type`. A disposed
+        pool is re-created from its class, so the engine keeps it.
+        """
+
+        key = (pool_class, engine_type)
+        if key not in cls.timed_pool_classes:
+            def connect(pool: Pool):
+                start = time.perf_counter()
+                try:
+                    return pool_class.connect(pool)
+                finally:
+                    # timed out or failed connections included
+                    db_pool_wait.labels(engine_type).observe(time.perf_counter() - start)
+
+            cls.timed_pool_classes[key] = type(f'Timed{pool_class.__name__}', (pool_class,), {'connect': connect})
+        return cls.timed_pool_classes[key]
+
+    @staticmethod
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @staticmethod
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['query_start'].pop()
+        statement_type = statement.lstrip().split(' ', 1)[0].upper()
+        if statement_type not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE'):
+            statement_type = 'OTHER'
+        db_query_duration.labels(statement_type).observe(duration)
+
+        queries = _request_queries.get()
+        if queries is not None:
+            queries[0] += 1
+            queries[1] += duration
+
+    @staticmethod
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        # the sync and the async engines have a pool each
+        pool = 'async' if isinstance(dbapi_connection, AdaptedConnection) else 'sync'
+        connection_record.info['checkout'] = (pool, time.perf_counter())
+        db_pool_checkouts.labels(pool).inc()
+        db_pool_checked_out.labels(pool).inc()
+
+    @staticmethod
+    def checkin(dbapi_connection, connection_record):
+        checkout = connection_record.info.pop('checkout', None)
+        if checkout is None:
+            return
+        pool, start = checkout
+        db_pool_checked_out.labels(pool).dec()
+        db_pool_connection_held.labels(pool).observe(time.perf_counter() - start)
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    """
+    The metrics in the Prometheus text format. With many worker processes (`PROMETHEUS_MULTIPROC_DIR` is set), the
+    metrics of all the workers are merged.
+    """
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        collected = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collected)
+    else:
+        collected = registry
+    return Response(generate_latest(collected), headers={'Content-Type': CONTENT_TYPE_LATEST})
@@ -0,0 +1,46 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key into a single call.
+
+    While a call for a key is in flight, the other callers with that key don't start their own call, they await the
+    one in flight and share its result (or its exception). The result isn't kept after the call is done, it's not a
+    cache: it only protects the database from many identical loads at once, e.g. on a hot key right after its cache
+    entry is invalidated.
+
+    The calls are shared between the tasks of one event loop (one worker). A call runs in its own task, with the
+    context of the caller that started it, so it must not use state bound to that caller (e.g. its request session).
+
+    Usage:
+        single_flight = SingleFlight()
+        product = await single_flight.do(('product', product_id), load_product, product_id)
+    """
+
+    def __init__(self):
+        self.calls: dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, func: Callable[..., Awaitable], *args, **kwargs) -> Any:
+        task = self.calls.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self.__forget(key, done))
+
+        # the call runs in its own task, so a cancelled caller doesn't cancel it for the others
+        return await asyncio.shield(task)
+
+    def forget(self, *keys: Hashable):
+        """
+        Stop sharing the calls in flight for the keys, e.g. when what they load has changed: the callers that already
+        await them get their result, the next callers start a new call.
+        """
+
+        for key in keys:
+            self.calls.pop(key, None)
+
+    def __forget(self, key: Hashable, task: asyncio.Task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
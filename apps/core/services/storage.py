@@ -0,0 +1,369 @@
+import logging
+import os
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncContextManager, AsyncIterator, Iterator
+
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from config import settings
+from config.database import DatabaseManager
+from config.settings import MEDIA_DIR
+
+logger = logging.getLogger(__name__)
+
+
+class BaseStorage:
+    """
+    Interface of the storage backends of the media files.
+
+    A file is addressed by its key, a `/`-separated path relative to the root of the storage, e.g.
+    `products/1/{file_name}` or `blobs/ab/cd/{sha256}.jpg`. The blocking I/O of the backends runs in the thread pool.
+    """
+
+    def __init__(self, base_url: str | None = None):
+        self.base_url = base_url
+
+    async def save(self, key: str, path: str | os.PathLike):
+        """
+        Store a local file under the key, the local file is moved (it doesn't exist anymore afterward).
+        """
+
+        raise NotImplementedError
+
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> bool:
+        """
+        Delete a file, and return False if it couldn't be deleted.
+        """
+
+        raise NotImplementedError
+
+    async def read_head(self, key: str, size: int) -> bytes | None:
+        """
+        Read the first `size` bytes of a file (less if it's smaller), e.g. to sniff its format, or None if it doesn't
+        exist.
+        """
+
+        raise NotImplementedError
+
+    async def touch(self, key: str) -> bool:
+        """
+        Set the modification time of a file to now, e.g. for a blob uploaded again, so the garbage collector sees it
+        as a new file. Return False if it doesn't exist.
+        """
+
+        raise NotImplementedError
+
+    async def list(self, prefix: str) -> list[str]:
+        """
+        The keys that start with the prefix.
+        """
+
+        raise NotImplementedError
+
+    def walk(self, prefix: str = '') -> AsyncIterator[tuple[str, int, float]]:
+        """
+        Stream the key, size and modification time (a timestamp) of every file under the directory `prefix`, without
+        listing the whole tree at once.
+        """
+
+        raise NotImplementedError
+
+    async def move(self, key: str, destination: str):
+        raise NotImplementedError
+
+    async def copy(self, key: str, destination: str):
+        raise NotImplementedError
+
+    async def prune(self, prefix: str):
+        """
+        Remove the directory `prefix` if it's empty, on the storages that have directories.
+        """
+
+    def local_copy(self, key: str) -> AsyncContextManager[Path]:
+        """
+        A path of the file on the local disk, e.g. to process it. Files created next to it can be stored with `save`.
+        """
+
+        raise NotImplementedError
+
+    async def temp_directory(self, key: str) -> Path | None:
+        """
+        The local directory of the temporary files that are about to be saved under the key (prefix), or None for
+        the directory of the system.
+        """
+
+        return None
+
+    def url(self, key: str) -> str | None:
+        """
+        The public URL of a file, or None if the files are served by the app (under `/media`).
+        """
+
+        return f'{self.base_url.rstrip("/")}/{key}' if self.base_url else None
+
+    async def presigned_upload(self, key: str, content_type: str, max_size: int, expires: int) -> dict:
+        """
+        A presigned request the clients can use to upload a file directly to the storage, without the app servers.
+        """
+
+        raise NotImplementedError
+
+
+class LocalStorage(BaseStorage):
+    """
+    The files on the local disk, in the media directory.
+    """
+
+    def __init__(self, root: str | os.PathLike, base_url: str | None = None):
+        super().__init__(base_url)
+        self.root = Path(root)
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+    async def save(self, key: str, path: str | os.PathLike):
+        destination = self.path(key)
+        if Path(path) != destination:
+            await run_in_threadpool(destination.parent.mkdir, parents=True, exist_ok=True)
+            await run_in_threadpool(shutil.move, path, destination)
+
+    async def exists(self, key: str) -> bool:
+        return await run_in_threadpool(self.path(key).exists)
+
+    async def delete(self, key: str) -> bool:
+        try:
+            await run_in_threadpool(os.remove, self.path(key))
+            return True
+        except OSError as e:
+            # Handle the case where the file could not be deleted
+            logger.error(f"The media file {key} could not be deleted: {e}")
+            return False
+
+    async def read_head(self, key: str, size: int) -> bytes | None:
+        def read():
+            with open(self.path(key), 'rb') as file:
+                return file.read(size)
+
+        try:
+            return await run_in_threadpool(read)
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+
+    async def touch(self, key: str) -> bool:
+        try:
+            await run_in_threadpool(os.utime, self.path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    async def list(self, prefix: str) -> list[str]:
+        directory, _, name = prefix.rpartition('/')
+        paths = await run_in_threadpool(lambda: sorted(self.path(directory).glob(f'{name}*')))
+        return [f'{directory}/{path.name}' if directory else path.name for path in paths]
+
+    async def walk(self, prefix: str = '') -> AsyncIterator[tuple[str, int, float]]:
+        async for item in iterate_in_threadpool(self.__scan(self.path(prefix))):
+            yield item
+
+    def __scan(self, directory: Path) -> Iterator[tuple[str, int, float]]:
+        try:
+            entries = os.scandir(directory)
+        except FileNotFoundError:
+            return
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self.__scan(Path(entry.path))
+                elif entry.is_file(follow_symlinks=False):
+                    try:
+                        stat_result = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        # deleted while the tree is scanned
+                        continue
+                    key = Path(entry.path).relative_to(self.root).as_posix()
+                    yield key, stat_result.st_size, stat_result.st_mtime
+
+    async def move(self, key: str, destination: str):
+        await self.save(destination, self.path(key))
+
+    async def copy(self, key: str, destination: str):
+        destination = self.path(destination)
+        await run_in_threadpool(destination.parent.mkdir, parents=True, exist_ok=True)
+        # the copy is a new file (not `copy2`, which keeps the modification time), so the garbage collector skips it
+        # until its record is saved (see `MediaGarbageCollector.min_age`)
+        await run_in_threadpool(shutil.copy, self.path(key), destination)
+
+    async def prune(self, prefix: str):
+        try:
+            await run_in_threadpool(os.rmdir, self.path(prefix))
+        except OSError:
+            # not empty, or already removed
+            pass
+
+    @asynccontextmanager
+    async def local_copy(self, key: str) -> AsyncIterator[Path]:
+        yield self.path(key)
+
+    async def temp_directory(self, key: str) -> Path:
+        # on the same filesystem as the destination, so the file is moved by an atomic rename
+        directory = self.path(key)
+        await run_in_threadpool(directory.mkdir, parents=True, exist_ok=True)
+        return directory
+
+
+class S3Storage(BaseStorage):
+    """
+    The files in a bucket of S3, or of any S3-compatible storage (MinIO, R2, ...).
+
+    Files are uploaded with multipart uploads of `multipart_chunk_size` parts, so large files are sent in parallel
+    parts and never read at once into memory.
+    """
+
+    def __init__(self, bucket: str, base_url: str | None = None, client=None, endpoint_url: str | None = None,
+                 region_name: str | None = None, multipart_chunk_size: int = 8 * 1024 * 1024):
+        super().__init__(base_url)
+        if client is None:
+            import boto3
+            client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region_name)
+        self.client = client
+        self.bucket = bucket
+        self.multipart_chunk_size = multipart_chunk_size
+
+    async def save(self, key: str, path: str | os.PathLike):
+        from boto3.s3.transfer import TransferConfig
+
+        config = TransferConfig(multipart_threshold=self.multipart_chunk_size,
+                                multipart_chunksize=self.multipart_chunk_size)
+        await run_in_threadpool(self.client.upload_file, str(path), self.bucket, key, Config=config)
+        os.remove(path)
+
+    async def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            await run_in_threadpool(self.client.head_object, Bucket=self.bucket, Key=key)
+            return True
+        except ClientError:
+            return False
+
+    async def delete(self, key: str) -> bool:
+        await run_in_threadpool(self.client.delete_object, Bucket=self.bucket, Key=key)
+        return True
+
+    async def read_head(self, key: str, size: int) -> bytes | None:
+        from botocore.exceptions import ClientError
+
+        try:
+            response = await run_in_threadpool(self.client.get_object, Bucket=self.bucket, Key=key,
+                                               Range=f'bytes=0-{size - 1}')
+        except ClientError as e:
+            # an empty object has no byte range
+            if e.response.get('Error', {}).get('Code') == 'InvalidRange':
+                return b''
+            return None
+        return await run_in_threadpool(response['Body'].read)
+
+    async def touch(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        # an object is only modified by writing it, it's copied onto itself with the same metadata
+        try:
+            head = await run_in_threadpool(self.client.head_object, Bucket=self.bucket, Key=key)
+        except ClientError:
+            return False
+        await run_in_threadpool(
+            self.client.copy_object, Bucket=self.bucket, Key=key, CopySource={'Bucket': self.bucket, 'Key': key},
+            ContentType=head.get('ContentType', 'binary/octet-stream'), Metadata=head.get('Metadata', {}),
+            MetadataDirective='REPLACE')
+        return True
+
+    async def list(self, prefix: str) -> list[str]:
+        paginator = self.client.get_paginator('list_objects_v2')
+        pages = await run_in_threadpool(lambda: list(paginator.paginate(Bucket=self.bucket, Prefix=prefix)))
+        return [item['Key'] for page in pages for item in page.get('Contents', [])]
+
+    async def walk(self, prefix: str = '') -> AsyncIterator[tuple[str, int, float]]:
+        prefix = f'{prefix.rstrip("/")}/' if prefix else ''
+        pages = self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix)
+        # one request per page of (up to) 1000 keys
+        async for page in iterate_in_threadpool(iter(pages)):
+            for item in page.get('Contents', []):
+                yield item['Key'], item['Size'], item['LastModified'].timestamp()
+
+    async def move(self, key: str, destination: str):
+        await self.copy(key, destination)
+        await self.delete(key)
+
+    async def copy(self, key: str, destination: str):
+        source = {'Bucket': self.bucket, 'Key': key}
+        await run_in_threadpool(self.client.copy_object, Bucket=self.bucket, Key=destination, CopySource=source)
+
+    @asynccontextmanager
+    async def local_copy(self, key: str) -> AsyncIterator[Path]:
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / key.rsplit('/', 1)[-1]
+            await run_in_threadpool(self.client.download_file, self.bucket, key, str(path))
+            yield path
+
+    def url(self, key: str) -> str:
+        if self.base_url:
+            return super().url(key)
+        return f'{self.client.meta.endpoint_url}/{self.bucket}/{key}'
+
+    async def presigned_upload(self, key: str, content_type: str, max_size: int, expires: int) -> dict:
+        return await run_in_threadpool(
+            self.client.generate_presigned_post,
+            Bucket=self.bucket,
+            Key=key,
+            Fields={'Content-Type': content_type},
+            Conditions=[{'Content-Type': content_type}, ['content-length-range', 1, max_size]],
+            ExpiresIn=expires)
+
+
+class StorageManager:
+    """
+    Give access to the storage backend configured by `settings.MEDIA_STORAGE`.
+
+    Usage:
+        storage = StorageManager.get_backend()
+        await storage.save('products/1/image.jpg', '/tmp/upload')
+        url = storage.url('products/1/image.jpg')
+    """
+
+    backend: BaseStorage | None = None
+
+    @classmethod
+    def get_backend(cls) -> BaseStorage:
+        if cls.backend is None:
+            config = settings.MEDIA_STORAGE
+            if config['backend'] == 's3':
+                cls.backend = S3Storage(
+                    bucket=config['bucket'],
+                    base_url=config['url'],
+                    endpoint_url=config['endpoint_url'],
+                    region_name=config['region'])
+            else:
+                cls.backend = LocalStorage(cls.get_media_root(), base_url=config['url'])
+        return cls.backend
+
+    @staticmethod
+    def get_media_root() -> Path:
+        """
+        The root of the local storage, the tests have their own.
+        """
+
+        return MEDIA_DIR / 'test' if DatabaseManager.get_testing_mode() else MEDIA_DIR
+
+    @classmethod
+    def set_backend(cls, backend: BaseStorage | None):
+        """
+        Replace the storage backend, e.g. in tests. With `None` the backend is built again from the settings.
+        """
+
+        cls.backend = backend
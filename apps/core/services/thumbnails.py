@@ -0,0 +1,105 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image, UnidentifiedImageError
+from PIL.Image import DecompressionBombError
+
+from config.settings import MEDIA_THUMBNAIL_WIDTHS, MEDIA_THUMBNAIL_FORMATS, MEDIA_PROCESS_WORKERS
+
+PIL_FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'gif': 'GIF', 'webp': 'WEBP'}
+
+
+def process_image(source: str, widths: tuple[int, ...], formats: tuple[str | None, ...]) -> dict | None:
+    """
+    Decode an image once, to read its dimensions and dominant color, and to make its thumbnails: it's resized to each
+    of the widths (smaller than its own), in each of the formats, next to the image. The thumbnails of `image.jpg`
+    are named `image_<width>.<format>`.
+
+    It runs in the worker processes, so it's a module-level function (it must be picklable) and it's CPU-bound only.
+
+    Returns:
+        The width, height, size, placeholder (dominant color, e.g. `#3a6ea5`) and thumbnails (width, height, format
+        and file name) of the image. None if the file isn't an image, or is too large to decode (a decompression
+        bomb, over `Image.MAX_IMAGE_PIXELS`).
+    """
+
+    source = Path(source)
+    try:
+        with Image.open(source) as image:
+            image.load()
+            if image.mode not in ('RGB', 'RGBA', 'L'):
+                image = image.convert('RGBA')
+
+            return {
+                'width': image.width,
+                'height': image.height,
+                'size': source.stat().st_size,
+                'placeholder': dominant_color(image),
+                'thumbnails': resize(image, source, widths, formats)
+            }
+    except (UnidentifiedImageError, DecompressionBombError, OSError):
+        # an error would fail the processing of all the images of the upload
+        return None
+
+
+def resize(image: Image.Image, source: Path, widths: tuple[int, ...], formats: tuple[str | None, ...]) -> list[dict]:
+    thumbnails = []
+    for width in sorted(widths):
+        if width >= image.width:
+            break
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS)
+
+        for extension in formats:
+            extension = (extension or source.suffix.lstrip('.')).lower()
+            pil_format = PIL_FORMATS.get(extension)
+            if pil_format is None:
+                continue
+
+            file_name = f'{source.stem}_{width}.{extension}'
+            output = resized.convert('RGB') if pil_format == 'JPEG' and resized.mode != 'RGB' else resized
+            output.save(source.with_name(file_name), pil_format, optimize=True)
+            thumbnails.append({'width': width, 'height': height, 'format': extension, 'src': file_name})
+    return thumbnails
+
+
+def dominant_color(image: Image.Image) -> str:
+    """
+    The most common color of an image, among a palette of 8 colors of a small copy of it.
+    """
+
+    small = image.convert('RGB').resize((64, 64), Image.BOX)
+    palette = small.quantize(colors=8)
+    _, index = max(palette.getcolors())
+    red, green, blue = palette.getpalette()[index * 3:index * 3 + 3]
+    return f'#{red:02x}{green:02x}{blue:02x}'
+
+
+class ThumbnailService:
+    """
+    Make the thumbnails of the uploaded images in a pool of processes, off the event loop.
+
+    Usage:
+        processed = await ThumbnailService.generate('/path/to/image.jpg')
+        processed['placeholder'], processed['thumbnails']
+    """
+
+    executor: ProcessPoolExecutor | None = None
+
+    @classmethod
+    def get_executor(cls) -> ProcessPoolExecutor:
+        if cls.executor is None:
+            cls.executor = ProcessPoolExecutor(max_workers=MEDIA_PROCESS_WORKERS)
+        return cls.executor
+
+    @classmethod
+    async def generate(cls, source: str | os.PathLike) -> dict | None:
+        """
+        Process an image (see `process_image`) in the pool: its thumbnails are made next to it.
+        """
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            cls.get_executor(), process_image, str(source), MEDIA_THUMBNAIL_WIDTHS, MEDIA_THUMBNAIL_FORMATS)
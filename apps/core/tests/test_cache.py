@@ -0,0 +1,89 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+from fakeredis import aioredis
+
+from apps.core.services.cache import InMemoryCache, RedisCache
+
+
+class CacheBackendTests:
+    """
+    The behaviour shared by all the cache backends, `make_cache` returns the backend under test.
+    """
+
+    def make_cache(self, ttl: int = 300):
+        raise NotImplementedError
+
+    @pytest.mark.asyncio
+    async def test_set_get_delete(self):
+        cache = self.make_cache()
+
+        assert await cache.get('product:1') is None
+        await cache.set('product:1', {'product_id': 1, 'price': Decimal('10.50')})
+        assert await cache.get('product:1') == {'product_id': 1, 'price': 10.5}
+
+        await cache.delete('product:1', 'product:2')
+        assert await cache.get('product:1') is None
+
+    @pytest.mark.asyncio
+    async def test_get_returns_a_copy(self):
+        cache = self.make_cache()
+
+        await cache.set('product:1', {'media': [{'src': 'media/products/1/a.png'}]})
+        (await cache.get('product:1'))['media'][0]['src'] = 'changed'
+        assert (await cache.get('product:1'))['media'][0]['src'] == 'media/products/1/a.png'
+
+    @pytest.mark.asyncio
+    async def test_ttl(self):
+        cache = self.make_cache(ttl=1)
+
+        await cache.set('product:1', {'product_id': 1})
+        await asyncio.sleep(1.1)
+        assert await cache.get('product:1') is None
+
+    @pytest.mark.asyncio
+    async def test_clear(self):
+        cache = self.make_cache()
+
+        await cache.set('product:1', 1)
+        await cache.set('product:2', 2)
+        await cache.clear()
+        assert await cache.get('product:1') is None
+        assert await cache.get('product:2') is None
+
+
+class TestInMemoryCache(CacheBackendTests):
+
+    def make_cache(self, ttl: int = 300):
+        return InMemoryCache(ttl=ttl, max_entries=3)
+
+    @pytest.mark.asyncio
+    async def test_evict_least_recently_used(self):
+        cache = self.make_cache()
+
+        for i in range(1, 4):
+            await cache.set(f'product:{i}', i)
+        await cache.get('product:1')
+        await cache.set('product:4', 4)
+
+        assert await cache.get('product:2') is None
+        assert [await cache.get(f'product:{i}') for i in (1, 3, 4)] == [1, 3, 4]
+
+
+class TestRedisCache(CacheBackendTests):
+
+    def make_cache(self, ttl: int = 300):
+        return RedisCache(ttl=ttl, client=aioredis.FakeRedis())
+
+    @pytest.mark.asyncio
+    async def test_keys_are_prefixed(self):
+        client = aioredis.FakeRedis()
+        await client.set('other-app:1', 'value')
+        cache = RedisCache(client=client, prefix='fast-store:')
+
+        await cache.set('product:1', 1)
+        await cache.clear()
+
+        assert await client.get('fast-store:product:1') is None
+        assert await client.get('other-app:1') == b'value'
@@ -0,0 +1,214 @@
+import asyncio
+import smtplib
+import socket
+import time
+
+import pytest
+
+from apps.core.services.email_queue import EmailQueue, SMTPConnection
+
+
+class SMTPHandler:
+    """
+    The handler of the local SMTP server: it keeps the received emails, and answers `replies` (e.g. a temporary error)
+    to the first emails.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.peers = set()
+        self.logins = 0
+        self.replies = []
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.replies:
+            return self.replies.pop(0)
+        self.messages.append(envelope)
+        self.peers.add(session.peer)
+        return '250 Message accepted for delivery'
+
+    def authenticate(self, server, session, envelope, mechanism, auth_data):
+        from aiosmtpd.smtp import AuthResult
+
+        self.logins += 1
+        return AuthResult(success=auth_data.password == b'password')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class EmailQueueTestBase:
+
+    @pytest.fixture
+    def smtp_server(self):
+        """
+        A local SMTP server (aiosmtpd) in place of the real one.
+        """
+
+        controller_module = pytest.importorskip('aiosmtpd.controller')
+        handler = SMTPHandler()
+        controller = controller_module.Controller(handler, hostname='127.0.0.1', port=free_port(),
+                                                  authenticator=handler.authenticate, auth_require_tls=False)
+        controller.start()
+        yield handler, controller
+        controller.stop()
+
+    @staticmethod
+    def make_queue(port: int, **kwargs) -> EmailQueue:
+        connection = SMTPConnection('127.0.0.1', port, 'shop@example.com', 'password', security='none', timeout=5)
+        return EmailQueue(connection, batch_size=kwargs.pop('batch_size', 20), backoff=kwargs.pop('backoff', 0.01),
+                          **kwargs)
+
+
+class TestEmailQueue(EmailQueueTestBase):
+
+    @pytest.mark.asyncio
+    async def test_send_batch_over_one_connection(self, smtp_server):
+        handler, controller = smtp_server
+        queue = self.make_queue(controller.port)
+
+        for i in range(5):
+            queue.enqueue(f'user{i}@example.com', 'Email Verification', f'code: {i}')
+        # --- enqueue doesn't wait for the SMTP server ---
+        assert handler.messages == []
+
+        await queue.join()
+        assert sorted(envelope.rcpt_tos[0] for envelope in handler.messages) == [
+            f'user{i}@example.com' for i in range(5)]
+        assert handler.messages[0].mail_from == 'shop@example.com'
+        assert b'Subject: Email Verification' in handler.messages[0].content
+        assert queue.stats == {'sent': 5, 'retried': 0, 'failed': 0}
+        assert len(handler.peers) == 1
+        assert handler.logins == 1
+        await queue.close()
+
+    @pytest.mark.asyncio
+    async def test_reuse_connection(self, smtp_server):
+        handler, controller = smtp_server
+        queue = self.make_queue(controller.port, batch_size=2)
+
+        for i in range(3):
+            queue.enqueue('user@example.com', 'Subject', 'body')
+            await queue.join()
+
+        assert len(handler.messages) == 3
+        assert len(handler.peers) == 1
+        assert handler.logins == 1
+        await queue.close()
+
+    @pytest.mark.asyncio
+    async def test_reconnect_after_idle_timeout(self, smtp_server):
+        handler, controller = smtp_server
+        queue = self.make_queue(controller.port)
+        queue.connection.idle_timeout = 0
+
+        for i in range(2):
+            queue.enqueue('user@example.com', 'Subject', 'body')
+            await queue.join()
+
+        assert len(handler.messages) == 2
+        assert handler.logins == 2
+        await queue.close()
+
+    @pytest.mark.asyncio
+    async def test_retry_temporary_error(self, smtp_server):
+        handler, controller = smtp_server
+        handler.replies = ['451 Try again later', '451 Try again later']
+        queue = self.make_queue(controller.port)
+
+        queue.enqueue('user@example.com', 'Subject', 'body')
+        await queue.join()
+
+        assert len(handler.messages) == 1
+        assert queue.stats == {'sent': 1, 'retried': 2, 'failed': 0}
+        await queue.close()
+
+    @pytest.mark.asyncio
+    async def test_permanent_error_is_not_retried(self, smtp_server):
+        handler, controller = smtp_server
+        handler.replies = ['550 No such user']
+        queue = self.make_queue(controller.port)
+
+        queue.enqueue('unknown@example.com', 'Subject', 'body')
+        queue.enqueue('user@example.com', 'Subject', 'body')
+        await queue.join()
+
+        # --- the other emails of the batch are still sent ---
+        assert [envelope.rcpt_tos for envelope in handler.messages] == [['user@example.com']]
+        assert queue.stats == {'sent': 1, 'retried': 0, 'failed': 1}
+        await queue.close()
+
+    @pytest.mark.asyncio
+    async def test_server_unreachable(self):
+        queue = self.make_queue(free_port(), max_attempts=3)
+
+        queue.enqueue('user@example.com', 'Subject', 'body')
+        await queue.join()
+
+        assert queue.stats == {'sent': 0, 'retried': 2, 'failed': 1}
+        await queue.close()
+
+    @pytest.mark.asyncio
+    async def test_close_doesnt_wait_for_backoff(self, smtp_server):
+        """
+        Test `close` sends the emails waiting for a retry at once, rather than after their backoff.
+        """
+
+        handler, controller = smtp_server
+        handler.replies = ['451 Try again later']
+        queue = self.make_queue(controller.port, backoff=30)
+
+        queue.enqueue('user@example.com', 'Subject', 'body')
+        while not queue.stats['retried']:
+            await asyncio.sleep(0.01)
+
+        start = time.monotonic()
+        await queue.close()
+        assert time.monotonic() - start < 5
+        assert len(handler.messages) == 1
+        assert queue.stats == {'sent': 1, 'retried': 1, 'failed': 0}
+
+    def test_emails_of_previous_event_loop(self, smtp_server):
+        """
+        Test the emails left in the queue, or waiting for a retry, by an event loop that stopped are sent by the
+        worker of the next one.
+        """
+
+        handler, controller = smtp_server
+        handler.replies = ['451 Try again later']
+        queue = self.make_queue(controller.port, batch_size=1, backoff=30)
+
+        async def enqueue_and_stop():
+            queue.enqueue('retried@example.com', 'Subject', 'body')
+            while not queue.stats['retried']:
+                await asyncio.sleep(0.01)
+            # the loop stops while the worker sends the first one, the second one is still queued
+            queue.enqueue('sending@example.com', 'Subject', 'body')
+            queue.enqueue('queued@example.com', 'Subject', 'body')
+
+        async def enqueue_and_close():
+            queue.enqueue('user@example.com', 'Subject', 'body')
+            await queue.close()
+
+        asyncio.run(enqueue_and_stop())
+        asyncio.run(enqueue_and_close())
+        assert {'queued@example.com', 'retried@example.com', 'user@example.com'} <= \
+               {envelope.rcpt_tos[0] for envelope in handler.messages}
+
+
+class TestTemporaryErrors:
+
+    @pytest.mark.parametrize('error, expected', [
+        (smtplib.SMTPResponseException(451, b'Try again later'), True),
+        (smtplib.SMTPResponseException(550, b'No such user'), False),
+        (smtplib.SMTPAuthenticationError(535, b'Authentication failed'), False),
+        (smtplib.SMTPRecipientsRefused({'user@example.com': (450, b'Mailbox busy')}), True),
+        (smtplib.SMTPRecipientsRefused({'user@example.com': (550, b'No such user')}), False),
+        (smtplib.SMTPServerDisconnected('Connection unexpectedly closed'), True),
+        (ConnectionRefusedError(), True),
+    ])
+    def test_is_temporary(self, error, expected):
+        assert EmailQueue.is_temporary(error) is expected
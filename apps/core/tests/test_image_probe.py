@@ -0,0 +1,46 @@
+import io
+
+import pytest
+from PIL import Image
+
+from apps.core.services.image_probe import ImageProbe
+
+
+class TestImageProbe:
+
+    @staticmethod
+    def probe(content: bytes, chunk_size: int) -> ImageProbe:
+        probe = ImageProbe()
+        for i in range(0, len(content), chunk_size):
+            probe.feed(content[i:i + chunk_size])
+        return probe
+
+    @pytest.mark.parametrize('pil_format, image_format, extension', [
+        ('JPEG', 'jpeg', 'jpg'), ('PNG', 'png', 'png'), ('GIF', 'gif', 'gif'), ('WEBP', 'webp', 'webp')])
+    @pytest.mark.parametrize('chunk_size', [5, 64 * 1024])
+    def test_probe_image(self, pil_format, image_format, extension, chunk_size):
+        """
+        Test the format, dimensions and size of an image are read from its chunks, whatever their size.
+        """
+
+        image = io.BytesIO()
+        Image.new('RGB', (1234, 567)).save(image, pil_format)
+        content = image.getvalue()
+
+        probe = self.probe(content, chunk_size)
+        assert (probe.format, probe.extension) == (image_format, extension)
+        assert (probe.width, probe.height, probe.size) == (1234, 567, len(content))
+
+    def test_probe_other_file(self):
+        probe = self.probe(b'%PDF-1.7 not an image' * 100, 64)
+        assert probe.format is probe.width is probe.height is None
+        assert probe.size == 2100
+
+    def test_truncated_image(self):
+        """
+        Test a file with an image signature but no valid header has no dimensions.
+        """
+
+        probe = self.probe(b'\x89PNG\r\n\x1a\n' + b'\0' * 100, 16)
+        assert probe.format == 'png'
+        assert probe.width is None
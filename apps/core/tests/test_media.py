@@ -0,0 +1,236 @@
+import asyncio
+import hashlib
+import io
+import os
+import time
+
+import pytest
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+from starlette.datastructures import Headers
+
+from apps.core.services.media import MediaService
+from apps.core.services.storage import StorageManager, LocalStorage
+from config import settings
+
+
+class MediaTestBase:
+
+    @pytest.fixture(autouse=True)
+    def local_storage(self, tmp_path):
+        StorageManager.set_backend(LocalStorage(tmp_path))
+        yield
+        StorageManager.set_backend(None)
+
+
+class TestSaveFile(MediaTestBase):
+    """
+    Test streaming the uploads to the storage.
+    """
+
+    @staticmethod
+    def make_media_service() -> MediaService:
+        return MediaService(parent_directory='uploads')
+
+    @pytest.mark.asyncio
+    async def test_save_file(self, tmp_path):
+        """
+        Test an upload larger than a chunk is saved as is, and no temporary file is left.
+        """
+
+        content = os.urandom(settings.UPLOAD_CHUNK_SIZE * 3 + 10)
+        upload = UploadFile(filename='image.png', file=io.BytesIO(content))
+
+        saved = await self.make_media_service().save_file(upload)
+
+        assert saved['type'] == 'png'
+        assert saved['size'] == len(content)
+        assert saved['width'] is None and saved['height'] is None
+        assert os.listdir(tmp_path / 'uploads') == [saved['src']]
+        assert (tmp_path / 'uploads' / saved['src']).read_bytes() == content
+
+    @pytest.mark.asyncio
+    async def test_save_image(self, tmp_path):
+        """
+        Test an image is saved with the extension of its real format, and its dimensions are read on the way.
+        """
+
+        image = io.BytesIO()
+        Image.new('RGB', (640, 480)).save(image, 'PNG')
+        upload = UploadFile(filename='image.jpg', file=io.BytesIO(image.getvalue()))
+
+        saved = await self.make_media_service().save_file(upload)
+
+        assert saved['src'].endswith('.png')
+        assert (saved['type'], saved['width'], saved['height']) == ('png', 640, 480)
+        assert saved['size'] == len(image.getvalue())
+
+    @pytest.mark.asyncio
+    async def test_save_file_too_large(self, tmp_path):
+        """
+        Test an upload is aborted as soon as it exceeds `MAX_FILE_SIZE`, and nothing is left on the disk.
+        """
+
+        upload = UploadFile(filename='large.png', file=io.BytesIO(b'\0' * (settings.MAX_FILE_SIZE * 1024 * 1024 + 1)))
+
+        with pytest.raises(HTTPException) as error:
+            await self.make_media_service().save_file(upload)
+        assert error.value.status_code == 400
+        assert os.listdir(tmp_path / 'uploads') == []
+
+    @pytest.mark.asyncio
+    async def test_is_allowed_file_size(self):
+        """
+        Test the size of an upload is checked without reading it.
+        """
+
+        max_size = settings.MAX_FILE_SIZE * 1024 * 1024
+        assert await MediaService.is_allowed_file_size(UploadFile(file=io.BytesIO(), size=max_size)) is True
+
+        with pytest.raises(HTTPException):
+            await MediaService.is_allowed_file_size(UploadFile(file=io.BytesIO(), size=max_size + 1))
+
+
+class TestSaveFiles(MediaTestBase):
+    """
+    Test saving many uploads concurrently.
+    """
+
+    @pytest.mark.asyncio
+    async def test_bounded_concurrency(self, monkeypatch, tmp_path):
+        """
+        Test the uploads are saved at the same time, but never more than `concurrency` at once, in their order.
+        """
+
+        media_service = MediaService(parent_directory='uploads')
+        running, max_running = 0, 0
+        save = media_service.storage.save
+
+        async def slow_save(key, path):
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            await save(key, path)
+            running -= 1
+
+        monkeypatch.setattr(media_service.storage, 'save', slow_save)
+        uploads = [UploadFile(filename=f'image-{i}.png', file=io.BytesIO(bytes([i]))) for i in range(10)]
+
+        saved = await media_service.save_files(uploads, concurrency=3)
+
+        assert max_running == 3
+        assert [(tmp_path / 'uploads' / file_name).read_bytes() for file_name in [item['src'] for item in saved]] == \
+               [bytes([i]) for i in range(10)]
+
+    @pytest.mark.asyncio
+    async def test_failed_upload(self, tmp_path):
+        """
+        Test the files saved with a failed upload are deleted.
+        """
+
+        too_large = b'\0' * (settings.MAX_FILE_SIZE * 1024 * 1024 + 1)
+        uploads = [UploadFile(filename='image.png', file=io.BytesIO(b'image')),
+                   UploadFile(filename='large.png', file=io.BytesIO(too_large))]
+
+        with pytest.raises(HTTPException):
+            await MediaService(parent_directory='uploads').save_files(uploads)
+        assert os.listdir(tmp_path / 'uploads') == []
+
+    @pytest.mark.asyncio
+    async def test_validate_files(self):
+        max_size = settings.MAX_FILE_SIZE * 1024 * 1024
+        uploads = [UploadFile(file=io.BytesIO(b'\x89PNG\r\n\x1a\n'), size=max_size) for _ in range(3)]
+        assert await MediaService.validate_files(uploads) is True
+
+        with pytest.raises(HTTPException):
+            await MediaService.validate_files(uploads + [UploadFile(file=io.BytesIO(b'GIF89a'), size=max_size + 1)])
+
+    @pytest.mark.asyncio
+    async def test_content_type_is_not_trusted(self):
+        """
+        Test the type of an upload is sniffed from its content, not taken from its `Content-Type`.
+        """
+
+        script = UploadFile(file=io.BytesIO(b'<script>alert(1)</script>'),
+                            headers=Headers({'content-type': 'image/png'}))
+        with pytest.raises(HTTPException) as error:
+            await MediaService.is_allowed_type(script)
+        assert error.value.detail == 'Invalid file type'
+
+        jpeg = UploadFile(file=io.BytesIO(b'\xff\xd8\xff\xe0'), headers=Headers({'content-type': 'text/plain'}))
+        assert await MediaService.is_allowed_type(jpeg) is True
+
+
+class TestShardedLayout(MediaTestBase):
+    """
+    Test the hashed fan-out of the media directories.
+    """
+
+    @pytest.fixture(autouse=True)
+    def sharded_layout(self, monkeypatch):
+        monkeypatch.setattr(settings, 'MEDIA_SHARDED_LAYOUT', True)
+
+    def test_sharded_prefix(self):
+        digest = hashlib.sha256(b'42').hexdigest()
+        assert MediaService.get_sharded_prefix('/products', 42) == f'products/{digest[:2]}/{digest[2:4]}/42'
+
+    @pytest.mark.asyncio
+    async def test_save_file(self, tmp_path):
+        """
+        Test an upload is saved in the sharded directory and returned as a key, and a plain name is still found in
+        the old directory.
+        """
+
+        media_service = MediaService(parent_directory='products', sub_directory=42)
+        saved = await media_service.save_file(UploadFile(filename='image.png', file=io.BytesIO(b'image')))
+
+        prefix = MediaService.get_sharded_prefix('products', 42)
+        assert saved['src'].startswith(f'{prefix}/')
+        assert media_service.get_key(saved['src']) == saved['src']
+        assert (tmp_path / saved['src']).read_bytes() == b'image'
+        assert media_service.get_key('image.png') == 'products/42/image.png'
+
+
+class TestContentAddressedStorage(MediaTestBase):
+    """
+    Test saving the uploads once, under the hash of their content.
+    """
+
+    @pytest.fixture(autouse=True)
+    def content_addressed(self, monkeypatch):
+        monkeypatch.setattr(settings, 'MEDIA_CONTENT_ADDRESSED', True)
+
+    @pytest.mark.asyncio
+    async def test_same_content_is_stored_once(self, tmp_path):
+        """
+        Test uploading the same content twice gives the same key and a single file, named by its SHA-256.
+        """
+
+        content = os.urandom(1000)
+        digest = hashlib.sha256(content).hexdigest()
+
+        keys = [
+            (await MediaService(parent_directory='products', sub_directory=i).save_file(
+                UploadFile(filename=f'image-{i}.png', file=io.BytesIO(content))))['src']
+            for i in (1, 2)
+        ]
+
+        assert keys == [f'blobs/{digest[:2]}/{digest[2:4]}/{digest}.png'] * 2
+        assert (tmp_path / keys[0]).read_bytes() == content
+        assert os.listdir(tmp_path / 'blobs' / digest[:2] / digest[2:4]) == [f'{digest}.png']
+
+    @pytest.mark.asyncio
+    async def test_same_content_renews_the_blob(self, tmp_path):
+        """
+        Test uploading the content of an old blob again makes it as young as a new upload, so the garbage collector
+        doesn't remove it before the new record that references it is saved.
+        """
+
+        media_service = MediaService()
+        key = (await media_service.save_file(UploadFile(filename='image.png', file=io.BytesIO(b'image'))))['src']
+        os.utime(tmp_path / key, (0, 0))
+
+        assert (await media_service.save_file(UploadFile(filename='image.png', file=io.BytesIO(b'image'))))['src'] \
+               == key
+        assert time.time() - os.path.getmtime(tmp_path / key) < 60
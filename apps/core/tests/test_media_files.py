@@ -0,0 +1,211 @@
+import asyncio
+from email.utils import formatdate, parsedate_to_datetime
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from apps.core.services.media_files import MediaFiles
+
+CONTENT = bytes(range(256)) * 4
+HASHED_NAME = 'ab' * 32 + '.jpg'
+
+
+class MediaFilesTestBase:
+
+    @pytest.fixture
+    def directory(self, tmp_path):
+        (tmp_path / 'products' / '1').mkdir(parents=True)
+        (tmp_path / 'products' / '1' / HASHED_NAME).write_bytes(CONTENT)
+        (tmp_path / 'products' / '1' / 'logo.svg').write_bytes(b'<svg></svg>')
+        (tmp_path / 'products' / '1' / 'logo.svg.br').write_bytes(b'brotli')
+        (tmp_path / 'secret.txt').write_bytes(b'secret')
+        return tmp_path / 'products'
+
+    @pytest.fixture
+    def client(self, directory):
+        app = FastAPI()
+        app.mount('/media', MediaFiles(directory=directory, accel_redirect=None, immutable_max_age=3600))
+        return TestClient(app)
+
+
+class TestServeMediaFiles(MediaFilesTestBase):
+
+    def test_get_file(self, client):
+        response = client.get(f'/media/1/{HASHED_NAME}')
+        assert response.status_code == 200
+        assert response.content == CONTENT
+        assert response.headers['content-type'] == 'image/jpeg'
+        assert response.headers['content-length'] == str(len(CONTENT))
+        assert response.headers['accept-ranges'] == 'bytes'
+        assert response.headers['etag']
+        assert response.headers['last-modified']
+
+    def test_head_file(self, client):
+        response = client.head(f'/media/1/{HASHED_NAME}')
+        assert response.status_code == 200
+        assert response.content == b''
+        assert response.headers['content-length'] == str(len(CONTENT))
+
+    def test_immutable_cache_control(self, client):
+        # a content-hashed (or random) name never changes, the clients don't have to revalidate it
+        response = client.get(f'/media/1/{HASHED_NAME}')
+        assert response.headers['cache-control'] == 'public, max-age=3600, immutable'
+
+        response = client.get('/media/1/logo.svg')
+        assert 'immutable' not in response.headers['cache-control']
+
+    def test_not_modified(self, client):
+        response = client.get(f'/media/1/{HASHED_NAME}')
+
+        response = client.get(f'/media/1/{HASHED_NAME}', headers={'If-None-Match': response.headers['etag']})
+        assert response.status_code == 304
+        assert response.content == b''
+
+        response = client.get(f'/media/1/{HASHED_NAME}',
+                              headers={'If-Modified-Since': response.headers['last-modified']})
+        assert response.status_code == 304
+
+        response = client.get(f'/media/1/{HASHED_NAME}', headers={'If-None-Match': '"other"'})
+        assert response.status_code == 200
+
+    def test_not_found(self, client):
+        assert client.get('/media/1/missing.jpg').status_code == 404
+        assert client.get('/media/1').status_code == 404
+
+    def test_path_traversal(self, client):
+        assert client.get('/media/../secret.txt').status_code == 404
+        assert client.get('/media/1/..%2F..%2Fsecret.txt').status_code == 404
+
+    def test_quarantine_is_not_served(self, client, directory):
+        """
+        Test the files quarantined by the garbage collector (unreferenced) aren't downloadable.
+        """
+
+        (directory / 'quarantine' / '1').mkdir(parents=True)
+        (directory / 'quarantine' / '1' / HASHED_NAME).write_bytes(CONTENT)
+
+        assert client.get(f'/media/quarantine/1/{HASHED_NAME}').status_code == 404
+        assert client.get(f'/media/1/../quarantine/1/{HASHED_NAME}').status_code == 404
+
+    def test_method_not_allowed(self, client):
+        response = client.post(f'/media/1/{HASHED_NAME}')
+        assert response.status_code == 405
+        assert response.headers['allow'] == 'GET, HEAD'
+
+
+class TestMediaFilesRange(MediaFilesTestBase):
+
+    def test_range(self, client):
+        response = client.get(f'/media/1/{HASHED_NAME}', headers={'Range': 'bytes=10-19'})
+        assert response.status_code == 206
+        assert response.content == CONTENT[10:20]
+        assert response.headers['content-range'] == f'bytes 10-19/{len(CONTENT)}'
+        assert response.headers['content-length'] == '10'
+
+    def test_open_and_suffix_range(self, client):
+        response = client.get(f'/media/1/{HASHED_NAME}', headers={'Range': 'bytes=1000-'})
+        assert response.status_code == 206
+        assert response.content == CONTENT[1000:]
+
+        response = client.get(f'/media/1/{HASHED_NAME}', headers={'Range': 'bytes=-5'})
+        assert response.status_code == 206
+        assert response.content == CONTENT[-5:]
+        assert response.headers['content-range'] == f'bytes {len(CONTENT) - 5}-{len(CONTENT) - 1}/{len(CONTENT)}'
+
+    def test_range_not_satisfiable(self, client):
+        response = client.get(f'/media/1/{HASHED_NAME}', headers={'Range': f'bytes={len(CONTENT)}-'})
+        assert response.status_code == 416
+        assert response.headers['content-range'] == f'bytes */{len(CONTENT)}'
+
+    def test_invalid_range_is_ignored(self, client):
+        for byte_range in ('bytes=0-1,5-6', 'items=0-1', 'bytes=5-1'):
+            response = client.get(f'/media/1/{HASHED_NAME}', headers={'Range': byte_range})
+            assert response.status_code == 200
+            assert response.content == CONTENT
+
+    def test_if_range(self, client):
+        etag = client.get(f'/media/1/{HASHED_NAME}').headers['etag']
+
+        response = client.get(f'/media/1/{HASHED_NAME}', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+        assert response.status_code == 206
+
+        # the file changed since the client got the first part: the whole file is sent
+        response = client.get(f'/media/1/{HASHED_NAME}', headers={'Range': 'bytes=0-9', 'If-Range': '"old"'})
+        assert response.status_code == 200
+        assert response.content == CONTENT
+
+    def test_if_range_date(self, client):
+        last_modified = client.get(f'/media/1/{HASHED_NAME}').headers['last-modified']
+
+        response = client.get(f'/media/1/{HASHED_NAME}', headers={'Range': 'bytes=0-9', 'If-Range': last_modified})
+        assert response.status_code == 206
+
+        # only the exact date matches, the file may have changed before a later one
+        later = formatdate(parsedate_to_datetime(last_modified).timestamp() + 60, usegmt=True)
+        response = client.get(f'/media/1/{HASHED_NAME}', headers={'Range': 'bytes=0-9', 'If-Range': later})
+        assert response.status_code == 200
+        assert response.content == CONTENT
+
+
+class TestMediaFilesDelivery(MediaFilesTestBase):
+
+    def test_precompressed_sibling(self, client):
+        response = client.get('/media/1/logo.svg', headers={'Accept-Encoding': 'br, gzip'})
+        assert response.headers['content-encoding'] == 'br'
+        assert response.headers['vary'] == 'Accept-Encoding'
+        assert response.headers['content-type'] == 'image/svg+xml'
+
+        response = client.get('/media/1/logo.svg', headers={'Accept-Encoding': 'gzip'})
+        assert 'content-encoding' not in response.headers
+        assert response.content == b'<svg></svg>'
+
+        # --- an encoding refused with `q=0` ---
+        response = client.get('/media/1/logo.svg', headers={'Accept-Encoding': 'br;q=0, gzip'})
+        assert 'content-encoding' not in response.headers
+        assert response.content == b'<svg></svg>'
+
+    @pytest.mark.parametrize('accept_encoding, expected', [
+        ('', set()),
+        ('br, gzip', {'br', 'gzip'}),
+        ('gzip;q=0', set()),
+        ('GZIP; q=0.5, br;q=0.0', {'gzip'}),
+        ('*', {'br', 'gzip'}),
+        ('*;q=0.1, br;q=0', {'gzip'}),
+        ('identity', set()),
+    ])
+    def test_accepted_encodings(self, accept_encoding, expected):
+        assert MediaFiles.accepted_encodings(accept_encoding) == expected
+
+    def test_accel_redirect(self, directory):
+        app = FastAPI()
+        app.mount('/media', MediaFiles(directory=directory, accel_redirect='/protected-media/'))
+
+        response = TestClient(app).get(f'/media/1/{HASHED_NAME}')
+        assert response.status_code == 200
+        assert response.content == b''
+        assert response.headers['x-accel-redirect'] == f'/protected-media/1/{HASHED_NAME}'
+        assert 'immutable' in response.headers['cache-control']
+
+    def test_zerocopysend(self, directory):
+        # the servers that support sendfile announce it with the `http.response.zerocopysend` extension
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.zerocopysend':
+                message['file'].seek(message['offset'])
+                message = {**message, 'body': message['file'].read(message['count'])}
+            messages.append(message)
+
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': f'/1/{HASHED_NAME}', 'headers': [(b'range', b'bytes=4-7')],
+            'extensions': {'http.response.zerocopysend': {}}
+        }
+        asyncio.run(MediaFiles(directory=directory)(scope, receive, send))
+
+        assert messages[0]['status'] == 206
+        assert messages[1]['type'] == 'http.response.zerocopysend'
+        assert messages[1]['body'] == CONTENT[4:8]
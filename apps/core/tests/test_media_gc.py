@@ -0,0 +1,94 @@
+import os
+import time
+
+import pytest
+
+from apps.core.services.media_gc import MediaGarbageCollector
+from apps.core.services.storage import LocalStorage
+
+
+class TestMediaGarbageCollector:
+
+    @pytest.fixture
+    def storage(self, tmp_path):
+        storage = LocalStorage(tmp_path)
+        an_hour_ago = time.time() - 3600
+        for key in ('products/1/kept.jpg', 'products/1/orphan.jpg', 'products/2/orphan_150.webp',
+                    'blobs/ab/cd/orphan.png', 'other/ignored.jpg'):
+            path = tmp_path / key
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b'x' * 10)
+            os.utime(path, (an_hour_ago, an_hour_ago))
+        return storage
+
+    @staticmethod
+    def make_references(referenced: set[str], batches: list | None = None):
+        async def references(keys):
+            keys = set(keys)
+            if batches is not None:
+                batches.append(keys)
+            return keys & referenced
+
+        return references
+
+    def make_collector(self, storage, **kwargs):
+        kwargs = {'prefixes': ('products', 'blobs'), 'batch_size': 2, 'rate': None, 'min_age': 60, **kwargs}
+        return MediaGarbageCollector(self.make_references({'products/1/kept.jpg'}), storage=storage, **kwargs)
+
+    @pytest.mark.asyncio
+    async def test_delete_orphans(self, storage, tmp_path):
+        report = await self.make_collector(storage).run()
+
+        assert report['scanned'] == 4
+        assert report['scanned_bytes'] == 40
+        assert report['orphans'] == report['removed'] == 3
+        assert report['reclaimed_bytes'] == 30
+        assert report['failed'] == 0
+        assert sorted([key async for key, _, _ in storage.walk('')]) == ['other/ignored.jpg', 'products/1/kept.jpg']
+
+    @pytest.mark.asyncio
+    async def test_dry_run(self, storage):
+        report = await self.make_collector(storage, dry_run=True).run()
+
+        assert report['orphans'] == 3
+        assert report['orphan_bytes'] == 30
+        assert report['removed'] == report['reclaimed_bytes'] == 0
+        assert len([key async for key, _, _ in storage.walk('')]) == 5
+
+    @pytest.mark.asyncio
+    async def test_quarantine(self, storage, tmp_path):
+        report = await self.make_collector(storage, quarantine='quarantine').run()
+
+        assert report['removed'] == 3
+        assert (tmp_path / 'quarantine/products/1/orphan.jpg').exists()
+        assert (tmp_path / 'quarantine/blobs/ab/cd/orphan.png').exists()
+        assert not (tmp_path / 'products/1/orphan.jpg').exists()
+
+    @pytest.mark.asyncio
+    async def test_recent_files_are_skipped(self, storage, tmp_path):
+        """
+        Test a file that may be an upload in flight (not saved in the database yet) isn't collected.
+        """
+
+        (tmp_path / 'products/1/uploading.jpg').write_bytes(b'x')
+
+        report = await self.make_collector(storage).run()
+        assert report['skipped'] == 1
+        assert (tmp_path / 'products/1/uploading.jpg').exists()
+
+    @pytest.mark.asyncio
+    async def test_batches(self, storage):
+        batches = []
+        collector = self.make_collector(storage)
+        collector.references = self.make_references(set(), batches)
+
+        await collector.run()
+        assert [len(batch) for batch in batches] == [2, 1, 1]
+
+    @pytest.mark.asyncio
+    async def test_rate_limit(self, storage):
+        started = time.monotonic()
+        await self.make_collector(storage, rate=20).run()
+
+        # 3 removals at 20 per second: the 2 last ones wait for their turn
+        assert time.monotonic() - started >= 0.1
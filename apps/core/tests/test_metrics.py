@@ -0,0 +1,199 @@
+import asyncio
+import io
+import threading
+
+import pytest
+from fastapi import UploadFile
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+
+from apps.accounts.services.password import PasswordManager
+from apps.core.services import metrics
+from apps.core.services.cache import CacheManager
+from apps.core.services.media import MediaService
+from apps.core.services.storage import StorageManager, LocalStorage
+from apps.main import app
+from apps.products.faker.data import FakeProduct
+from config import settings
+from config.database import DatabaseManager
+from config.settings import PASSWORD_HASHING
+
+
+def sample(name: str, **labels) -> float:
+    return metrics.registry.get_sample_value(name, labels) or 0
+
+
+class MetricsTestBase:
+    product_endpoint = '/products/{product_id}'
+    metrics_endpoint = '/metrics'
+
+    @classmethod
+    def setup_class(cls):
+        cls.client = TestClient(app)
+        DatabaseManager.create_test_database()
+        CacheManager.set_backend(None)
+
+    @classmethod
+    def teardown_class(cls):
+        DatabaseManager.drop_all_tables()
+
+
+class TestRequestMetrics(MetricsTestBase):
+
+    def test_route_template(self):
+        """
+        Test the requests are measured by the template of their route, not by their path.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product())
+        labels = {'method': 'GET', 'route': self.product_endpoint, 'status': '200'}
+        before = sample('http_request_duration_seconds_count', **labels)
+
+        response = self.client.get(f'/products/{product.id}')
+        assert response.status_code == 200
+        self.client.get(f'/products/{product.id}')
+
+        assert sample('http_request_duration_seconds_count', **labels) == before + 2
+        assert sample('http_requests_in_progress', method='GET') == 0
+
+    def test_response_size(self):
+        _, product = asyncio.run(FakeProduct.populate_product())
+        before = sample('http_response_size_bytes_sum', method='GET', route=self.product_endpoint)
+
+        response = self.client.get(f'/products/{product.id}')
+
+        after = sample('http_response_size_bytes_sum', method='GET', route=self.product_endpoint)
+        assert after == before + len(response.content)
+
+    def test_unmatched_route(self):
+        before = sample('http_request_duration_seconds_count', method='GET', route='<unmatched>', status='404')
+
+        assert self.client.get('/unknown/page/1').status_code == 404
+
+        after = sample('http_request_duration_seconds_count', method='GET', route='<unmatched>', status='404')
+        assert after == before + 1
+
+    def test_metrics_endpoint(self):
+        response = self.client.get(self.metrics_endpoint)
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/plain')
+        assert 'http_request_duration_seconds_bucket' in response.text
+        assert 'db_query_duration_seconds' in response.text
+
+        # --- the scrapes themselves aren't measured ---
+        assert f'route="{self.metrics_endpoint}"' not in response.text
+
+
+class TestDatabaseMetrics(MetricsTestBase):
+
+    def test_queries_per_request(self):
+        """
+        Test the queries of a request are counted, and measured by statement type.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product())
+        CacheManager.set_backend(None)
+        requests_before = sample('db_request_queries_count', route=self.product_endpoint)
+        queries_before = sample('db_request_queries_sum', route=self.product_endpoint)
+        selects_before = sample('db_query_duration_seconds_count', statement='SELECT')
+
+        self.client.get(f'/products/{product.id}')
+
+        assert sample('db_request_queries_count', route=self.product_endpoint) == requests_before + 1
+        queries = sample('db_request_queries_sum', route=self.product_endpoint) - queries_before
+        assert queries >= 1
+        assert sample('db_query_duration_seconds_count', statement='SELECT') >= selects_before + queries
+        assert sample('db_request_query_duration_seconds_sum', route=self.product_endpoint) > 0
+
+    def test_pool_checkouts(self):
+        before = sample('db_pool_checkouts_total', pool='async') + sample('db_pool_checkouts_total', pool='sync')
+
+        asyncio.run(FakeProduct.populate_product())
+
+        after = sample('db_pool_checkouts_total', pool='async') + sample('db_pool_checkouts_total', pool='sync')
+        assert after > before
+        assert sample('db_pool_checked_out', pool='async') == 0
+
+    def test_pool_wait(self, monkeypatch):
+        """
+        Test the time a checkout of the engines of `DatabaseManager` waits for a free connection is measured, apart
+        from the time a connection is held.
+        """
+
+        monkeypatch.setitem(settings.DATABASE_POOL, 'pool_size', 1)
+        monkeypatch.setitem(settings.DATABASE_POOL, 'max_overflow', 0)
+        DatabaseManager.create_test_database()
+        waits_before = sample('db_pool_wait_seconds_count', pool='sync')
+        wait_before = sample('db_pool_wait_seconds_sum', pool='sync')
+        held_before = sample('db_pool_connection_held_seconds_count', pool='sync')
+
+        try:
+            # the only connection of the pool is released after 0.2s
+            held = DatabaseManager.engine.connect()
+            threading.Timer(0.2, held.close).start()
+            with DatabaseManager.engine.connect():
+                pass
+
+            assert sample('db_pool_wait_seconds_count', pool='sync') == waits_before + 2
+            assert sample('db_pool_wait_seconds_sum', pool='sync') - wait_before >= 0.15
+            assert sample('db_pool_connection_held_seconds_count', pool='sync') == held_before + 2
+        finally:
+            monkeypatch.undo()
+            DatabaseManager.create_test_database()
+
+    def test_pool_wait_other_engines(self, tmp_path):
+        """
+        Test the engines not created by `DatabaseManager` aren't timed, and a disposed pool of its engines still is.
+        """
+
+        engine = create_engine(f'sqlite:///{tmp_path / "other.db"}')
+        waits_before = sample('db_pool_wait_seconds_count', pool='sync')
+        with engine.connect():
+            pass
+        engine.dispose()
+        assert sample('db_pool_wait_seconds_count', pool='sync') == waits_before
+
+        DatabaseManager.engine.dispose()
+        with DatabaseManager.engine.connect():
+            pass
+        assert sample('db_pool_wait_seconds_count', pool='sync') == waits_before + 1
+
+
+class TestPasswordMetrics:
+
+    @pytest.mark.asyncio
+    async def test_hashing_calls(self):
+        """
+        Test the password hashing calls running in the pool, and queued over its size, are exported.
+        """
+
+        workers = PASSWORD_HASHING['workers']
+        tasks = [asyncio.create_task(PasswordManager.ahash_password('password')) for _ in range(workers + 2)]
+        await asyncio.sleep(0)
+
+        assert sample('password_hashing_calls', state='running') == workers
+        assert sample('password_hashing_calls', state='queued') == 2
+
+        await asyncio.gather(*tasks)
+        assert sample('password_hashing_calls', state='running') == 0
+        assert sample('password_hashing_calls', state='queued') == 0
+
+
+class TestMediaMetrics:
+
+    @pytest.fixture(autouse=True)
+    def local_storage(self, tmp_path):
+        StorageManager.set_backend(LocalStorage(tmp_path))
+        yield
+        StorageManager.set_backend(None)
+
+    @pytest.mark.asyncio
+    async def test_upload_metrics(self):
+        before_size = sample('media_upload_size_bytes_sum', storage='LocalStorage')
+        before_count = sample('media_upload_duration_seconds_count', storage='LocalStorage', result='saved')
+
+        content = b'x' * 1000
+        await MediaService(parent_directory='uploads').save_file(UploadFile(filename='a.txt', file=io.BytesIO(content)))
+
+        assert sample('media_upload_size_bytes_sum', storage='LocalStorage') == before_size + len(content)
+        assert sample('media_upload_duration_seconds_count', storage='LocalStorage', result='saved') == before_count + 1
@@ -0,0 +1,59 @@
+from pathlib import Path
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, inspect, text
+
+import apps.accounts.models  # noqa: F401, the tables of all the apps are in the metadata
+import apps.products.models  # noqa: F401
+from config.database import FastModel
+
+ROOT = Path(__file__).resolve().parents[3]
+
+
+class TestMigrations:
+    """
+    Test the alembic revisions upgrade a database created by an older version of the app.
+    """
+
+    @staticmethod
+    def upgrade(url: str):
+        config = Config()
+        config.set_main_option('script_location', str(ROOT / 'alembic'))
+        config.set_main_option('sqlalchemy.url', url)
+        command.upgrade(config, 'head')
+
+    def test_upgrade_existing_database(self, tmp_path):
+        url = f'sqlite:///{tmp_path / "old.db"}'
+        engine = create_engine(url)
+        with engine.begin() as connection:
+            connection.execute(text('CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR(256))'))
+            connection.execute(text('CREATE TABLE product_media (id INTEGER PRIMARY KEY, src VARCHAR(256))'))
+            connection.execute(text('CREATE TABLE product_media_thumbnails '
+                                    '(id INTEGER PRIMARY KEY, media_id INTEGER, src VARCHAR(256))'))
+            connection.execute(text("INSERT INTO users (id, email) VALUES (1, 'user@example.com')"))
+
+        self.upgrade(url)
+
+        inspector = inspect(engine)
+        assert {'token_version'} <= {column['name'] for column in inspector.get_columns('users')}
+        assert {'width', 'height', 'size', 'placeholder'} <= \
+               {column['name'] for column in inspector.get_columns('product_media')}
+        assert {'ix_product_media_src'} <= {index['name'] for index in inspector.get_indexes('product_media')}
+        assert {'ix_product_media_thumbnails_src', 'ix_product_media_thumbnails_media_id'} <= \
+               {index['name'] for index in inspector.get_indexes('product_media_thumbnails')}
+        with engine.connect() as connection:
+            assert connection.execute(text('SELECT token_version FROM users')).scalar_one() == 0
+
+    def test_upgrade_new_database(self, tmp_path):
+        """
+        Test a database created with the current models (`create_all`) is upgraded without changes.
+        """
+
+        url = f'sqlite:///{tmp_path / "new.db"}'
+        FastModel.metadata.create_all(create_engine(url))
+
+        self.upgrade(url)
+
+        with create_engine(url).connect() as connection:
+            assert connection.execute(text('SELECT version_num FROM alembic_version')).scalar_one() == '4b2e9c71d3a8'
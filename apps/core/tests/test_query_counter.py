@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select, text
+
+from apps.accounts.models import User
+from apps.core.base_test_case import BaseTestCase
+from apps.core.query_counter import QueryCounter, RepeatedQueryWarning
+from config.database import DatabaseManager
+
+
+class TestQueryCounter(BaseTestCase):
+
+    @classmethod
+    def setup_class(cls):
+        DatabaseManager.create_test_database()
+
+    @classmethod
+    def teardown_class(cls):
+        DatabaseManager.drop_all_tables()
+
+    @staticmethod
+    async def select_users(times: int):
+        async with DatabaseManager.get_async_session() as session:
+            for user_id in range(times):
+                await session.execute(select(User).where(User.id == user_id))
+
+    def test_count_sync_and_async_queries(self):
+        with QueryCounter() as queries:
+            asyncio.run(self.select_users(2))
+            DatabaseManager.get_session().execute(text('SELECT 1'))
+
+        assert queries.count == 3
+        assert queries.statements[-1] == 'SELECT 1'
+
+        # --- the queries after the block aren't counted ---
+        asyncio.run(self.select_users(1))
+        assert queries.count == 3
+
+    def test_repeated_statements(self):
+        """
+        Test the same statement run with other parameters (an N+1 query) is reported, and warned about on demand.
+        """
+
+        with pytest.warns(RepeatedQueryWarning, match='ran 3 times'):
+            with QueryCounter(warn_repeated=True) as queries:
+                asyncio.run(self.select_users(3))
+
+        assert list(queries.repeated.values()) == [3]
+
+    def test_assert_max_queries(self):
+        with self.assert_max_queries(2):
+            asyncio.run(self.select_users(2))
+
+        with pytest.raises(AssertionError, match='3 queries, expected at most 2'):
+            with self.assert_max_queries(2, warn_repeated=False):
+                asyncio.run(self.select_users(3))
+
+    def test_assert_num_queries(self):
+        with self.assert_num_queries(0):
+            pass
+
+        with pytest.raises(AssertionError, match='1 queries, expected 2'):
+            with self.assert_num_queries(2):
+                asyncio.run(self.select_users(1))
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from apps.core.services.single_flight import SingleFlight
+
+
+class TestSingleFlight:
+
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_are_coalesced(self):
+        """
+        Test concurrent calls with the same key share a single call and its result.
+        """
+
+        calls = []
+
+        async def load(key):
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            return {'key': key}
+
+        single_flight = SingleFlight()
+        results = await asyncio.gather(*[single_flight.do(key, load, key) for key in (1, 1, 1, 2, 2)])
+
+        assert sorted(calls) == [1, 2]
+        assert results == [{'key': 1}] * 3 + [{'key': 2}] * 2
+        assert single_flight.calls == {}
+
+    @pytest.mark.asyncio
+    async def test_sequential_calls_are_not_cached(self):
+        """
+        Test a call made after the previous one is done runs again.
+        """
+
+        calls = []
+
+        async def load():
+            calls.append(1)
+            return len(calls)
+
+        single_flight = SingleFlight()
+        assert await single_flight.do('key', load) == 1
+        assert await single_flight.do('key', load) == 2
+
+    @pytest.mark.asyncio
+    async def test_exception_is_shared(self):
+        """
+        Test all the callers of a failed call get its exception, and the next call runs again.
+        """
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError('failed')
+
+        single_flight = SingleFlight()
+        results = await asyncio.gather(*[single_flight.do('key', fail) for _ in range(3)], return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert single_flight.calls == {}
+
+    @pytest.mark.asyncio
+    async def test_cancelled_caller_does_not_cancel_the_others(self):
+        """
+        Test cancelling one caller doesn't cancel the call shared with the other callers.
+        """
+
+        async def load():
+            await asyncio.sleep(0.05)
+            return 'loaded'
+
+        single_flight = SingleFlight()
+        first = asyncio.create_task(single_flight.do('key', load))
+        second = asyncio.create_task(single_flight.do('key', load))
+        await asyncio.sleep(0.01)
+        first.cancel()
+
+        assert await second == 'loaded'
+        with pytest.raises(asyncio.CancelledError):
+            await first
@@ -0,0 +1,195 @@
+import os
+import time
+
+import boto3
+import pytest
+import requests
+from moto import mock_s3
+
+from apps.core.services.storage import LocalStorage, S3Storage
+
+
+class StorageBackendTests:
+    """
+    The behaviour shared by all the storage backends, the `storage` fixture is the backend under test.
+    """
+
+    @pytest.mark.asyncio
+    async def test_save_exists_delete(self, storage, tmp_path):
+        source = tmp_path / 'upload'
+        source.write_bytes(b'image')
+
+        await storage.save('products/1/image.jpg', source)
+        assert not source.exists()
+        assert await storage.exists('products/1/image.jpg')
+        assert not await storage.exists('products/1/other.jpg')
+
+        assert await storage.delete('products/1/image.jpg')
+        assert not await storage.exists('products/1/image.jpg')
+
+    @pytest.mark.asyncio
+    async def test_list(self, storage, tmp_path):
+        for name in ('image.jpg', 'image_150.webp', 'image_400.webp', 'other.jpg'):
+            (tmp_path / name).write_bytes(b'image')
+            await storage.save(f'blobs/ab/cd/{name}', tmp_path / name)
+
+        assert await storage.list('blobs/ab/cd/image_') == ['blobs/ab/cd/image_150.webp', 'blobs/ab/cd/image_400.webp']
+
+    @pytest.mark.asyncio
+    async def test_local_copy(self, storage, tmp_path):
+        (tmp_path / 'upload').write_bytes(b'image')
+        await storage.save('products/1/image.jpg', tmp_path / 'upload')
+
+        async with storage.local_copy('products/1/image.jpg') as path:
+            assert path.read_bytes() == b'image'
+
+            # a file made next to the copy is saved with the storage
+            (path.parent / 'image_150.webp').write_bytes(b'thumbnail')
+            await storage.save('products/1/image_150.webp', path.parent / 'image_150.webp')
+
+        assert await storage.exists('products/1/image_150.webp')
+
+    @pytest.mark.asyncio
+    async def test_walk(self, storage, tmp_path):
+        for key in ('products/1/a.jpg', 'products/2/b.jpg', 'products10/c.jpg', 'blobs/ab/cd/d.jpg'):
+            (tmp_path / 'upload').write_bytes(key.encode())
+            await storage.save(key, tmp_path / 'upload')
+
+        files = [item async for item in storage.walk('products')]
+        assert sorted(key for key, _, _ in files) == ['products/1/a.jpg', 'products/2/b.jpg']
+        assert all(size == len(key) and modified > 0 for key, size, modified in files)
+
+        assert [item async for item in storage.walk('missing')] == []
+
+    @pytest.mark.asyncio
+    async def test_read_head(self, storage, tmp_path):
+        (tmp_path / 'upload').write_bytes(b'\x89PNG\r\n\x1a\n and the rest of the image')
+        await storage.save('products/1/image.png', tmp_path / 'upload')
+
+        assert await storage.read_head('products/1/image.png', 8) == b'\x89PNG\r\n\x1a\n'
+        assert await storage.read_head('products/1/image.png', 1000) == b'\x89PNG\r\n\x1a\n and the rest of the image'
+        assert await storage.read_head('products/1/missing.png', 8) is None
+
+    @pytest.mark.asyncio
+    async def test_touch(self, storage, tmp_path):
+        (tmp_path / 'upload').write_bytes(b'image')
+        await storage.save('blobs/ab/cd/image.jpg', tmp_path / 'upload')
+
+        assert await storage.touch('blobs/ab/cd/image.jpg')
+        assert not await storage.touch('blobs/ab/cd/missing.jpg')
+        async with storage.local_copy('blobs/ab/cd/image.jpg') as path:
+            assert path.read_bytes() == b'image'
+
+    @pytest.mark.asyncio
+    async def test_move(self, storage, tmp_path):
+        (tmp_path / 'upload').write_bytes(b'image')
+        await storage.save('products/1/image.jpg', tmp_path / 'upload')
+
+        await storage.move('products/1/image.jpg', 'quarantine/products/1/image.jpg')
+        assert not await storage.exists('products/1/image.jpg')
+        async with storage.local_copy('quarantine/products/1/image.jpg') as path:
+            assert path.read_bytes() == b'image'
+
+    @pytest.mark.asyncio
+    async def test_copy(self, storage, tmp_path):
+        (tmp_path / 'upload').write_bytes(b'image')
+        await storage.save('products/1/image.jpg', tmp_path / 'upload')
+
+        await storage.copy('products/1/image.jpg', 'products/ab/cd/1/image.jpg')
+        assert await storage.exists('products/1/image.jpg')
+        async with storage.local_copy('products/ab/cd/1/image.jpg') as path:
+            assert path.read_bytes() == b'image'
+
+
+class TestLocalStorage(StorageBackendTests):
+
+    @pytest.fixture
+    def storage(self, tmp_path):
+        return LocalStorage(tmp_path / 'media')
+
+    def test_url(self, tmp_path):
+        assert LocalStorage(tmp_path).url('products/1/image.jpg') is None
+        assert LocalStorage(tmp_path, base_url='https://cdn.test/').url('products/1/image.jpg') == \
+               'https://cdn.test/products/1/image.jpg'
+
+    @pytest.mark.asyncio
+    async def test_prune(self, storage, tmp_path):
+        (tmp_path / 'upload').write_bytes(b'image')
+        await storage.save('products/1/image.jpg', tmp_path / 'upload')
+
+        await storage.prune('products/1')
+        assert storage.path('products/1').is_dir()
+
+        await storage.delete('products/1/image.jpg')
+        await storage.prune('products/1')
+        assert not storage.path('products/1').exists()
+
+    @pytest.mark.asyncio
+    async def test_touch_modification_time(self, storage, tmp_path):
+        (tmp_path / 'upload').write_bytes(b'image')
+        await storage.save('blobs/ab/cd/image.jpg', tmp_path / 'upload')
+        os.utime(storage.path('blobs/ab/cd/image.jpg'), (0, 0))
+
+        await storage.touch('blobs/ab/cd/image.jpg')
+        [(_, _, modified)] = [item async for item in storage.walk('blobs')]
+        assert time.time() - modified < 60
+
+    @pytest.mark.asyncio
+    async def test_delete_missing_file(self, storage, caplog):
+        assert not await storage.delete('products/1/missing.jpg')
+        assert 'products/1/missing.jpg could not be deleted' in caplog.text
+
+    @pytest.mark.asyncio
+    async def test_temp_directory(self, storage):
+        directory = await storage.temp_directory('products/1')
+        assert directory == storage.path('products/1')
+        assert directory.is_dir()
+
+    @pytest.mark.asyncio
+    async def test_presigned_upload_is_not_supported(self, storage):
+        with pytest.raises(NotImplementedError):
+            await storage.presigned_upload('products/1/image.jpg', 'image/jpeg', 1024, 60)
+
+
+class TestS3Storage(StorageBackendTests):
+
+    @pytest.fixture
+    def storage(self, monkeypatch):
+        monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+        monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+        with mock_s3():
+            client = boto3.client('s3', region_name='us-east-1')
+            client.create_bucket(Bucket='media')
+            yield S3Storage('media', client=client, multipart_chunk_size=5 * 1024 * 1024)
+
+    @pytest.mark.asyncio
+    async def test_multipart_upload(self, storage, tmp_path):
+        """
+        Test a file larger than a part is uploaded in parts.
+        """
+
+        content = os.urandom(11 * 1024 * 1024)
+        (tmp_path / 'upload').write_bytes(content)
+        await storage.save('products/1/large.jpg', tmp_path / 'upload')
+
+        stored = storage.client.get_object(Bucket='media', Key='products/1/large.jpg')
+        assert stored['Body'].read() == content
+        assert stored['ETag'].strip('"').endswith('-3')
+
+    def test_url(self, storage):
+        assert storage.url('products/1/image.jpg') == 'https://s3.amazonaws.com/media/products/1/image.jpg'
+
+        storage.base_url = 'https://cdn.test'
+        assert storage.url('products/1/image.jpg') == 'https://cdn.test/products/1/image.jpg'
+
+    @pytest.mark.asyncio
+    async def test_presigned_upload(self, storage):
+        """
+        Test a client can upload a file directly with the presigned request, within its size limit.
+        """
+
+        upload = await storage.presigned_upload('products/1/image.png', 'image/png', 1024, 60)
+
+        response = requests.post(upload['url'], data=upload['fields'], files={'file': b'image'})
+        assert response.status_code == 204
+        assert await storage.exists('products/1/image.png')
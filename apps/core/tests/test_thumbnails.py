@@ -0,0 +1,96 @@
+import pytest
+from PIL import Image
+
+from apps.core.services.thumbnails import process_image, ThumbnailService
+
+
+class TestThumbnails:
+
+    def test_make_thumbnails(self, tmp_path):
+        """
+        Test an image is resized to each width smaller than its own, in WebP and in its original format.
+        """
+
+        source = tmp_path / 'image.png'
+        Image.new('RGBA', (1200, 600), (255, 0, 0, 128)).save(source)
+
+        thumbnails = process_image(str(source), (150, 400, 1000, 2000), ('webp', None))['thumbnails']
+
+        assert [(t['width'], t['height'], t['format']) for t in thumbnails] == [
+            (150, 75, 'webp'), (150, 75, 'png'),
+            (400, 200, 'webp'), (400, 200, 'png'),
+            (1000, 500, 'webp'), (1000, 500, 'png')]
+        for thumbnail in thumbnails:
+            with Image.open(tmp_path / thumbnail['src']) as image:
+                assert image.size == (thumbnail['width'], thumbnail['height'])
+                assert image.format == {'webp': 'WEBP', 'png': 'PNG'}[thumbnail['format']]
+
+    def test_make_thumbnails_jpeg_from_palette_image(self, tmp_path):
+        """
+        Test an image in a mode JPEG can't store (e.g. a palette GIF renamed to `.jpg`) is converted.
+        """
+
+        source = tmp_path / 'image.jpg'
+        Image.new('P', (800, 800)).save(source, 'GIF')
+
+        thumbnails = process_image(str(source), (150,), (None,))['thumbnails']
+        assert [t['src'] for t in thumbnails] == ['image_150.jpg']
+
+    def test_make_thumbnails_small_or_invalid_image(self, tmp_path):
+        """
+        Test nothing is made for an image smaller than the widths, or for a file that isn't an image.
+        """
+
+        small = tmp_path / 'small.png'
+        Image.new('RGB', (100, 100)).save(small)
+        invalid = tmp_path / 'invalid.png'
+        invalid.write_bytes(b'not an image')
+
+        assert process_image(str(small), (150, 400), ('webp',))['thumbnails'] == []
+        assert process_image(str(invalid), (150, 400), ('webp',)) is None
+
+    def test_make_thumbnails_decompression_bomb(self, tmp_path, monkeypatch):
+        """
+        Test an image over the pixel limit of Pillow is skipped like a file that isn't an image, rather than failing
+        the whole upload.
+        """
+
+        source = tmp_path / 'bomb.png'
+        Image.new('RGB', (300, 300)).save(source)
+        monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 100)
+
+        assert process_image(str(source), (150,), ('webp',)) is None
+
+    @pytest.mark.asyncio
+    async def test_generate_in_process_pool(self, tmp_path):
+        """
+        Test the thumbnails are made by the pool of processes.
+        """
+
+        source = tmp_path / 'image.jpg'
+        Image.new('RGB', (500, 500)).save(source)
+
+        processed = await ThumbnailService.generate(source)
+        thumbnails = processed['thumbnails']
+        assert {(t['width'], t['format']) for t in thumbnails} == {(150, 'webp'), (150, 'jpg'), (400, 'webp'),
+                                                                  (400, 'jpg')}
+        assert all((tmp_path / t['src']).exists() for t in thumbnails)
+
+    def test_process_image(self, tmp_path):
+        """
+        Test the dimensions, size and dominant color of an image are read with its thumbnails.
+        """
+
+        source = tmp_path / 'image.png'
+        image = Image.new('RGB', (300, 200), (58, 110, 165))
+        image.paste((255, 255, 255), (0, 0, 100, 50))
+        image.save(source)
+
+        processed = process_image(str(source), (150,), ('webp',))
+        assert (processed['width'], processed['height']) == (300, 200)
+        assert processed['size'] == source.stat().st_size
+        assert processed['placeholder'] == '#3a6ea5'
+        assert len(processed['thumbnails']) == 1
+
+        (tmp_path / 'invalid.png').write_bytes(b'not an image')
+        assert process_image(str(tmp_path / 'invalid.png'), (150,), ('webp',)) is None
@@ -1,10 +1,12 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 
-from config.database import DatabaseManager
+from apps.core.services.email_queue import EmailQueueManager
+from apps.core.services.media_files import MediaFiles
+from apps.core.services.metrics import DatabaseMetrics, MetricsMiddleware, metrics_endpoint
+from config.database import DatabaseManager, DatabaseSessionMiddleware
 from config.routers import RouterManager
-from config.settings import MEDIA_DIR
+from config.settings import METRICS
 
 # -------------------
 # --- Init Models ---
@@ -29,12 +31,28 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"])
 
+# open a database session per request and close it when the response is sent
+app.add_middleware(DatabaseSessionMiddleware)
+
+# measure the requests (by route template) and their database queries, served at `/metrics`
+if METRICS['enabled']:
+    DatabaseMetrics.instrument()
+    app.add_middleware(MetricsMiddleware)
+    app.add_route(METRICS['path'], metrics_endpoint, include_in_schema=False)
+
 # -------------------
 # --- Static File ---
 # -------------------
 
-# add static-file support, for see images by URL
-app.mount("/media", StaticFiles(directory=MEDIA_DIR), name="media")
+# add static-file support, for see images by URL (with byte ranges, sendfile and long-lived caching)
+app.mount("/media", MediaFiles(), name="media")
+
+# ----------------
+# --- Shutdown ---
+# ----------------
+
+# send the queued emails before the worker exits
+app.add_event_handler("shutdown", EmailQueueManager.close)
 
 # --------------------
 # --- Init Routers ---
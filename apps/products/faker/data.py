@@ -86,22 +86,22 @@ class FakeProduct:
         return payload.copy()
 
     @classmethod
-    def populate_product(cls) -> tuple[dict[str, str | int], Product]:
+    async def populate_product(cls) -> tuple[dict[str, str | int], Product]:
         """
         Crete a product without options.
         """
 
         product_data = cls.get_payload()
-        return product_data.copy(), ProductService.create_product(product_data, get_obj=True)
+        return product_data.copy(), await ProductService.create_product(product_data, get_obj=True)
 
     @classmethod
-    def populate_product_with_options(cls, get_product_obj=True) -> tuple[dict[str, str | int], Product | dict]:
+    async def populate_product_with_options(cls, get_product_obj=True) -> tuple[dict[str, str | int], Product | dict]:
         """
         Crete a product with options. (with all fields)
         """
 
         product_data = cls.get_payload_with_options()
-        return product_data.copy(), ProductService.create_product(product_data, get_obj=get_product_obj)
+        return product_data.copy(), await ProductService.create_product(product_data, get_obj=get_product_obj)
 
     @classmethod
     async def populate_product_with_media(cls):
@@ -109,14 +109,14 @@ class FakeProduct:
         product: Product
 
         # --- create a product ---
-        payload, product = cls.populate_product()
+        payload, product = await cls.populate_product()
         payload['alt'] = 'Test Alt Text'
 
         # --- get demo images ---
         upload = FakeMedia.populate_images_for_product(upload_file=True, product_id=product.id)
 
         # --- attach media to product ---
-        media = ProductService.create_media(product.id, payload['alt'], upload)
+        media = await ProductService().create_media(product.id, payload['alt'], upload)
         if media:
             return payload, product
 
@@ -130,14 +130,14 @@ class FakeProduct:
         product: Product
 
         # --- create a product ---
-        payload, product = cls.populate_product_with_options()
+        payload, product = await cls.populate_product_with_options()
         payload['alt'] = 'Test Alt Text'
 
         # --- get demo images ---
         upload = FakeMedia.populate_images_for_product(upload_file=True, product_id=product.id)
 
         # --- attach media to product ---
-        media = ProductService.create_media(product.id, payload['alt'], upload)
+        media = await ProductService().create_media(product.id, payload['alt'], upload)
         if media:
             return payload, product
 
@@ -153,9 +153,9 @@ class FakeProduct:
 
         # --- create 18 products without media ---
         for i in range(9):
-            cls.populate_product()
+            await cls.populate_product()
         for i in range(9):
-            cls.populate_product_with_options()
+            await cls.populate_product_with_options()
 
 
 class FakeMedia:
@@ -21,9 +21,12 @@ class Product(FastModel):
     updated_at = Column(DateTime, nullable=True)
     published_at = Column(DateTime, nullable=True)
 
-    options = relationship("ProductOption", back_populates="product", cascade="all, delete-orphan")
-    variants = relationship("ProductVariant", back_populates="product", cascade="all, delete-orphan")
-    media = relationship("ProductMedia", back_populates="product", cascade="all, delete-orphan")
+    options = relationship("ProductOption", back_populates="product", cascade="all, delete-orphan",
+                           order_by="ProductOption.id")
+    variants = relationship("ProductVariant", back_populates="product", cascade="all, delete-orphan",
+                            order_by="ProductVariant.id")
+    media = relationship("ProductMedia", back_populates="product", cascade="all, delete-orphan",
+                         order_by="ProductMedia.id")
 
     # TODO add user_id to track which user added this product
 
@@ -39,7 +42,8 @@ class ProductOption(FastModel):
 
     __table_args__ = (UniqueConstraint('product_id', 'option_name'),)
     product = relationship("Product", back_populates="options")
-    option_items = relationship("ProductOptionItem", back_populates="product_option", cascade="all, delete-orphan")
+    option_items = relationship("ProductOptionItem", back_populates="product_option", cascade="all, delete-orphan",
+                                order_by="ProductOptionItem.id")
 
 
 class ProductOptionItem(FastModel):
@@ -87,9 +91,41 @@ class ProductMedia(FastModel):
     # TODO if set the position to `1` it means this is the main image
     # position = Column(Integer)
     alt = Column(String, nullable=True)
-    src = Column(String)
+
+    # a file name in `media/products/{product_id}`, or the key of a content-addressed blob shared with other media
+    # (indexed to count its references)
+    src = Column(String, index=True)
     type = Column(String)
+
+    # read from the image while it's uploaded (in pixels and bytes), so the clients can reserve its space
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    size = Column(Integer, nullable=True)
+    # the dominant color of the image (e.g. `#3a6ea5`), to show while it's loaded; set with its thumbnails
+    placeholder = Column(String(7), nullable=True)
+
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, onupdate=func.now())
 
     product = relationship("Product", back_populates="media")
+    thumbnails = relationship("ProductMediaThumbnail", back_populates="media", cascade="all, delete-orphan",
+                              order_by="ProductMediaThumbnail.id")
+
+
+class ProductMediaThumbnail(FastModel):
+    """
+    A resized copy of a product image, made in the background after the image is uploaded.
+    """
+
+    __tablename__ = "product_media_thumbnails"
+
+    id = Column(Integer, primary_key=True)
+    media_id = Column(Integer, ForeignKey("product_media.id"), index=True)
+    width = Column(Integer)
+    height = Column(Integer)
+    format = Column(String)
+    # indexed for the lookups of the media garbage collector
+    src = Column(String, index=True)
+    created_at = Column(DateTime, server_default=func.now())
+
+    media = relationship("ProductMedia", back_populates="thumbnails")
@@ -28,14 +28,16 @@ Every time we create product, the media should be None, because the Media after
 attached to it.
 """
 
-from fastapi import APIRouter, status, Form, UploadFile, File, HTTPException, Query, Path, Depends
+from fastapi import APIRouter, status, Form, UploadFile, File, HTTPException, Query, Path, Depends, BackgroundTasks
 from fastapi import Request
 from fastapi.responses import JSONResponse
 
 from apps.accounts.services.permissions import Permission
+from apps.core.services.conditional import ConditionalGet
 from apps.core.services.media import MediaService
 from apps.products import schemas
 from apps.products.services import ProductService
+from config import settings
 
 router = APIRouter(
     prefix="/products"
@@ -56,7 +58,7 @@ router = APIRouter(
     tags=["Product"],
     dependencies=[Depends(Permission.is_admin)])
 async def create_product(request: Request, product: schemas.CreateProductIn):
-    return {'product': ProductService(request).create_product(product.model_dump())}
+    return {'product': await ProductService(request).create_product(product.model_dump())}
 
 
 @router.get(
@@ -69,8 +71,10 @@ async def create_product(request: Request, product: schemas.CreateProductIn):
 async def retrieve_product(request: Request, product_id: int):
     # TODO user can retrieve products with status of (active , archived)
     # TODO fix bug if there are not product in database
-    product = ProductService(request).retrieve_product(product_id)
-    return {"product": product}
+    product = await ProductService(request).retrieve_product(product_id)
+    return ConditionalGet.response(
+        request, schemas.RetrieveProductOut, {"product": product},
+        last_modified=ConditionalGet.latest(product, product['variants'], product['media']))
 
 
 @router.get(
@@ -80,14 +84,17 @@ async def retrieve_product(request: Request, product_id: int):
     summary='Retrieve a list of products',
     description='Retrieve a list of products.',
     tags=["Product"])
-async def list_produces(request: Request):
+async def list_produces(
+        request: Request,
+        after: str | None = Query(None, description='The `next_cursor` of the previous page.'),
+        limit: int | None = Query(None, ge=1, le=settings.products_list_max_limit)):
     # TODO permission: admin users (admin, is_admin), none-admin users
     # TODO as none-admin permission, list products that they status is `active`.
     # TODO as none-admin, dont list the product with the status of `archived` and `draft`.
     # TODO only admin can list products with status `draft`.
-    products = ProductService(request).list_products()
+    products, next_cursor = await ProductService(request).list_products(after=after, limit=limit)
     if products:
-        return {'products': products}
+        return {'products': products, 'next_cursor': next_cursor}
     return JSONResponse(
         content=None,
         status_code=status.HTTP_204_NO_CONTENT
@@ -114,7 +121,7 @@ async def update_product(request: Request, product_id: int, payload: schemas.Upd
             updated_product_data[key] = value
 
     try:
-        updated_product = ProductService(request).update_product(product_id, **updated_product_data)
+        updated_product = await ProductService(request).update_product(product_id, **updated_product_data)
         return {'product': updated_product}
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -128,7 +135,7 @@ async def update_product(request: Request, product_id: int, payload: schemas.Upd
     tags=['Product'],
     dependencies=[Depends(Permission.is_admin)])
 async def delete_product(product_id: int):
-    ProductService.delete_product(product_id)
+    await ProductService.delete_product(product_id)
 
 
 # -------------------------------
@@ -151,7 +158,7 @@ async def update_variant(variant_id: int, payload: schemas.UpdateVariantIn):
         if value is not None:
             update_data[key] = value
     try:
-        updated_variant = ProductService.update_variant(variant_id, **update_data)
+        updated_variant = await ProductService.update_variant(variant_id, **update_data)
         return {'variant': updated_variant}
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -165,7 +172,7 @@ async def update_variant(variant_id: int, payload: schemas.UpdateVariantIn):
     description='Retrieves a single product variant.',
     tags=['Product Variant'])
 async def retrieve_variant(variant_id: int):
-    return {'variant': ProductService.retrieve_variant(variant_id)}
+    return {'variant': await ProductService.retrieve_variant(variant_id)}
 
 
 @router.get(
@@ -175,8 +182,10 @@ async def retrieve_variant(variant_id: int):
     summary='Retrieves a list of product variants',
     description='Retrieves a list of product variants.',
     tags=['Product Variant'])
-async def list_variants(product_id: int):
-    return {'variants': ProductService.retrieve_variants(product_id)}
+async def list_variants(request: Request, product_id: int):
+    variants = await ProductService.retrieve_variants(product_id)
+    return ConditionalGet.response(
+        request, schemas.ListVariantsOut, {'variants': variants}, last_modified=ConditionalGet.latest(variants))
 
 
 # -----------------------------
@@ -197,14 +206,42 @@ when updating a product, actions on product's images are:
     description="Create a new product image.",
     tags=['Product Image'],
     dependencies=[Depends(Permission.is_admin)])
-async def create_product_media(request: Request, x_files: list[UploadFile] = File(), product_id: int = Path(),
-                               alt: str | None = Form(None)):
+async def create_product_media(request: Request, background_tasks: BackgroundTasks, x_files: list[UploadFile] = File(),
+                               product_id: int = Path(), alt: str | None = Form(None)):
     # check the file size and type
-    for file in x_files:
-        MediaService.is_allowed_extension(file)
-        await MediaService.is_allowed_file_size(file)
+    await MediaService.validate_files(x_files)
 
-    media = ProductService(request).create_media(product_id=product_id, alt=alt, files=x_files)
+    # the thumbnails are made in the background, after the response is sent
+    media = await ProductService(request).create_media(
+        product_id=product_id, alt=alt, files=x_files, background_tasks=background_tasks)
+    return {'media': media}
+
+
+@router.post(
+    '/{product_id}/media/presigned-upload',
+    status_code=status.HTTP_201_CREATED,
+    response_model=schemas.PresignedUploadOut,
+    summary="Create a presigned upload for a product image",
+    description="Create a presigned request to upload a product image directly to the media storage. Once uploaded, "
+                "attach the image to the product with its `key`.",
+    tags=['Product Image'],
+    dependencies=[Depends(Permission.is_admin)])
+async def create_presigned_upload(product_id: int, payload: schemas.PresignedUploadIn):
+    return await ProductService.create_presigned_upload(product_id, payload.file_name, payload.content_type)
+
+
+@router.post(
+    '/{product_id}/media/attach',
+    status_code=status.HTTP_201_CREATED,
+    response_model=schemas.CreateProductMediaOut,
+    summary="Attach uploaded images to a product",
+    description="Attach images uploaded directly to the media storage (with a presigned upload) to a product.",
+    tags=['Product Image'],
+    dependencies=[Depends(Permission.is_admin)])
+async def attach_product_media(request: Request, background_tasks: BackgroundTasks, product_id: int,
+                               payload: schemas.AttachMediaIn):
+    media = await ProductService(request).attach_media(
+        product_id, payload.keys, alt=payload.alt, background_tasks=background_tasks)
     return {'media': media}
 
 
@@ -216,7 +253,9 @@ async def create_product_media(request: Request, x_files: list[UploadFile] = Fil
     description='Get a single product image by id.',
     tags=['Product Image'])
 async def retrieve_single_media(request: Request, media_id: int):
-    return {'media': ProductService(request).retrieve_single_media(media_id)}
+    media = await ProductService(request).retrieve_single_media(media_id)
+    return ConditionalGet.response(
+        request, schemas.RetrieveMediaOut, {'media': media}, last_modified=ConditionalGet.latest(media))
 
 
 @router.get(
@@ -227,9 +266,10 @@ async def retrieve_single_media(request: Request, media_id: int):
     description="Receive a list of all Product Images.",
     tags=['Product Image'])
 async def list_product_media(request: Request, product_id: int):
-    media = ProductService(request).retrieve_media_list(product_id=product_id)
+    media = await ProductService(request).retrieve_media_list(product_id=product_id)
     if media:
-        return {'media': media}
+        return ConditionalGet.response(
+            request, schemas.RetrieveProductMediaOut, {'media': media}, last_modified=ConditionalGet.latest(media))
     return JSONResponse(
         content=None,
         status_code=status.HTTP_204_NO_CONTENT
@@ -244,17 +284,20 @@ async def list_product_media(request: Request, product_id: int):
     description='Updates an existing image.',
     tags=['Product Image'],
     dependencies=[Depends(Permission.is_admin)])
-async def update_media(request: Request, media_id: int, file: UploadFile = File(), alt: str | None = Form(None)):
+async def update_media(request: Request, background_tasks: BackgroundTasks, media_id: int, file: UploadFile = File(),
+                       alt: str | None = Form(None)):
     update_data = {}
 
     if file is not None:
+        await MediaService.validate_files([file])
         update_data['file'] = file
 
     if alt is not None:
         update_data['alt'] = alt
 
     try:
-        updated_media = ProductService(request).update_media(media_id, **update_data)
+        updated_media = await ProductService(request).update_media(
+            media_id, background_tasks=background_tasks, **update_data)
         return {'media': updated_media}
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -269,7 +312,7 @@ async def update_media(request: Request, media_id: int, file: UploadFile = File(
     dependencies=[Depends(Permission.is_admin)])
 async def delete_product_media(product_id: int, media_ids: str = Query(...)):
     media_ids_list = list(map(int, media_ids.split(',')))
-    ProductService.delete_product_media(product_id, media_ids_list)
+    await ProductService.delete_product_media(product_id, media_ids_list)
 
 
 @router.delete(
@@ -280,4 +323,4 @@ async def delete_product_media(product_id: int, media_ids: str = Query(...)):
     tags=['Product Image'],
     dependencies=[Depends(Permission.is_admin)])
 async def delete_media_file(media_id: int):
-    ProductService.delete_media_file(media_id)
+    await ProductService.delete_media_file(media_id)
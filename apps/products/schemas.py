@@ -1,4 +1,4 @@
-from typing import Annotated, List
+from typing import Annotated, List, Literal
 
 from fastapi import Query, UploadFile
 from pydantic import BaseModel, constr, field_validator, model_validator
@@ -75,12 +75,24 @@ class OptionIn(BaseModel):
 """
 
 
+class MediaThumbnailSchema(BaseModel):
+    width: int
+    height: int
+    format: str
+    src: str
+
+
 class ProductMediaSchema(BaseModel):
     media_id: int
     product_id: int
     alt: str
     src: str
     type: str
+    width: int | None = None
+    height: int | None = None
+    size: int | None = None
+    placeholder: str | None = None
+    thumbnails: list[MediaThumbnailSchema] | None = None
     updated_at: str | None
     created_at: str
 
@@ -118,6 +130,22 @@ class RetrieveMediaOut(BaseModel):
     media: ProductMediaSchema
 
 
+class PresignedUploadIn(BaseModel):
+    file_name: Annotated[str, Query(max_length=255, min_length=1)]
+    content_type: Literal['image/jpeg', 'image/png', 'image/gif']
+
+
+class PresignedUploadOut(BaseModel):
+    key: str
+    url: str
+    fields: dict[str, str]
+
+
+class AttachMediaIn(BaseModel):
+    keys: Annotated[list[str], Query(min_length=1)]
+    alt: str | None = None
+
+
 """
 ---------------------------------------
 --------------- Product ---------------
@@ -208,6 +236,7 @@ class ListProductIn(BaseModel):
 
 class ListProductOut(BaseModel):
     products: list[ProductSchema]
+    next_cursor: str | None = None
 
 
 class UpdateProductIn(BaseModel):
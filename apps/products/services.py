@@ -1,46 +1,82 @@
+import asyncio
 from itertools import product as options_combination
+from typing import Iterable
 
-from fastapi import Request
-from sqlalchemy import select, and_, or_
+from fastapi import BackgroundTasks, Request, HTTPException, status
+from sqlalchemy import select, insert, update, and_, or_, bindparam
+from sqlalchemy.orm import joinedload, selectinload
 
 from apps.core.date_time import DateTime
+from apps.core.services.cache import CacheManager
+from apps.core.services.image_probe import EXTENSIONS, SIGNATURE_SIZE, ImageProbe
 from apps.core.services.media import MediaService
-from apps.products.models import Product, ProductOption, ProductOptionItem, ProductVariant, ProductMedia
+from apps.core.services.single_flight import SingleFlight
+from apps.core.services.storage import StorageManager
+from apps.core.services.thumbnails import ThumbnailService
+from apps.products.models import (
+    Product, ProductOption, ProductOptionItem, ProductVariant, ProductMedia, ProductMediaThumbnail)
 from config import settings
 from config.database import DatabaseManager
 
 
 class ProductService:
-    request: Request | None = None
-    product = None
-    price: int | float
-    stock: int
-    options: list | None = []
-    options_data: list = []
-    variants: list = []
-    media: list | None = None
+    """
+    Products, with their options, variants and media.
 
-    @classmethod
-    def __init__(cls, request: Request | None = None):
-        cls.request = request
+    The only state of an instance is the request it serves, used to build the media URLs, so an instance must not be
+    shared between requests. Everything else is stateless, so the methods that don't build media URLs are class or
+    static methods and can be called without an instance.
+
+    Usage:
+        product = await ProductService(request).retrieve_product(product_id)
+        variants = await ProductService.retrieve_variants(product_id)
+    """
+
+    # concurrent loads of the same product (or variants) in this worker share a single query
+    single_flight = SingleFlight()
+
+    # the number of loads running in this worker for each cached product, and the number of times the product was
+    # invalidated while they run: a load started before an invalidation doesn't cache what it loaded (see
+    # `invalidate_product_cache`). Both are dropped when the last load of the product is done, so they only hold the
+    # products being loaded.
+    cache_loads: dict[str, int] = {}
+    cache_generations: dict[str, int] = {}
+
+    def __init__(self, request: Request | None = None):
+        self.request = request
 
     @classmethod
-    def create_product(cls, data: dict, get_obj: bool = False):
+    async def create_product(cls, data: dict, get_obj: bool = False):
+        """
+        Create a product with its options, option-items and variants in a single transaction.
 
-        cls._create_product(data)
-        cls.__create_product_options()
-        cls.__create_variants()
+        Options, items and variants are inserted in bulk (`INSERT ... RETURNING`), and the response is built from
+        the inserted rows, so no matter how many variants a product has, there is just one commit and no re-query.
+        """
+
+        price = data.pop('price', 0)
+        stock = data.pop('stock', 0)
+        options_data = data.pop('options', []) or []
+
+        async with DatabaseManager.get_async_session() as session:
+            try:
+                product = await cls._create_product(session, data)
+                options = await cls.__create_product_options(session, product.id, options_data)
+                variants = await cls.__create_variants(session, product.id, options, price, stock)
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+
+        # the id can be reused (e.g. after the database is reset), don't let a stale entry outlive it
+        await cls.invalidate_product_cache(product.id)
 
         if get_obj:
-            return cls.product
-        return cls.retrieve_product(cls.product.id)
+            return product
+        return cls.__product_to_dict(product, options, variants, media=None)
 
     @classmethod
-    def _create_product(cls, data: dict):
-        cls.price = data.pop('price', 0)
-        cls.stock = data.pop('stock', 0)
-        cls.options_data = data.pop('options', [])
-
+    async def _create_product(cls, session, data: dict) -> Product:
         if 'status' in data:
             # Check if the value is one of the specified values, if not, set it to 'draft'
             valid_statuses = ['active', 'archived', 'draft']
@@ -48,63 +84,95 @@ class ProductService:
                 data['status'] = 'draft'
 
         # create a product
-        cls.product = Product.create(**data)
+        return (await session.scalars(insert(Product).returning(Product), [data])).one()
 
     @classmethod
-    def __create_product_options(cls):
+    async def __create_product_options(cls, session, product_id: int, options_data: list[dict]):
         """
-        Create new option if it doesn't exist and update its items,
-        and ensures that options are uniq in a product and also items in each option are uniq.
+        Create the options of a new product and their items, with one bulk insert for the options and one for all
+        the items.
+
+        The uniqueness of options in a product, and of items in each option, are validated by the request schema.
         """
 
-        if cls.options_data:
-            for option in cls.options_data:
+        if not options_data:
+            return None
 
-                # Creates a new instance of the ProductOption model, adds it to the database,
-                # and commits the transaction. Returns the newly created model instance
-                new_option = ProductOption.create(product_id=cls.product.id, option_name=option['option_name'])
-
-                for item in option['items']:
-                    ProductOptionItem.create(option_id=new_option.id, item_name=item)
-            cls.options = cls.retrieve_options(cls.product.id)
-        else:
-            cls.options = None
+        # the returned rows aren't in the order of the parameters (asking for it makes sqlite insert a row at a
+        # time), they're matched by their unique columns instead
+
+        # --- insert options ---
+        rows = await session.execute(
+            insert(ProductOption).returning(ProductOption.id, ProductOption.option_name),
+            [{'product_id': product_id, 'option_name': option['option_name']} for option in options_data])
+        option_ids = {row.option_name: row.id for row in rows}
+        options = [
+            {'options_id': option_ids[option['option_name']], 'option_name': option['option_name'], 'items': []}
+            for option in options_data
+        ]
+
+        # --- insert items of all options ---
+        items_data = [
+            {'option_id': option['options_id'], 'item_name': item}
+            for option, data in zip(options, options_data)
+            for item in data['items']
+        ]
+        rows = await session.execute(
+            insert(ProductOptionItem).returning(
+                ProductOptionItem.id, ProductOptionItem.option_id, ProductOptionItem.item_name),
+            items_data)
+        item_ids = {(row.option_id, row.item_name): row.id for row in rows}
+
+        options_by_id = {option['options_id']: option for option in options}
+        for item in items_data:
+            options_by_id[item['option_id']]['items'].append(
+                {'item_id': item_ids[(item['option_id'], item['item_name'])], 'item_name': item['item_name']})
+
+        return options
 
     @classmethod
-    def retrieve_options(cls, product_id):
+    async def retrieve_options(cls, product_id):
         """
         Get all options of a product
         """
 
-        product_options = []
-        options = ProductOption.filter(ProductOption.product_id == product_id).all()
-        for option in options:
-            # Retrieves records from the database based on a given filter condition.
-            # Returns a list of model instances matching the filter condition.
-            items = ProductOptionItem.filter(ProductOptionItem.option_id == option.id).all()
+        async with DatabaseManager.get_async_session() as session:
+            # load the items of all options with a single `IN (...)` query
+            options = await session.scalars(
+                select(ProductOption)
+                .where(ProductOption.product_id == product_id)
+                .order_by(ProductOption.id)
+                .options(selectinload(ProductOption.option_items))
+            )
+            return cls.__options_to_dict(options)
 
-            product_options.append({
+    @staticmethod
+    def __options_to_dict(options: Iterable[ProductOption]):
+        product_options = [
+            {
                 'options_id': option.id,
                 'option_name': option.option_name,
-                'items': [{'item_id': item.id, 'item_name': item.item_name} for item in items]
-            })
+                'items': [{'item_id': item.id, 'item_name': item.item_name} for item in option.option_items]
+            }
+            for option in options
+        ]
         if product_options:
             return product_options
         else:
             return None
 
     @classmethod
-    def __create_variants(cls):
+    async def __create_variants(cls, session, product_id: int, options: list[dict] | None, price, stock):
         """
-        Create a default variant or create variants by options combination.
+        Create a default variant or create variants by options combination, with one bulk insert.
         """
 
-        if cls.options:
+        if options:
 
             # create variants by options combination
-            items_id = cls.get_item_ids_by_product_id(cls.product.id)
-            variants = list(options_combination(*items_id))
-            for variant in variants:
+            items_id = [[item['item_id'] for item in option['items']] for option in options]
+            variants_data = []
+            for variant in options_combination(*items_id):
                 values_tuple = tuple(variant)
 
                 # set each value to an option and set none if it doesn't exist
@@ -112,54 +180,64 @@ class ProductService:
                     values_tuple += (None,)
                 option1, option2, option3 = values_tuple
 
-                ProductVariant.create(
-                    product_id=cls.product.id,
-                    option1=option1,
-                    option2=option2,
-                    option3=option3,
-                    price=cls.price,
-                    stock=cls.stock
-                )
+                variants_data.append({
+                    'product_id': product_id,
+                    'option1': option1,
+                    'option2': option2,
+                    'option3': option3,
+                    'price': price,
+                    'stock': stock
+                })
         else:
             # set a default variant
-            ProductVariant.create(
-                product_id=cls.product.id,
-                price=cls.price,
-                stock=cls.stock
-            )
-
-        cls.variants = cls.retrieve_variants(cls.product.id)
+            variants_data = [{
+                'product_id': product_id,
+                'option1': None,
+                'option2': None,
+                'option3': None,
+                'price': price,
+                'stock': stock
+            }]
+
+        # a variant is unique by its items, the returned rows are put back in the order of the combinations
+        variants = {
+            (variant.option1, variant.option2, variant.option3): variant
+            for variant in await session.scalars(insert(ProductVariant).returning(ProductVariant), variants_data)
+        }
+        return [
+            cls.__variant_to_dict(variants[(data['option1'], data['option2'], data['option3'])])
+            for data in variants_data
+        ]
 
     @classmethod
-    def retrieve_variants(cls, product_id):
+    async def retrieve_variants(cls, product_id):
         """
-        Get all variants of a product
+        Get all variants of a product.
+
+        Concurrent calls for the same product await a single load.
         """
 
-        product_variants = []
-        variants: list[ProductVariant] = ProductVariant.filter(ProductVariant.product_id == product_id).all()
-        for variant in variants:
-            product_variants.append(
-                {
-                    "variant_id": variant.id,
-                    "product_id": variant.product_id,
-                    "price": variant.price,
-                    "stock": variant.stock,
-                    "option1": variant.option1,
-                    "option2": variant.option2,
-                    "option3": variant.option3,
-                    "created_at": DateTime.string(variant.created_at),
-                    "updated_at": DateTime.string(variant.updated_at)
-                })
+        return await cls.single_flight.do(('variants', product_id), cls.__load_variants, product_id)
+
+    @classmethod
+    async def __load_variants(cls, product_id):
+        # the load is shared by concurrent callers, it has its own session (not the one of the first caller's request)
+        async with DatabaseManager.async_session_factory() as session:
+            variants = await session.scalars(select(ProductVariant).where(ProductVariant.product_id == product_id))
+        product_variants = [cls.__variant_to_dict(variant) for variant in variants]
 
         if product_variants:
             return product_variants
         return None
 
+    @classmethod
+    async def retrieve_variant(cls, variant_id: int):
+        variant = await ProductVariant.aget_or_404(variant_id)
+        return cls.__variant_to_dict(variant)
+
     @staticmethod
-    def retrieve_variant(variant_id: int):
-        variant = ProductVariant.get_or_404(variant_id)
-        variant_data = {
+    def __variant_to_dict(variant: ProductVariant):
+        return {
             "variant_id": variant.id,
             "product_id": variant.product_id,
             "price": variant.price,
@@ -170,20 +248,18 @@ class ProductService:
             "created_at": DateTime.string(variant.created_at),
             "updated_at": DateTime.string(variant.updated_at)
         }
-        return variant_data
 
     @classmethod
-    def get_item_ids_by_product_id(cls, product_id):
+    async def get_item_ids_by_product_id(cls, product_id):
         item_ids_by_option = []
         item_ids_dict = {}
-        with DatabaseManager.session as session:
+        async with DatabaseManager.get_async_session() as session:
 
             # Query the ProductOptionItem table to retrieve item_ids
-            items = (
-                session.query(ProductOptionItem.option_id, ProductOptionItem.id)
+            items = await session.execute(
+                select(ProductOptionItem.option_id, ProductOptionItem.id)
                 .join(ProductOption)
-                .filter(ProductOption.product_id == product_id)
-                .all()
+                .where(ProductOption.product_id == product_id)
             )
 
             # Separate item_ids by option_id
@@ -197,75 +273,168 @@ class ProductService:
 
         return item_ids_by_option
 
+    async def retrieve_product(self, product_id):
+        """
+        Get a product with its options, variants and media.
+
+        The product is served from the cache when it's there, otherwise it's loaded from the database and cached
+        until it changes (see `invalidate_product_cache`) or its TTL expires. The cached product keeps the media
+        paths, the URLs are made for the current request.
+
+        Concurrent calls for the same product await a single load, so a hot product whose cache entry was just
+        invalidated is loaded once, not by every request at the same time.
+        """
+
+        product = await self.single_flight.do(('product', product_id), self.__fetch_product, product_id)
+        return self.__with_media_urls(product)
+
     @classmethod
-    def retrieve_product(cls, product_id):
-        cls.product = Product.get_or_404(product_id)
-        cls.options = cls.retrieve_options(product_id)
-        cls.variants = cls.retrieve_variants(product_id)
-        cls.media = cls.retrieve_media_list(product_id)
-
-        product = {
-            'product_id': cls.product.id,
-            'product_name': cls.product.product_name,
-            'description': cls.product.description,
-            'status': cls.product.status,
-            'created_at': DateTime.string(cls.product.created_at),
-            'updated_at': DateTime.string(cls.product.updated_at),
-            'published_at': DateTime.string(cls.product.published_at),
-            'options': cls.options,
-            'variants': cls.variants,
-            'media': cls.media
-        }
+    async def __fetch_product(cls, product_id):
+        cache = CacheManager.get_backend()
+        key = cls.__product_cache_key(product_id)
+
+        product = await cache.get(key)
+        if product is None:
+            cls.cache_loads[key] = cls.cache_loads.get(key, 0) + 1
+            try:
+                generation = cls.cache_generations.get(key, 0)
+                product = await cls.__load_product(product_id)
+                # the product may have changed while it was loaded, then it's not cached
+                if cls.cache_generations.get(key, 0) == generation:
+                    await cache.set(key, product)
+            finally:
+                cls.cache_loads[key] -= 1
+                if not cls.cache_loads[key]:
+                    del cls.cache_loads[key]
+                    cls.cache_generations.pop(key, None)
         return product
 
     @classmethod
-    def update_product(cls, product_id, **kwargs):
+    async def __load_product(cls, product_id):
+        """
+        Load a product from the database, with media paths instead of URLs.
+
+        The whole product is loaded with 3 queries, whatever its shape: the product joined with its options and
+        their items, then the variants and the media (joined with their thumbnails), each with a single `IN (...)`
+        query.
+
+        The load is shared by concurrent callers (see `retrieve_product`), so it has its own session: the session of
+        the first caller's request is closed if that request ends first.
+        """
+
+        async with DatabaseManager.async_session_factory() as session:
+            product = (await session.scalars(
+                select(Product)
+                .where(Product.id == product_id)
+                .options(
+                    joinedload(Product.options).joinedload(ProductOption.option_items),
+                    selectinload(Product.variants),
+                    selectinload(Product.media).joinedload(ProductMedia.thumbnails))
+            )).unique().first()
+
+        if product is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+
+        return cls.__loaded_product_to_dict(product)
+
+    @classmethod
+    def __loaded_product_to_dict(cls, product: Product):
+        """
+        Convert a product, with its options, variants and media already loaded, to a dictionary with media paths.
+        """
+
+        options = cls.__options_to_dict(product.options)
+        variants = [cls.__variant_to_dict(variant) for variant in product.variants] or None
+        media = [cls.__media_to_dict(media) for media in product.media] or None
+        return cls.__product_to_dict(product, options, variants, media)
+
+    @staticmethod
+    def __product_cache_key(product_id) -> str:
+        return f'product:{product_id}'
+
+    @classmethod
+    async def invalidate_product_cache(cls, *product_ids):
+        """
+        Remove products from the cache, it must be called whenever a product or its variants or media change.
+
+        A load of the product that started before (and may have read the old rows) won't cache it, so the stale
+        product isn't written back after it's removed. The loads in other workers aren't ordered against it, their
+        stale entries can stay until the TTL (`settings.CACHES['ttl']`).
+        """
+
+        keys = [cls.__product_cache_key(product_id) for product_id in product_ids]
+        for key in keys:
+            # only a running load can write back the old product
+            if key in cls.cache_loads:
+                cls.cache_generations[key] = cls.cache_generations.get(key, 0) + 1
+        # the next retrieves don't join a load that may have read the old rows
+        cls.single_flight.forget(*[('product', product_id) for product_id in product_ids],
+                                 *[('variants', product_id) for product_id in product_ids])
+        await CacheManager.get_backend().delete(*keys)
+
+    @staticmethod
+    def __product_to_dict(product: Product, options: list | None, variants: list | None, media: list | None):
+        return {
+            'product_id': product.id,
+            'product_name': product.product_name,
+            'description': product.description,
+            'status': product.status,
+            'created_at': DateTime.string(product.created_at),
+            'updated_at': DateTime.string(product.updated_at),
+            'published_at': DateTime.string(product.published_at),
+            'options': options,
+            'variants': variants,
+            'media': media
+        }
+
+    async def update_product(self, product_id, **kwargs):
 
         # --- init data ---
         # TODO `updated_at` is autoupdate dont need to code
         kwargs['updated_at'] = DateTime.now()
 
         # --- update product ---
-        Product.update(product_id, **kwargs)
-        return cls.retrieve_product(product_id)
+        await Product.aupdate(product_id, **kwargs)
+        await self.invalidate_product_cache(product_id)
+        return await self.retrieve_product(product_id)
 
     @classmethod
-    def update_variant(cls, variant_id, **kwargs):
+    async def update_variant(cls, variant_id, **kwargs):
         # check variant exist
-        ProductVariant.get_or_404(variant_id)
+        variant = await ProductVariant.aget_or_404(variant_id)
 
         # TODO `updated_at` is autoupdate dont need to code
         kwargs['updated_at'] = DateTime.now()
-        ProductVariant.update(variant_id, **kwargs)
+        await ProductVariant.aupdate(variant_id, **kwargs)
+        await cls.invalidate_product_cache(variant.product_id)
 
-        return cls.retrieve_variant(variant_id)
+        return await cls.retrieve_variant(variant_id)
 
-    @classmethod
-    def list_products(cls, limit: int = 12):
+    async def list_products(self, after: str | None = None, limit: int | None = None):
         # - if "default variant" is not set, first variant will be
         # - on list of products, for price, get it from "default variant"
         # - if price or stock of default variant is 0 then select first variant that is not 0
         # - or for price, get it from "less price"
         # do all of them with graphql and let the front devs decide witch query should be run.
 
-        # also can override the list `limit` in settings.py
-        if hasattr(settings, 'products_list_limit'):
-            limit = settings.products_list_limit
-
-        products_list = []
-
-        with DatabaseManager.session as session:
-            products = session.execute(
-                select(Product.id).limit(limit)
-            )
-
-        for product in products:
-            products_list.append(cls.retrieve_product(product.id))
-
-        return products_list
+        # the default `limit` of a page can be overridden in settings.py
+        if limit is None:
+            limit = getattr(settings, 'products_list_limit', 12)
+
+        # load the page after the cursor and all its options, items, variants and media with a fixed number of
+        # `IN (...)` queries, whatever the size or the depth of the page is
+        products, next_cursor = await Product.akeyset(
+            after=after,
+            limit=limit,
+            options=(
+                selectinload(Product.options).selectinload(ProductOption.option_items),
+                selectinload(Product.variants),
+                selectinload(Product.media).joinedload(ProductMedia.thumbnails)))
+
+        return [self.__with_media_urls(self.__loaded_product_to_dict(product)) for product in products], next_cursor
         # --- list by join ----
         # products_list = []
-        # with DatabaseManager.session as session:
+        # with DatabaseManager.get_session() as session:
         #     products = select(
         #         Product.id,
         #         Product.product_name,
@@ -289,126 +458,446 @@ class ProductService:
         #         }
         #     )
 
-    @classmethod
-    def create_media(cls, product_id, alt, files):
+    async def create_media(self, product_id, alt, files, background_tasks: BackgroundTasks | None = None):
         """
         Save uploaded media to `media` directory and attach uploads to a product.
+
+        With `background_tasks`, the thumbnails of the new media are generated after the response is sent.
         """
 
-        product: Product = Product.get_or_404(product_id)
+        product: Product = await Product.aget_or_404(product_id)
         media_service = MediaService(parent_directory="/products", sub_directory=product_id)
 
-        for file in files:
-            file_name, file_extension = media_service.save_file(file)
-            ProductMedia.create(
-                product_id=product_id,
-                alt=alt if alt is not None else product.product_name,
-                src=file_name,
-                type=file_extension
-            )
+        # the files are saved concurrently, then attached with one insert
+        saved_files = await media_service.save_files(files)
+        media_ids = await self.__insert_media(product_id, [
+            {'alt': alt if alt is not None else product.product_name, **saved_file}
+            for saved_file in saved_files
+        ])
+        await self.invalidate_product_cache(product_id)
+
+        if background_tasks is not None:
+            background_tasks.add_task(self.generate_thumbnails, media_ids)
 
-        media = cls.retrieve_media_list(product_id)
+        media = await self.retrieve_media_list(product_id)
         return media
 
     @classmethod
-    def retrieve_media_list(cls, product_id):
+    async def create_presigned_upload(cls, product_id, file_name: str, content_type: str):
+        """
+        Let a client upload an image directly to the storage, without sending it through the app servers.
+
+        Return the key the image must be uploaded to, and the presigned request (URL and form fields) to upload it.
+        Once uploaded, the image is attached to the product with `attach_media`.
+        """
+
+        await Product.aget_or_404(product_id)
+        media_service = MediaService(parent_directory="/products", sub_directory=product_id)
+        key = media_service.get_key(media_service.get_upload_src(media_service.generate_unique_filename(file_name)))
+
+        try:
+            upload = await media_service.storage.presigned_upload(
+                key, content_type, MediaService.get_max_file_size(), settings.MEDIA_STORAGE['presigned_expires'])
+        except NotImplementedError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="The media storage doesn't support direct uploads.")
+        return {'key': key, **upload}
+
+    async def attach_media(self, product_id, keys: list[str], alt: str | None = None,
+                           background_tasks: BackgroundTasks | None = None):
+        """
+        Attach images uploaded directly to the storage (see `create_presigned_upload`) to a product.
+
+        The uploads didn't go through the app, so the real format of each one is sniffed from its first bytes, like
+        the direct uploads (`MediaService.save_file`): the key (and its extension) chosen by the client isn't trusted.
+        """
+
+        product: Product = await Product.aget_or_404(product_id)
+        media_service = MediaService(parent_directory="/products", sub_directory=product_id)
+        prefix = f'{media_service.upload_prefix}/'
+
+        # only the keys given to this product, and actually uploaded
+        file_types = {}
+        for key in keys:
+            file_name = key.removeprefix(prefix)
+            head = None
+            if file_name != key and '/' not in file_name:
+                head = await media_service.storage.read_head(key, SIGNATURE_SIZE)
+            if head is None:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid media key: {key}")
+
+            image_format = ImageProbe.sniff(head)
+            if image_format not in MediaService.allowed_formats:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid file type")
+            file_types[file_name] = EXTENSIONS[image_format]
+
+        media_ids = await self.__insert_media(product_id, [
+            {
+                'alt': alt if alt is not None else product.product_name,
+                'src': media_service.get_upload_src(file_name),
+                'type': file_type
+            }
+            for file_name, file_type in file_types.items()
+        ])
+        await self.invalidate_product_cache(product_id)
+
+        if background_tasks is not None:
+            background_tasks.add_task(self.generate_thumbnails, media_ids)
+        return await self.retrieve_media_list(product_id)
+
+    @staticmethod
+    async def __insert_media(product_id, rows: list[dict]) -> list[int]:
+        """
+        Insert the media of a product with one (multi-row) statement, and return their ids.
+        """
+
+        if not rows:
+            return []
+        async with DatabaseManager.get_async_session() as session:
+            media_ids = list(await session.scalars(
+                insert(ProductMedia).values([{'product_id': product_id, **row} for row in rows])
+                .returning(ProductMedia.id)))
+            await session.commit()
+        return media_ids
+
+    async def retrieve_media_list(self, product_id):
         """
         Get all media of a product.
         """
 
-        media_list = []
-        product_media: list[ProductMedia] = ProductMedia.filter(ProductMedia.product_id == product_id).all()
-        for media in product_media:
-            media_list.append(
-                {
-                    "media_id": media.id,
-                    "product_id": media.product_id,
-                    "alt": media.alt,
-                    "src": cls.__get_media_url(media.product_id, media.src),
-                    "type": media.type,
-                    "created_at": DateTime.string(media.created_at),
-                    "updated_at": DateTime.string(media.updated_at)
-                })
+        async with DatabaseManager.get_async_session() as session:
+            product_media = (await session.scalars(
+                select(ProductMedia)
+                .where(ProductMedia.product_id == product_id)
+                .order_by(ProductMedia.id)
+                .options(joinedload(ProductMedia.thumbnails))
+            )).unique().all()
+        media_list = [self.__with_media_url(self.__media_to_dict(media)) for media in product_media]
         if media_list:
             return media_list
         else:
             return None
 
-    @classmethod
-    def retrieve_single_media(cls, media_id):
+    async def retrieve_single_media(self, media_id):
         """
         Get a media by id.
         """
 
-        media_obj = ProductMedia.filter(ProductMedia.id == media_id).first()
+        async with DatabaseManager.get_async_session() as session:
+            media_obj = await session.get(ProductMedia, media_id, options=[joinedload(ProductMedia.thumbnails)])
         if media_obj:
-            media = {
-                "media_id": media_obj.id,
-                "product_id": media_obj.product_id,
-                "alt": media_obj.alt,
-                "src": cls.__get_media_url(media_obj.product_id, media_obj.src),
-                "type": media_obj.type,
-                "created_at": DateTime.string(media_obj.created_at),
-                "updated_at": DateTime.string(media_obj.updated_at)
-            }
-            return media
+            return self.__with_media_url(self.__media_to_dict(media_obj))
         else:
             return None
 
     @classmethod
-    def __get_media_url(cls, product_id, file_name: str):
-        if cls.request is None:
+    def __media_to_dict(cls, media: ProductMedia):
+        return {
+            "media_id": media.id,
+            "product_id": media.product_id,
+            "alt": media.alt,
+            "src": cls.__get_media_key(media.product_id, media.src),
+            "type": media.type,
+            "width": media.width,
+            "height": media.height,
+            "size": media.size,
+            "placeholder": media.placeholder,
+            "thumbnails": [
+                {
+                    "width": thumbnail.width,
+                    "height": thumbnail.height,
+                    "format": thumbnail.format,
+                    "src": cls.__get_media_key(media.product_id, thumbnail.src)
+                }
+                for thumbnail in media.thumbnails
+            ] or None,
+            "created_at": DateTime.string(media.created_at),
+            "updated_at": DateTime.string(media.updated_at)
+        }
+
+    @staticmethod
+    def __get_media_key(product_id, file_name: str | None):
+        if file_name is None:
+            return None
+        return MediaService(parent_directory="/products", sub_directory=product_id).get_key(file_name)
+
+    def __get_media_url(self, key: str | None):
+        """
+        The URL of a media file: on the storage (or its CDN) if it has public URLs, otherwise on this app.
+        """
+
+        if key is None:
+            return None
+
+        url = StorageManager.get_backend().url(key)
+        if url is not None:
+            return url
+
+        if self.request is None:
             base_url = "http://127.0.0.1:8000/"
         else:
-            base_url = str(cls.request.base_url)
+            base_url = str(self.request.base_url)
+        return f"{base_url}media/{key}"
 
-        return f"{base_url}media/products/{product_id}/{file_name}" if file_name is not None else None
+    def __with_media_url(self, media: dict):
+        """
+        Return a copy of a media dict, with its paths replaced by URLs for the current request.
+        """
 
-    @classmethod
-    def update_media(cls, media_id, **kwargs):
+        thumbnails = [
+            {**thumbnail, 'src': self.__get_media_url(thumbnail['src'])} for thumbnail in media.get('thumbnails') or []
+        ]
+        return {**media, 'src': self.__get_media_url(media['src']), 'thumbnails': thumbnails or None}
+
+    def __with_media_urls(self, product: dict):
+        """
+        Return a copy of a product dict, with the media paths replaced by URLs for the current request.
+
+        The product dict itself is left untouched, it can be shared by concurrent requests.
+        """
+
+        if not product['media']:
+            return product
+        return {**product, 'media': [self.__with_media_url(media) for media in product['media']]}
+
+    async def update_media(self, media_id, background_tasks: BackgroundTasks | None = None, **kwargs):
         # check media exist
-        media: ProductMedia = ProductMedia.get_or_404(media_id)
+        media: ProductMedia = await ProductMedia.aget_or_404(media_id)
         file = kwargs.pop('file', None)
         if file is not None:
             media_service = MediaService(parent_directory="/products", sub_directory=media.product_id)
-            file_name, file_extension = media_service.save_file(file)
-            kwargs['src'] = file_name
-            kwargs['type'] = file_extension
+            kwargs.update(await media_service.save_file(file), placeholder=None)
+            replaced_src = media.src
+
+            # the thumbnails of the replaced file are dropped, and made again for the new file
+            for thumbnail in await ProductMediaThumbnail.afilter(ProductMediaThumbnail.media_id == media_id):
+                await ProductMediaThumbnail.adelete(thumbnail)
+            if background_tasks is not None:
+                background_tasks.add_task(self.generate_thumbnails, [media_id])
 
         # TODO `updated_at` is autoupdate dont need to code
         kwargs['updated_at'] = DateTime.now()
-        ProductMedia.update(media_id, **kwargs)
+        await ProductMedia.aupdate(media_id, **kwargs)
+        if file is not None:
+            await self.__release_blobs([replaced_src])
+        await self.invalidate_product_cache(media.product_id)
 
-        return cls.retrieve_single_media(media_id)
+        return await self.retrieve_single_media(media_id)
 
-    @staticmethod
-    def delete_product_media(product_id, media_ids: list[int]):
+    @classmethod
+    async def delete_product_media(cls, product_id, media_ids: list[int]):
 
         # Fetch the product media records to be deleted
-        with DatabaseManager.session as session:
-            filters = [
-                and_(ProductMedia.product_id == product_id, ProductMedia.id == media_id)
-                for media_id in media_ids
-            ]
-            media_to_delete = session.query(ProductMedia).filter(or_(*filters)).all()
-
-            # Delete the product media records
-            for media in media_to_delete:
-                ProductMedia.delete(ProductMedia.get_or_404(media.id))
+        filters = [
+            and_(ProductMedia.product_id == product_id, ProductMedia.id == media_id)
+            for media_id in media_ids
+        ]
+        media_to_delete = await ProductMedia.afilter(or_(*filters))
+
+        # Delete the product media records
+        for media in media_to_delete:
+            await ProductMedia.adelete(media)
+        await cls.__release_blobs([media.src for media in media_to_delete])
+        await cls.invalidate_product_cache(product_id)
         return None
 
-    @staticmethod
-    def delete_product(product_id):
-        Product.delete(Product.get_or_404(product_id))
+    @classmethod
+    async def delete_product(cls, product_id):
+        await Product.adelete(await Product.aget_or_404(product_id))
+        await cls.invalidate_product_cache(product_id)
 
     @classmethod
-    def delete_media_file(cls, media_id: int):
-        media = ProductMedia.get_or_404(media_id)
+    async def delete_media_file(cls, media_id: int):
+        media = await ProductMedia.aget_or_404(media_id)
         product_id = media.product_id
 
+        # a file referenced by its key (a content-addressed blob, or in the sharded layout) can be shared with other
+        # media, it's deleted with its last reference (or by the garbage collector, see `__release_blobs`)
+        if MediaService.is_blob_key(media.src):
+            await ProductMedia.adelete(media)
+            await cls.__release_blobs([media.src])
+            await cls.invalidate_product_cache(product_id)
+            return True
+
         media_service = MediaService(parent_directory="/products", sub_directory=product_id)
-        is_fie_deleted = media_service.delete_file(media.src)
+        is_fie_deleted = await media_service.delete_file(media.src)
         if is_fie_deleted:
-            ProductMedia.delete(ProductMedia.get_or_404(media_id))
+            for thumbnail in await ProductMediaThumbnail.afilter(ProductMediaThumbnail.media_id == media_id):
+                await media_service.delete_file(thumbnail.src)
+            await ProductMedia.adelete(media)
+            await cls.invalidate_product_cache(product_id)
             return True
         return False
+
+    @classmethod
+    async def generate_thumbnails(cls, media_ids: list[int]):
+        """
+        Make the thumbnails of product images, in the pool of processes of `ThumbnailService`, and attach them to the
+        images with one bulk insert. The images get their placeholder (and their dimensions and size, if they weren't
+        uploaded through the app) with one bulk update.
+
+        It's meant to run in the background, after the response of the upload is sent.
+        """
+
+        media_list = await ProductMedia.afilter(ProductMedia.id.in_(media_ids))
+        processed = await asyncio.gather(*[cls.__make_thumbnails(media) for media in media_list])
+        # a file that isn't an image is left as is
+        images = [(media, image) for media, image in zip(media_list, processed) if image is not None]
+
+        # the thumbnails are made next to their image, so the thumbnails of a blob are keys in its directory
+        rows = [
+            {
+                'media_id': media.id,
+                **thumbnail,
+                'src': f"{media.src.rsplit('/', 1)[0]}/{thumbnail['src']}"
+                if MediaService.is_blob_key(media.src) else thumbnail['src']
+            }
+            for media, image in images
+            for thumbnail in image['thumbnails']
+        ]
+        if images:
+            async with DatabaseManager.get_async_session() as session:
+                await session.execute(update(ProductMedia), [
+                    {'id': media.id, **{field: image[field] for field in ('width', 'height', 'size', 'placeholder')}}
+                    for media, image in images
+                ])
+                if rows:
+                    await session.execute(insert(ProductMediaThumbnail), rows)
+                await session.commit()
+        await cls.invalidate_product_cache(*{media.product_id for media in media_list})
+
+    @staticmethod
+    async def __make_thumbnails(media: ProductMedia) -> dict | None:
+        """
+        Process an image on a local copy of it, and store its thumbnails next to the image.
+        """
+
+        media_service = MediaService(parent_directory="/products", sub_directory=media.product_id)
+        key = media_service.get_key(media.src)
+        directory = key.rsplit('/', 1)[0]
+
+        async with media_service.storage.local_copy(key) as path:
+            processed = await ThumbnailService.generate(path)
+            for thumbnail in processed['thumbnails'] if processed else []:
+                await media_service.storage.save(f"{directory}/{thumbnail['src']}", path.parent / thumbnail['src'])
+        return processed
+
+    @classmethod
+    async def shard_media(cls, batch_size: int = 100, pause: float = 0) -> dict:
+        """
+        Move the media files saved in `products/{product_id}` to the sharded layout (see `MediaService`), while the
+        app is running.
+
+        The media are handled in batches of `batch_size`, with a `pause` (in seconds) between them. For each batch,
+        the files (and their thumbnails) are copied to their new key, the media are updated to reference them with
+        one transaction, and then the old files are deleted: a media always references a file that exists. A media
+        replaced or deleted meanwhile isn't updated (its new copy is left to the garbage collector).
+
+        Returns:
+            The number of moved media and files, and of media whose file is missing (they're left as they are).
+        """
+
+        report = {'media': 0, 'files': 0, 'missing': 0}
+        after = 0
+        while True:
+            async with DatabaseManager.get_async_session() as session:
+                media_list = list(await session.scalars(
+                    select(ProductMedia)
+                    .options(selectinload(ProductMedia.thumbnails))
+                    .where(ProductMedia.id > after, ProductMedia.src.not_like('%/%'))
+                    .order_by(ProductMedia.id)
+                    .limit(batch_size)))
+            if not media_list:
+                return report
+
+            after = media_list[-1].id
+            await cls.__shard_media_batch(media_list, report)
+            if pause:
+                await asyncio.sleep(pause)
+
+    @classmethod
+    async def __shard_media_batch(cls, media_list: list[ProductMedia], report: dict):
+        storage = StorageManager.get_backend()
+        media_rows, thumbnail_rows, old_keys = [], [], []
+
+        for media in media_list:
+            media_service = MediaService(parent_directory="/products", sub_directory=media.product_id)
+            if not await storage.exists(media_service.get_key(media.src)):
+                report['missing'] += 1
+                continue
+
+            prefix = MediaService.get_sharded_prefix('products', media.product_id)
+            files = [(media_rows, media)] + [
+                (thumbnail_rows, thumbnail) for thumbnail in media.thumbnails
+                if not MediaService.is_blob_key(thumbnail.src)
+            ]
+            for rows, record in files:
+                key = media_service.get_key(record.src)
+                if rows is thumbnail_rows and not await storage.exists(key):
+                    continue
+                await storage.copy(key, f'{prefix}/{record.src}')
+                rows.append({'_id': record.id, '_src': record.src, 'new_src': f'{prefix}/{record.src}'})
+                old_keys.append(key)
+
+        # only the records that still reference the old file are updated
+        async with DatabaseManager.get_async_session() as session:
+            for model, rows in ((ProductMedia, media_rows), (ProductMediaThumbnail, thumbnail_rows)):
+                if rows:
+                    table = model.__table__
+                    await session.execute(
+                        update(table)
+                        .where(table.c.id == bindparam('_id'), table.c.src == bindparam('_src'))
+                        .values(src=bindparam('new_src')),
+                        rows)
+            await session.commit()
+        await cls.invalidate_product_cache(*{media.product_id for media in media_list})
+
+        for key in old_keys:
+            await storage.delete(key)
+        for product_id in {media.product_id for media in media_list}:
+            await storage.prune(f'products/{product_id}')
+
+        report['media'] += len(media_rows)
+        report['files'] += len(old_keys)
+
+    @classmethod
+    async def referenced_media_keys(cls, keys: Iterable[str]) -> set[str]:
+        """
+        The keys, among the given storage keys, of the files that a product media or thumbnail references.
+
+        A media file is referenced by its name in `products/{product_id}/`, or by its key if it's a blob. It takes two
+        queries, whatever the number of keys (see `MediaGarbageCollector`).
+        """
+
+        keys = set(keys)
+        sources = keys | {key.rsplit('/', 1)[-1] for key in keys}
+
+        async with DatabaseManager.get_async_session() as session:
+            media = await session.execute(
+                select(ProductMedia.product_id, ProductMedia.src).where(ProductMedia.src.in_(sources)))
+            thumbnails = await session.execute(
+                select(ProductMedia.product_id, ProductMediaThumbnail.src)
+                .join(ProductMedia, ProductMedia.id == ProductMediaThumbnail.media_id)
+                .where(ProductMediaThumbnail.src.in_(sources)))
+
+        referenced = {cls.__get_media_key(product_id, src) for product_id, src in [*media, *thumbnails]}
+        return keys & referenced
+
+    @staticmethod
+    async def __release_blobs(sources: list[str]):
+        """
+        Delete the files referenced by their key in the sharded layout, among the given media sources, that no media
+        references anymore.
+
+        The content-addressed blobs are left to the garbage collector: an upload of the same content doesn't write the
+        blob again, it could reference it right after the check (its `min_age` grace period covers that upload).
+        """
+
+        keys = {src for src in sources if MediaService.is_blob_key(src) and not MediaService.is_content_addressed(src)}
+        if not keys:
+            return
+
+        referenced = {media.src for media in await ProductMedia.afilter(ProductMedia.src.in_(keys))}
+        media_service = MediaService()
+        for key in keys - referenced:
+            await media_service.delete_blob(key)
@@ -1,16 +1,24 @@
 import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 
 import pytest
-from fastapi import status
+from fastapi import status, Request
 from fastapi.testclient import TestClient
+from sqlalchemy import event
 
 from apps.accounts.faker.data import FakeUser
 from apps.accounts.models import User
+from apps.accounts.services.user import UserManager
 from apps.core.base_test_case import BaseTestCase
+from apps.core.services.cache import CacheManager
 from apps.main import app
 from apps.products.faker.data import FakeProduct
+from apps.products.models import Product
 from apps.products.services import ProductService
-from config.database import DatabaseManager
+from config import settings
+from config.database import DatabaseManager, _request_async_session
 
 
 class ProductTestBase(BaseTestCase):
@@ -26,9 +34,11 @@ class ProductTestBase(BaseTestCase):
 
         # Initialize the test database and session before the test class starts
         DatabaseManager.create_test_database()
+        CacheManager.set_backend(None)
+        asyncio.run(UserManager.cache.clear())
 
         # --- create an admin ---
-        cls.admin, access_token = FakeUser.populate_admin()
+        cls.admin, access_token = asyncio.run(FakeUser.populate_admin())
         cls.admin_authorization = {"Authorization": f"Bearer {access_token}"}
 
     @classmethod
@@ -258,6 +268,40 @@ class TestCreateProduct(ProductTestBase):
         # --- media ---
         assert expected['media'] is None
 
+    def test_create_product_in_single_transaction(self):
+        """
+        Test create a product with options commits once, and the response has the inserted rows as they are stored
+        in the database.
+        """
+
+        commits = []
+        engine = DatabaseManager.async_engine.sync_engine
+        listener = lambda connection: commits.append(connection)  # noqa: E731
+        event.listen(engine, 'commit', listener)
+        try:
+            payload = FakeProduct.get_payload_with_options()
+            product = asyncio.run(ProductService.create_product(payload))
+        finally:
+            event.remove(engine, 'commit', listener)
+
+        assert len(commits) == 1
+        assert len(product['options']) == 3
+        assert len(product['variants']) == 8
+
+        # --- the response is the same as what is stored ---
+        assert product == asyncio.run(ProductService().retrieve_product(product['product_id']))
+
+    def test_create_product_query_budget(self):
+        """
+        Test create a product with 3 options and 8 variants stays within its query budget: one multi-row insert for
+        each level (product, options, items, variants), and the admin's authentication.
+        """
+
+        payload = FakeProduct.get_payload_with_options()
+        with self.assert_max_queries(5):
+            response = self.client.post(self.product_endpoint, json=payload, headers=self.admin_authorization)
+        assert response.status_code == status.HTTP_201_CREATED
+
     # ---------------------
     # --- Test Payloads ---
     # ---------------------
@@ -491,7 +535,7 @@ class TestRetrieveProduct(ProductTestBase):
         """
 
         # --- create a product ---
-        payload, product = FakeProduct.populate_product()
+        payload, product = asyncio.run(FakeProduct.populate_product())
 
         # --- retrieve product ---
         response = self.client.get(f'{self.product_endpoint}{product.id}')
@@ -539,7 +583,7 @@ class TestRetrieveProduct(ProductTestBase):
         """
 
         # --- create a product ---
-        payload, product = FakeProduct.populate_product_with_options()
+        payload, product = asyncio.run(FakeProduct.populate_product_with_options())
 
         # --- retrieve product ---
         response = self.client.get(f"{self.product_endpoint}{product.id}")
@@ -709,6 +753,25 @@ class TestRetrieveProduct(ProductTestBase):
             assert media_item["updated_at"] is None
             self.assert_datetime_format(media_item['created_at'])
 
+    @pytest.mark.parametrize('populate', [
+        FakeProduct.populate_product,
+        FakeProduct.populate_product_with_options,
+        FakeProduct.populate_product_with_options_media
+    ])
+    def test_retrieve_product_query_count(self, populate):
+        """
+        Test retrieve a product costs the same number of queries, whatever its options, variants and media.
+        """
+
+        # --- create a product ---
+        _, product = asyncio.run(populate())
+
+        # --- count the queries of the request ---
+        with self.assert_num_queries(3):
+            response = self.client.get(f"{self.product_endpoint}{product.id}")
+
+        assert response.status_code == status.HTTP_200_OK
+
     def test_retrieve_product_404(self):
         """
         Test retrieve a product if it doesn't exist.
@@ -716,6 +779,237 @@ class TestRetrieveProduct(ProductTestBase):
         response = self.client.get(f"{self.product_endpoint}{999999999}")
         assert response.status_code == status.HTTP_404_NOT_FOUND
 
+    def test_retrieve_product_conditional(self):
+        """
+        Test revalidate a product with `If-None-Match` / `If-Modified-Since`:
+        - 304 without a body while it doesn't change.
+        - 200 with a new ETag after it changes.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product_with_options_media())
+        endpoint = f"{self.product_endpoint}{product.id}"
+
+        response = self.client.get(endpoint)
+        assert response.status_code == status.HTTP_200_OK
+        etag = response.headers['etag']
+        last_modified = response.headers['last-modified']
+        variant_id = response.json()['product']['variants'][0]['variant_id']
+        assert etag.startswith('"') and etag.endswith('"')
+        assert response.headers['cache-control'] == settings.HTTP_CACHE_CONTROL
+
+        # --- not modified ---
+        for headers in ({'If-None-Match': etag}, {'If-None-Match': f'"other", W/{etag}'},
+                        {'If-Modified-Since': last_modified}):
+            response = self.client.get(endpoint, headers=headers)
+            assert response.status_code == status.HTTP_304_NOT_MODIFIED
+            assert response.content == b''
+            assert response.headers['etag'] == etag
+
+        # --- modified ---
+        asyncio.run(ProductService.update_variant(variant_id, price=12.5))
+        response = self.client.get(endpoint, headers={'If-None-Match': etag})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers['etag'] != etag
+        assert response.json()['product']['variants'][0]['price'] == 12.5
+
+    def test_retrieve_product_last_modified_timezone(self, monkeypatch):
+        """
+        Test `Last-Modified` is the time the product changed in UTC, whatever the time zone of the server is: the
+        database defaults and `DateTime.now` both store naive UTC datetimes.
+        """
+
+        def get_last_modified(product_id) -> datetime:
+            response = self.client.get(f"{self.product_endpoint}{product_id}")
+            return parsedate_to_datetime(response.headers['last-modified'])
+
+        monkeypatch.setenv('TZ', 'Asia/Tokyo')
+        time.tzset()
+        try:
+            # --- created (by the database default) ---
+            _, product = asyncio.run(FakeProduct.populate_product())
+            created = get_last_modified(product.id)
+
+            # --- updated (by the app) ---
+            asyncio.run(ProductService().update_product(product.id, product_name='updated in Tokyo'))
+            updated = get_last_modified(product.id)
+        finally:
+            monkeypatch.undo()
+            time.tzset()
+
+        for last_modified in (created, updated):
+            assert abs(datetime.now(timezone.utc) - last_modified) < timedelta(minutes=1)
+
+    def test_retrieve_product_from_cache(self):
+        """
+        Test a product retrieved again is served from the cache, without touching the database.
+        """
+
+        # --- create a product and retrieve it once ---
+        _, product = asyncio.run(FakeProduct.populate_product_with_options_media())
+        first = self.client.get(f"{self.product_endpoint}{product.id}")
+
+        # --- count the queries of the second request ---
+        with self.assert_num_queries(0):
+            second = self.client.get(f"{self.product_endpoint}{product.id}")
+
+        assert second.status_code == status.HTTP_200_OK
+        assert second.json() == first.json()
+        assert second.json()['product']['media'][0]['src'].startswith('http://testserver/media/products/')
+
+    def test_retrieve_product_concurrently(self):
+        """
+        Test concurrent retrieves of a product that isn't cached load it from the database once.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product_with_options_media())
+
+        async def retrieve_concurrently():
+            return await asyncio.gather(
+                *[ProductService().retrieve_product(product.id) for _ in range(10)],
+                *[ProductService.retrieve_variants(product.id) for _ in range(10)])
+
+        # 3 queries to load the product, and 1 for the variants
+        with self.assert_num_queries(4):
+            results = asyncio.run(retrieve_concurrently())
+
+        products, variants = results[:10], results[10:]
+        assert all(item == products[0] for item in products)
+        assert all(item == variants[0] for item in variants)
+
+    def test_update_product_while_loading(self, monkeypatch):
+        """
+        Test an update during a slow load of the product doesn't join that load: the update returns the new product,
+        and the old one isn't cached.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product())
+        load_product = ProductService._ProductService__load_product
+
+        async def update_while_loading():
+            loaded = asyncio.Event()
+            release = asyncio.Event()
+
+            async def slow_load(product_id):
+                result = await load_product(product_id)
+                if not loaded.is_set():
+                    # the first load has read the old product, it ends after the update
+                    loaded.set()
+                    await release.wait()
+                return result
+
+            monkeypatch.setattr(ProductService, '_ProductService__load_product', slow_load)
+            first = asyncio.create_task(ProductService().retrieve_product(product.id))
+            await loaded.wait()
+            updated = await ProductService().update_product(product.id, product_name='updated while loading')
+            release.set()
+            return await first, updated, await ProductService().retrieve_product(product.id)
+
+        first, updated, retrieved = asyncio.run(update_while_loading())
+        assert first['product_name'] == product.product_name
+        assert updated['product_name'] == 'updated while loading'
+        assert retrieved['product_name'] == 'updated while loading'
+
+        # the generations are only kept while the product is loaded
+        key = f'product:{product.id}'
+        assert key not in ProductService.cache_loads
+        assert key not in ProductService.cache_generations
+
+    def test_invalidate_product_cache_without_load(self):
+        """
+        Test invalidating products that aren't being loaded doesn't keep any state for them.
+        """
+
+        asyncio.run(ProductService.invalidate_product_cache(*range(1000, 1100)))
+        assert not any(f'product:{product_id}' in ProductService.cache_generations for product_id in range(1000, 1100))
+
+    def test_retrieve_product_concurrently_own_session(self):
+        """
+        Test a load shared by concurrent callers doesn't run on the session of the request that started it, which is
+        closed when that request ends.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product_with_options_media())
+
+        class ClosedSession:
+            async def __aenter__(self):
+                raise RuntimeError('The session of the request is closed.')
+
+        async def retrieve_in_request():
+            token = _request_async_session.set(ClosedSession())
+            try:
+                return await asyncio.gather(ProductService().retrieve_product(product.id),
+                                            ProductService.retrieve_variants(product.id))
+            finally:
+                _request_async_session.reset(token)
+
+        retrieved, variants = asyncio.run(retrieve_in_request())
+        assert retrieved['product_id'] == product.id
+        assert variants == retrieved['variants']
+
+    def test_retrieve_product_concurrent_requests(self):
+        """
+        Test concurrent requests don't share their state: each one gets the media URLs of its own host.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product_with_options_media())
+
+        def request(host: str) -> Request:
+            return Request({'type': 'http', 'scheme': 'http', 'server': (host, 80), 'path': '/', 'root_path': '',
+                            'headers': [(b'host', host.encode())]})
+
+        async def retrieve_concurrently():
+            services = [ProductService(request(f'shop-{i}.test')) for i in range(10)]
+            return await asyncio.gather(*[service.retrieve_product(product.id) for service in services])
+
+        for i, retrieved in enumerate(asyncio.run(retrieve_concurrently())):
+            for media in retrieved['media']:
+                assert media['src'].startswith(f'http://shop-{i}.test/media/products/{product.id}/')
+
+    def test_retrieve_product_cache_invalidation(self):
+        """
+        Test a cached product is refreshed when it, its variants or its media change.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product_with_options_media())
+        cached = asyncio.run(ProductService().retrieve_product(product.id))
+
+        # --- update the product ---
+        asyncio.run(ProductService().update_product(product.id, product_name='cached product'))
+        assert asyncio.run(ProductService().retrieve_product(product.id))['product_name'] == 'cached product'
+
+        # --- update a variant ---
+        variant_id = cached['variants'][0]['variant_id']
+        asyncio.run(ProductService.update_variant(variant_id, price=99))
+        assert asyncio.run(ProductService().retrieve_product(product.id))['variants'][0]['price'] == 99
+
+        # --- delete the media ---
+        media_ids = [media['media_id'] for media in cached['media']]
+        asyncio.run(ProductService.delete_product_media(product.id, media_ids))
+        assert asyncio.run(ProductService().retrieve_product(product.id))['media'] is None
+
+        # --- delete the product ---
+        asyncio.run(ProductService.delete_product(product.id))
+        response = self.client.get(f"{self.product_endpoint}{product.id}")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_retrieve_product_invalidated_while_loading(self, monkeypatch):
+        """
+        Test a product that changes while it's loaded isn't cached: the old rows aren't written back to the cache
+        after the invalidation.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product())
+        load_product = ProductService._ProductService__load_product
+
+        async def load_then_invalidate(product_id):
+            loaded = await load_product(product_id)
+            await ProductService.invalidate_product_cache(product_id)
+            return loaded
+
+        monkeypatch.setattr(ProductService, '_ProductService__load_product', load_then_invalidate)
+        asyncio.run(ProductService().retrieve_product(product.id))
+        assert asyncio.run(CacheManager.get_backend().get(f'product:{product.id}')) is None
+
     # ---------------------
     # --- Test Payloads ---
     # ---------------------
@@ -756,6 +1050,82 @@ class TestListProduct(ProductTestBase):
             assert isinstance(product['product_id'], int)
             assert isinstance(product['product_name'], str)
 
+    @pytest.mark.parametrize('limit', [1, 5, 20])
+    def test_list_products_query_count(self, limit, monkeypatch):
+        """
+        Test list the products costs the same number of queries, whatever the size of the page is.
+        """
+
+        # --- create products with options ---
+        for _ in range(limit):
+            asyncio.run(FakeProduct.populate_product_with_options())
+        monkeypatch.setattr(settings, 'products_list_limit', limit)
+
+        # --- count the queries of the request: products, options, option items, variants and media ---
+        with self.assert_num_queries(5) as queries:
+            response = self.client.get(self.product_endpoint)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json().get('products')) == limit
+        assert queries.repeated == {}
+
+    def test_list_products_with_cursor(self):
+        """
+        Test page through the products by following the `next_cursor` of each page.
+        """
+
+        for _ in range(5):
+            asyncio.run(FakeProduct.populate_product())
+
+        # --- follow the cursors ---
+        product_ids, params = [], {'limit': 2}
+        while True:
+            response = self.client.get(self.product_endpoint, params=params)
+            assert response.status_code == status.HTTP_200_OK
+            page = response.json()
+            assert len(page['products']) <= 2
+            product_ids += [product['product_id'] for product in page['products']]
+            if page['next_cursor'] is None:
+                break
+            params['after'] = page['next_cursor']
+
+        # --- every product is listed once, in order ---
+        assert len(product_ids) >= 5
+        assert product_ids == sorted(set(product_ids))
+
+    def test_list_products_deep_page_query_count(self):
+        """
+        Test a deep page costs the same number of queries as the first one.
+        """
+
+        for _ in range(4):
+            asyncio.run(FakeProduct.populate_product_with_options())
+        product_ids = [product.id for product in asyncio.run(Product.akeyset(limit=100))[0]]
+
+        with self.assert_num_queries(5):
+            after = Product.encode_cursor({'id': product_ids[-2]})
+            response = self.client.get(self.product_endpoint, params={'limit': 1, 'after': after})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()['next_cursor'] is None
+
+    def test_list_products_invalid_cursor(self):
+        """
+        Test list the products with an invalid cursor.
+        """
+
+        response = self.client.get(self.product_endpoint, params={'after': 'invalid'})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_list_products_invalid_limit(self):
+        """
+        Test list the products with a limit out of the allowed range.
+        """
+
+        for limit in (0, settings.products_list_max_limit + 1):
+            response = self.client.get(self.product_endpoint, params={'limit': limit})
+            assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
     # ---------------------
     # --- Test Payloads ---
     # ---------------------
@@ -784,7 +1154,7 @@ class TestUpdateProduct(ProductTestBase):
         """
 
         # --- create product ---
-        payload, product = FakeProduct.populate_product()
+        payload, product = asyncio.run(FakeProduct.populate_product())
 
         response = self.client.put(f"{self.product_endpoint}{product.id}", json=update_payload,
                                    headers=self.admin_authorization)
@@ -854,7 +1224,7 @@ class TestDestroyProduct(ProductTestBase):
         """
 
         # --- create a product ---
-        _, product = FakeProduct.populate_product()
+        _, product = asyncio.run(FakeProduct.populate_product())
 
         # --- request ---
         response = self.client.delete(f"{self.product_endpoint}{product.id}", headers=self.admin_authorization)
@@ -864,7 +1234,7 @@ class TestDestroyProduct(ProductTestBase):
         expected = self.client.get(f"{self.product_endpoint}{product.id}")
         assert expected.status_code == status.HTTP_404_NOT_FOUND
 
-        variant = ProductService.retrieve_variants(product.id)
+        variant = asyncio.run(ProductService.retrieve_variants(product.id))
         assert variant is None
 
     @pytest.mark.asyncio
@@ -887,10 +1257,10 @@ class TestDestroyProduct(ProductTestBase):
         expected = self.client.get(f"{self.product_endpoint}{product.id}")
         assert expected.status_code == status.HTTP_404_NOT_FOUND
 
-        variant = ProductService.retrieve_variants(product.id)
+        variant = await ProductService.retrieve_variants(product.id)
         assert variant is None
 
-        media = ProductService.retrieve_media_list(product.id)
+        media = await ProductService().retrieve_media_list(product.id)
         assert media is None
 
     def test_delete_product_with_options(self):
@@ -902,7 +1272,7 @@ class TestDestroyProduct(ProductTestBase):
         """
 
         # --- create a product with options ---
-        _, product = FakeProduct.populate_product_with_options()
+        _, product = asyncio.run(FakeProduct.populate_product_with_options())
 
         # --- request ---
         response = self.client.delete(f"{self.product_endpoint}{product.id}", headers=self.admin_authorization)
@@ -912,10 +1282,10 @@ class TestDestroyProduct(ProductTestBase):
         expected = self.client.get(f"{self.product_endpoint}{product.id}")
         assert expected.status_code == status.HTTP_404_NOT_FOUND
 
-        variant = ProductService.retrieve_variants(product.id)
+        variant = asyncio.run(ProductService.retrieve_variants(product.id))
         assert variant is None
 
-        options = ProductService.retrieve_options(product.id)
+        options = asyncio.run(ProductService.retrieve_options(product.id))
         assert options is None
 
     @pytest.mark.asyncio
@@ -939,13 +1309,13 @@ class TestDestroyProduct(ProductTestBase):
         expected = self.client.get(f"{self.product_endpoint}{product.id}")
         assert expected.status_code == status.HTTP_404_NOT_FOUND
 
-        variant = ProductService.retrieve_variants(product.id)
+        variant = await ProductService.retrieve_variants(product.id)
         assert variant is None
 
-        options = ProductService.retrieve_options(product.id)
+        options = await ProductService.retrieve_options(product.id)
         assert options is None
 
-        media = ProductService.retrieve_media_list(product.id)
+        media = await ProductService().retrieve_media_list(product.id)
         assert media is None
 
 # TODO refactor tests
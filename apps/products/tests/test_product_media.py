@@ -1,15 +1,27 @@
 import asyncio
+import io
+import os
 
+import boto3
 import pytest
+import requests
 from fastapi import status
 from fastapi.testclient import TestClient
+from moto import mock_s3
+from PIL import Image
 
 from apps.accounts.faker.data import FakeUser
 from apps.accounts.models import User
+from apps.accounts.services.user import UserManager
 from apps.core.base_test_case import BaseTestCase
+from apps.core.services.media import MediaService
+from apps.core.services.media_gc import MediaGarbageCollector
+from apps.core.services.storage import LocalStorage, StorageManager, S3Storage
+from apps.core.services.cache import CacheManager
 from apps.main import app
 from apps.products.faker.data import FakeProduct, FakeMedia
 from apps.products.services import ProductService
+from config import settings
 from config.database import DatabaseManager
 
 
@@ -25,9 +37,11 @@ class ProductMediaTestBase(BaseTestCase):
     def setup_class(cls):
         cls.client = TestClient(app)
         DatabaseManager.create_test_database()
+        CacheManager.set_backend(None)
+        asyncio.run(UserManager.cache.clear())
 
         # --- create an admin ---
-        cls.admin, access_token = FakeUser.populate_admin()
+        cls.admin, access_token = asyncio.run(FakeUser.populate_admin())
         cls.admin_authorization = {"Authorization": f"Bearer {access_token}"}
 
     @classmethod
@@ -47,7 +61,7 @@ class TestCreateProductMedia(ProductMediaTestBase):
         """
 
         # --- create a product ---
-        product_payload, product = FakeProduct.populate_product()
+        product_payload, product = asyncio.run(FakeProduct.populate_product())
 
         # --- upload files ----
         file_paths = FakeMedia.populate_images_for_product()
@@ -78,13 +92,459 @@ class TestCreateProductMedia(ProductMediaTestBase):
             self.assert_datetime_format(media['created_at'])
 
         # --- test static file URL ---
-        url = f'/media/test{media_list[0]["src"].split("/media")[-1]}'
-        response = self.client.get(url)
+        response = self.client.get(media_list[0]["src"])
         assert response.status_code == status.HTTP_200_OK
 
         # test file size is not zero
         assert len(response.content) > 0
 
+    def test_create_media_thumbnails(self):
+        """
+        Test the thumbnails of an uploaded image are made in the background, and listed with the image.
+        """
+
+        # --- create a product ---
+        product_payload, product = asyncio.run(FakeProduct.populate_product())
+
+        # --- upload an image ---
+        image = io.BytesIO()
+        Image.new('RGB', (1200, 800)).save(image, 'JPEG')
+        image.seek(0)
+        files = [("x_files", ('image.jpg', image, 'image/jpeg'))]
+        response = self.client.post(f"{self.product_endpoint}{product.id}/media/", files=files,
+                                    headers=self.admin_authorization)
+        assert response.status_code == status.HTTP_201_CREATED
+
+        # --- the thumbnails are listed, in WebP and in the original format ---
+        media = self.client.get(f"{self.product_endpoint}{product.id}/media").json()['media'][0]
+        thumbnails = media['thumbnails']
+        assert [(t['width'], t['height'], t['format']) for t in thumbnails] == [
+            (150, 100, 'webp'), (150, 100, 'jpg'),
+            (400, 267, 'webp'), (400, 267, 'jpg'),
+            (1000, 667, 'webp'), (1000, 667, 'jpg')]
+        for thumbnail in thumbnails:
+            assert thumbnail['src'].startswith(f'http://testserver/media/products/{product.id}/')
+            response = self.client.get(thumbnail['src'])
+            assert response.status_code == status.HTTP_200_OK
+            assert response.headers['cache-control'].endswith('immutable')
+
+        # --- and with the product ---
+        product_media = self.client.get(f"{self.product_endpoint}{product.id}").json()['product']['media']
+        assert product_media[0]['thumbnails'] == thumbnails
+
+
+class TestProductMediaMetadata(ProductMediaTestBase):
+    """
+    Test the real format and the metadata of the uploaded images.
+    """
+
+    def test_image_metadata(self):
+        """
+        Test the dimensions and size of an image are returned with the upload, and its placeholder once processed.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product())
+        image = io.BytesIO()
+        Image.new('RGB', (800, 600), (200, 30, 30)).save(image, 'PNG')
+        files = [("x_files", ('image.png', io.BytesIO(image.getvalue()), 'image/png'))]
+
+        response = self.client.post(f"{self.product_endpoint}{product.id}/media/", files=files,
+                                    headers=self.admin_authorization)
+        assert response.status_code == status.HTTP_201_CREATED
+        media = response.json()['media'][0]
+        assert (media['width'], media['height'], media['size']) == (800, 600, len(image.getvalue()))
+
+        # --- the placeholder is set in the background, with the thumbnails ---
+        media = self.client.get(f"{self.product_endpoint}{product.id}").json()['product']['media'][0]
+        assert media['placeholder'] == '#c81e1e'
+
+    def test_spoofed_content_type(self):
+        """
+        Test a file that isn't an image is rejected, whatever its `Content-Type` and name.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product())
+        files = [("x_files", ('image.png', io.BytesIO(b'<html></html>'), 'image/png'))]
+
+        response = self.client.post(f"{self.product_endpoint}{product.id}/media/", files=files,
+                                    headers=self.admin_authorization)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_real_extension(self):
+        """
+        Test an image is stored with the extension of its real format.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product())
+        image = io.BytesIO()
+        Image.new('RGB', (100, 100)).save(image, 'GIF')
+        files = [("x_files", ('image.jpg', io.BytesIO(image.getvalue()), 'image/jpeg'))]
+
+        response = self.client.post(f"{self.product_endpoint}{product.id}/media/", files=files,
+                                    headers=self.admin_authorization)
+        media = response.json()['media'][0]
+        assert media['type'] == 'gif'
+        assert self.client.get(media['src']).headers['content-type'] == 'image/gif'
+
+
+class TestCreateProductGallery(ProductMediaTestBase):
+    """
+    Test uploading many images at once.
+    """
+
+    def test_create_media_gallery(self):
+        """
+        Test the images of a gallery are attached in their order, with one insert.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product())
+        images = []
+        for i in range(20):
+            image = io.BytesIO()
+            Image.new('RGB', (10 + i, 10)).save(image, 'PNG')
+            images.append(image.getvalue())
+        files = [("x_files", (f'image-{i}.png', io.BytesIO(image), 'image/png')) for i, image in enumerate(images)]
+
+        # --- count the inserts of the request ---
+        with self.count_queries() as queries:
+            response = self.client.post(f"{self.product_endpoint}{product.id}/media/", files=files,
+                                        headers=self.admin_authorization)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        inserts = [statement for statement in queries.statements if statement.startswith('INSERT INTO product_media ')]
+        assert len(inserts) == 1
+
+        # --- every file is stored, in the order of the upload ---
+        media_list = response.json()['media']
+        assert len(media_list) == 20
+        for media, image in zip(media_list, images):
+            assert self.client.get(media['src']).content == image
+
+
+class TestContentAddressedMedia(ProductMediaTestBase):
+    """
+    Test the product media in the content-addressed storage mode.
+    """
+
+    @pytest.fixture(autouse=True)
+    def content_addressed(self, monkeypatch):
+        monkeypatch.setattr(settings, 'MEDIA_CONTENT_ADDRESSED', True)
+
+    def upload(self, product_id: int, content: bytes):
+        files = [("x_files", ('image.png', io.BytesIO(content), 'image/png'))]
+        response = self.client.post(f"{self.product_endpoint}{product_id}/media/", files=files,
+                                    headers=self.admin_authorization)
+        assert response.status_code == status.HTTP_201_CREATED
+        return response.json()['media'][-1]
+
+    def test_shared_blob_is_collected_after_its_last_reference(self):
+        """
+        Test the same image uploaded to two products is stored once. Deleting the media never deletes it (an upload of
+        the same content may be about to reference it), the garbage collector does once nothing references it.
+        """
+
+        _, first_product = asyncio.run(FakeProduct.populate_product())
+        _, second_product = asyncio.run(FakeProduct.populate_product())
+
+        image = io.BytesIO()
+        Image.new('RGB', (300, 300), (0, 128, 255)).save(image, 'PNG')
+        first = self.upload(first_product.id, image.getvalue())
+        second = self.upload(second_product.id, image.getvalue())
+
+        # --- one blob, referenced by both media ---
+        assert first['src'] == second['src']
+        assert first['src'].startswith('http://testserver/media/blobs/')
+        blob = StorageManager.get_media_root() / first['src'].split('/media/', 1)[1]
+        assert blob.exists()
+        assert len(list(blob.parent.glob(f'{blob.stem}_150.*'))) == 2
+
+        # --- the blob is kept when the media are deleted ---
+        asyncio.run(ProductService.delete_media_file(first['media_id']))
+        asyncio.run(ProductService.delete_product_media(second_product.id, [second['media_id']]))
+        assert blob.exists()
+
+        # --- and collected (with its thumbnails) ---
+        prefix = blob.parent.relative_to(StorageManager.get_media_root()).as_posix()
+        collector = MediaGarbageCollector(ProductService.referenced_media_keys, prefixes=[prefix], min_age=0, rate=None)
+        asyncio.run(collector.run())
+        assert list(blob.parent.glob(f'{blob.stem}*')) == []
+
+
+class TestMediaGarbageCollection(ProductMediaTestBase):
+    """
+    Test the media files of deleted or replaced product media are collected, and only them.
+    """
+
+    @pytest.fixture(autouse=True)
+    def local_storage(self, tmp_path):
+        self.storage = LocalStorage(tmp_path)
+        StorageManager.set_backend(self.storage)
+        yield
+        StorageManager.set_backend(None)
+
+    def upload(self, product_id: int):
+        image = io.BytesIO()
+        Image.new('RGB', (600, 400)).save(image, 'JPEG')
+        files = [("x_files", ('image.jpg', io.BytesIO(image.getvalue()), 'image/jpeg'))]
+        response = self.client.post(f"{self.product_endpoint}{product_id}/media/", files=files,
+                                    headers=self.admin_authorization)
+        assert response.status_code == status.HTTP_201_CREATED
+
+    def stored_keys(self, prefix: str) -> list[str]:
+        async def walk():
+            return sorted([key async for key, _, _ in self.storage.walk(prefix)])
+
+        return asyncio.run(walk())
+
+    def test_collect_unreferenced_files(self):
+        _, product = asyncio.run(FakeProduct.populate_product())
+        _, deleted_product = asyncio.run(FakeProduct.populate_product())
+        self.upload(product.id)
+        self.upload(deleted_product.id)
+        (self.storage.path(f'products/{product.id}/stray.jpg')).write_bytes(b'stray')
+
+        # --- deleting the product leaves its files (an image and 4 thumbnails) ---
+        asyncio.run(ProductService.delete_product(deleted_product.id))
+        kept = self.stored_keys(f'products/{product.id}')
+        kept.remove(f'products/{product.id}/stray.jpg')
+
+        # --- collect ---
+        collector = MediaGarbageCollector(ProductService.referenced_media_keys, min_age=0, rate=None)
+        report = asyncio.run(collector.run())
+
+        assert report['orphans'] == report['removed'] == 6
+        assert self.stored_keys(f'products/{deleted_product.id}') == []
+        assert self.stored_keys(f'products/{product.id}') == kept
+        assert len(kept) == 5
+
+    def test_referenced_media_keys(self):
+        _, product = asyncio.run(FakeProduct.populate_product())
+        self.upload(product.id)
+        media = asyncio.run(ProductService().retrieve_media_list(product.id))[0]
+        keys = [url.split('/media/', 1)[1] for url in [media['src']] + [t['src'] for t in media['thumbnails']]]
+
+        # --- a name is only referenced in the directory of its product ---
+        other_product_keys = [f'products/{product.id + 1}/{key.rsplit("/", 1)[1]}' for key in keys]
+        referenced = asyncio.run(ProductService.referenced_media_keys(keys + other_product_keys + ['blobs/a.jpg']))
+        assert referenced == set(keys)
+
+
+class TestShardedMediaLayout(ProductMediaTestBase):
+    """
+    Test the sharded layout of the media files, and moving the files saved before to it.
+    """
+
+    @pytest.fixture(autouse=True)
+    def local_storage(self, tmp_path):
+        self.storage = LocalStorage(tmp_path)
+        StorageManager.set_backend(self.storage)
+        yield
+        StorageManager.set_backend(None)
+
+    def upload(self, product_id: int) -> dict:
+        image = io.BytesIO()
+        Image.new('RGB', (600, 400)).save(image, 'JPEG')
+        files = [("x_files", ('image.jpg', io.BytesIO(image.getvalue()), 'image/jpeg'))]
+        response = self.client.post(f"{self.product_endpoint}{product_id}/media/", files=files,
+                                    headers=self.admin_authorization)
+        assert response.status_code == status.HTTP_201_CREATED
+        return self.client.get(f"{self.product_endpoint}{product_id}/media").json()['media'][-1]
+
+    @staticmethod
+    def keys(media: dict) -> list[str]:
+        return [url.split('/media/', 1)[1] for url in [media['src']] + [t['src'] for t in media['thumbnails']]]
+
+    def test_upload_in_sharded_layout(self, monkeypatch):
+        monkeypatch.setattr(settings, 'MEDIA_SHARDED_LAYOUT', True)
+        _, product = asyncio.run(FakeProduct.populate_product())
+
+        media = self.upload(product.id)
+        prefix = MediaService.get_sharded_prefix('products', product.id)
+        assert all(key.startswith(f'{prefix}/') for key in self.keys(media))
+        assert all(self.storage.path(key).exists() for key in self.keys(media))
+
+        # --- the files are deleted with the media ---
+        asyncio.run(ProductService.delete_media_file(media['media_id']))
+        assert not any(self.storage.path(key).exists() for key in self.keys(media))
+
+    def test_shard_media(self, monkeypatch):
+        """
+        Test the files saved in `products/{product_id}` are moved to the sharded layout, with their thumbnails.
+        """
+
+        products = [asyncio.run(FakeProduct.populate_product())[1] for _ in range(3)]
+        old_media = [self.upload(product.id) for product in products]
+        assert all(key.startswith(f'products/{product.id}/') for product, media in zip(products, old_media)
+                   for key in self.keys(media))
+
+        monkeypatch.setattr(settings, 'MEDIA_SHARDED_LAYOUT', True)
+        report = asyncio.run(ProductService.shard_media(batch_size=2))
+        assert report == {'media': 3, 'files': 15, 'missing': 0}
+
+        for product, old in zip(products, old_media):
+            prefix = MediaService.get_sharded_prefix('products', product.id)
+            media = self.client.get(f"{self.product_endpoint}{product.id}").json()['product']['media'][-1]
+            assert [key.rsplit('/', 1)[1] for key in self.keys(media)] == \
+                   [key.rsplit('/', 1)[1] for key in self.keys(old)]
+            assert all(key.startswith(f'{prefix}/') and self.storage.path(key).exists() for key in self.keys(media))
+
+            # --- the old directory is removed ---
+            assert not self.storage.path(f'products/{product.id}').exists()
+
+        # --- it's done once ---
+        assert asyncio.run(ProductService.shard_media()) == {'media': 0, 'files': 0, 'missing': 0}
+
+    def test_shard_media_during_garbage_collection(self, monkeypatch):
+        """
+        Test a garbage collection that runs while old files are moved doesn't remove their new copies, which aren't
+        referenced until the batch is saved.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product())
+        old = self.upload(product.id)
+        for key in self.keys(old):
+            os.utime(self.storage.path(key), (0, 0))
+
+        collector = MediaGarbageCollector(ProductService.referenced_media_keys, min_age=3600, rate=None)
+        copy = self.storage.copy
+
+        async def copy_then_collect(key: str, destination: str):
+            await copy(key, destination)
+            await collector.run()
+
+        monkeypatch.setattr(settings, 'MEDIA_SHARDED_LAYOUT', True)
+        monkeypatch.setattr(self.storage, 'copy', copy_then_collect)
+        asyncio.run(ProductService.shard_media())
+
+        media = self.client.get(f"{self.product_endpoint}{product.id}").json()['product']['media'][-1]
+        assert media['src'] != old['src']
+        assert all(self.storage.path(key).exists() for key in self.keys(media))
+
+
+class TestS3ProductMedia(ProductMediaTestBase):
+    """
+    Test the product media on an S3 storage (a moto stand-in).
+    """
+
+    @pytest.fixture(autouse=True)
+    def s3_storage(self, monkeypatch):
+        monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+        monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+        with mock_s3():
+            client = boto3.client('s3', region_name='us-east-1')
+            client.create_bucket(Bucket='media')
+            self.storage = S3Storage('media', base_url='https://cdn.test', client=client)
+            StorageManager.set_backend(self.storage)
+            yield
+            StorageManager.set_backend(None)
+
+    @staticmethod
+    def make_image() -> bytes:
+        image = io.BytesIO()
+        Image.new('RGB', (600, 400)).save(image, 'JPEG')
+        return image.getvalue()
+
+    def test_create_media(self):
+        """
+        Test an uploaded image and its thumbnails are stored in the bucket, and served from the CDN.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product())
+        files = [("x_files", ('image.jpg', io.BytesIO(self.make_image()), 'image/jpeg'))]
+        response = self.client.post(f"{self.product_endpoint}{product.id}/media/", files=files,
+                                    headers=self.admin_authorization)
+        assert response.status_code == status.HTTP_201_CREATED
+
+        media = self.client.get(f"{self.product_endpoint}{product.id}/media").json()['media'][0]
+        assert media['src'].startswith(f'https://cdn.test/products/{product.id}/')
+        assert len(media['thumbnails']) == 4
+        for url in [media['src']] + [thumbnail['src'] for thumbnail in media['thumbnails']]:
+            assert asyncio.run(self.storage.exists(url.removeprefix('https://cdn.test/')))
+
+        # --- delete the image ---
+        asyncio.run(ProductService.delete_media_file(media['media_id']))
+        assert not asyncio.run(self.storage.exists(media['src'].removeprefix('https://cdn.test/')))
+
+    def test_presigned_upload(self):
+        """
+        Test upload an image directly to the bucket, then attach it to the product.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product())
+
+        # --- get a presigned upload ---
+        response = self.client.post(f"{self.product_endpoint}{product.id}/media/presigned-upload",
+                                    json={'file_name': 'image.jpg', 'content_type': 'image/jpeg'},
+                                    headers=self.admin_authorization)
+        assert response.status_code == status.HTTP_201_CREATED
+        upload = response.json()
+        assert upload['key'].startswith(f'products/{product.id}/')
+
+        # --- upload the image, without the app ---
+        uploaded = requests.post(upload['url'], data=upload['fields'], files={'file': self.make_image()})
+        assert uploaded.status_code == status.HTTP_204_NO_CONTENT
+
+        # --- attach it ---
+        response = self.client.post(f"{self.product_endpoint}{product.id}/media/attach",
+                                    json={'keys': [upload['key']], 'alt': 'direct upload'},
+                                    headers=self.admin_authorization)
+        assert response.status_code == status.HTTP_201_CREATED
+        media = response.json()['media'][0]
+        assert media['src'] == f"https://cdn.test/{upload['key']}"
+        assert media['alt'] == 'direct upload'
+
+    def test_attach_invalid_key(self):
+        """
+        Test attach a key that wasn't uploaded, or that belongs to another product.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product())
+        for key in (f'products/{product.id}/missing.jpg', 'products/999999/image.jpg', 'blobs/ab/cd/image.jpg'):
+            response = self.client.post(f"{self.product_endpoint}{product.id}/media/attach", json={'keys': [key]},
+                                        headers=self.admin_authorization)
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_attach_sniffed_type(self):
+        """
+        Test the type of an attached upload is sniffed from its content, not taken from its key, and an upload that
+        isn't an image is rejected.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product())
+
+        def upload(content: bytes) -> str:
+            response = self.client.post(f"{self.product_endpoint}{product.id}/media/presigned-upload",
+                                        json={'file_name': 'image.jpg', 'content_type': 'image/jpeg'},
+                                        headers=self.admin_authorization)
+            presigned = response.json()
+            requests.post(presigned['url'], data=presigned['fields'], files={'file': content})
+            return presigned['key']
+
+        png = io.BytesIO()
+        Image.new('RGB', (600, 400)).save(png, 'PNG')
+        response = self.client.post(f"{self.product_endpoint}{product.id}/media/attach",
+                                    json={'keys': [upload(png.getvalue())]}, headers=self.admin_authorization)
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.json()['media'][0]['type'] == 'png'
+
+        response = self.client.post(f"{self.product_endpoint}{product.id}/media/attach",
+                                    json={'keys': [upload(b'<html>not an image</html>')]},
+                                    headers=self.admin_authorization)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert len(self.client.get(f"{self.product_endpoint}{product.id}/media").json()['media']) == 1
+
+    def test_presigned_upload_on_local_storage(self):
+        """
+        Test the local storage doesn't support the direct uploads.
+        """
+
+        StorageManager.set_backend(None)
+        _, product = asyncio.run(FakeProduct.populate_product())
+        response = self.client.post(f"{self.product_endpoint}{product.id}/media/presigned-upload",
+                                    json={'file_name': 'image.jpg', 'content_type': 'image/jpeg'},
+                                    headers=self.admin_authorization)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
 
 class TestRetrieveProductMedia(ProductMediaTestBase):
     """
@@ -100,12 +560,29 @@ class TestRetrieveProductMedia(ProductMediaTestBase):
         payload, product = asyncio.run(FakeProduct.populate_product_with_media())
 
         # --- get a media ---
-        media = ProductService.retrieve_media_list(product.id)[0]
+        media = asyncio.run(ProductService().retrieve_media_list(product.id))[0]
 
         # --- request ---
         response = self.client.get(f"{self.product_media_endpoint}{media['media_id']}")
         assert response.status_code == status.HTTP_200_OK
 
+    def test_retrieve_media_not_modified(self):
+        """
+        Test revalidate a single product image, and the list of the product images, with their ETag.
+        """
+
+        payload, product = asyncio.run(FakeProduct.populate_product_with_media())
+        media = asyncio.run(ProductService().retrieve_media_list(product.id))[0]
+
+        endpoints = (f"{self.product_media_endpoint}{media['media_id']}", f"{self.product_endpoint}{product.id}/media")
+        for endpoint in endpoints:
+            response = self.client.get(endpoint)
+            assert response.headers['last-modified']
+
+            response = self.client.get(endpoint, headers={'If-None-Match': response.headers['etag']})
+            assert response.status_code == status.HTTP_304_NOT_MODIFIED
+            assert response.content == b''
+
     @pytest.mark.asyncio
     async def test_list_product_media(self):
         """
@@ -142,7 +619,7 @@ class TestRetrieveProductMedia(ProductMediaTestBase):
         """
 
         # --- create a product ---
-        payload, product = FakeProduct.populate_product()
+        payload, product = asyncio.run(FakeProduct.populate_product())
 
         # --- request ---
         response = self.client.get(f"{self.product_endpoint}{product.id}/{'media'}")
@@ -163,7 +640,7 @@ class TestUpdateProductMedia(ProductMediaTestBase):
         payload, product = await FakeProduct.populate_product_with_media()
 
         # --- get a media ---
-        media = ProductService.retrieve_media_list(product.id)[0]
+        media = (await ProductService().retrieve_media_list(product.id))[0]
         update_payload = {
             "media_id": media['media_id'],
             "alt": "updated alt text"
@@ -187,8 +664,7 @@ class TestUpdateProductMedia(ProductMediaTestBase):
         assert expected['src'] is not None
 
         # --- test static file URL ---
-        url = f'/media/test{media["src"].split("/media")[-1]}'
-        response = self.client.get(url)
+        response = self.client.get(expected["src"])
         assert response.status_code == status.HTTP_200_OK
 
         # test file size is not zero
@@ -206,7 +682,7 @@ class TestDestroyProductMedia(ProductMediaTestBase):
         payload, product = await FakeProduct.populate_product_with_media()
 
         # --- get a media ---
-        media = ProductService.retrieve_media_list(product.id)
+        media = await ProductService().retrieve_media_list(product.id)
         media_ids = [
             media[0]['media_id'],
             media[1]['media_id']
@@ -220,8 +696,8 @@ class TestDestroyProductMedia(ProductMediaTestBase):
         assert response.status_code == status.HTTP_204_NO_CONTENT
 
         # --- expected ---
-        media_1 = ProductService.retrieve_single_media(media[0]['media_id'])
-        media_2 = ProductService.retrieve_single_media(media[1]['media_id'])
+        media_1 = await ProductService().retrieve_single_media(media[0]['media_id'])
+        media_2 = await ProductService().retrieve_single_media(media[1]['media_id'])
         assert media_1 is None
         assert media_2 is None
 
@@ -235,19 +711,18 @@ class TestDestroyProductMedia(ProductMediaTestBase):
         _, product = await FakeProduct.populate_product_with_media()
 
         # --- retrieve media to get a media_id ---
-        media = ProductService.retrieve_media_list(product.id)[0]
+        media = (await ProductService().retrieve_media_list(product.id))[0]
         media_id = media['media_id']
         # --- request ---
         response = self.client.delete(f"{self.product_media_endpoint}{media_id}", headers=self.admin_authorization)
         assert response.status_code == status.HTTP_204_NO_CONTENT
 
         # --- expected ---
-        expected_media = ProductService.retrieve_single_media(media_id)
+        expected_media = await ProductService().retrieve_single_media(media_id)
         assert expected_media is None
 
         # --- test static file URL ---
-        url = f'/media/test{media["src"].split("/media")[-1]}'
-        response = self.client.get(url)
+        response = self.client.get(media["src"])
         assert response.status_code == status.HTTP_404_NOT_FOUND
 
 
@@ -263,7 +738,7 @@ class TestProductMediaPayloadFields(ProductMediaTestBase):
         """
 
         # --- create a product ---
-        product_payload, product = FakeProduct.populate_product()
+        product_payload, product = asyncio.run(FakeProduct.populate_product())
 
         # --- upload files ----
         file_paths = FakeMedia.populate_images_for_product()
@@ -286,7 +761,7 @@ class TestProductMediaPayloadFields(ProductMediaTestBase):
         """
 
         # --- create a product ---
-        product_payload, product = FakeProduct.populate_product()
+        product_payload, product = asyncio.run(FakeProduct.populate_product())
 
         # --- upload files ----
         file_paths = FakeMedia.populate_images_for_product()
@@ -303,7 +778,7 @@ class TestProductMediaPayloadFields(ProductMediaTestBase):
         """
 
         # --- create a product ---
-        product_payload, product = FakeProduct.populate_product()
+        product_payload, product = asyncio.run(FakeProduct.populate_product())
 
         # --- upload files ----
         media_payload = {
@@ -321,7 +796,7 @@ class TestProductMediaPayloadFields(ProductMediaTestBase):
         """
 
         # --- create a product ---
-        product_payload, product = FakeProduct.populate_product()
+        product_payload, product = asyncio.run(FakeProduct.populate_product())
 
         # --- upload files ----
         file_paths = FakeMedia.populate_docs_file()
@@ -341,7 +816,7 @@ class TestProductMediaPayloadFields(ProductMediaTestBase):
         """
 
         # --- create a product ---
-        product_payload, product = FakeProduct.populate_product()
+        product_payload, product = asyncio.run(FakeProduct.populate_product())
 
         # --- upload files ----
         file_paths = FakeMedia.populate_large_file()
@@ -355,4 +830,22 @@ class TestProductMediaPayloadFields(ProductMediaTestBase):
                                     headers=self.admin_authorization)
         assert response.status_code == status.HTTP_400_BAD_REQUEST
 
+    def test_create_media_with_generated_large_file(self):
+        """
+        Test create media with a file larger than the max size, nothing is saved.
+        """
+
+        # --- create a product ---
+        product_payload, product = asyncio.run(FakeProduct.populate_product())
+
+        # --- upload a file 1 byte over the limit ---
+        large_file = io.BytesIO(b'\0' * (settings.MAX_FILE_SIZE * 1024 * 1024 + 1))
+        files = [("x_files", ('large.png', large_file, 'image/png'))]
+
+        # --- request ---
+        response = self.client.post(f"{self.product_endpoint}{product.id}/media/", data={'alt': 'test alt'},
+                                    files=files, headers=self.admin_authorization)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert asyncio.run(ProductService().retrieve_media_list(product.id)) is None
+
 # TODO test permissions for CRUD on product routers
@@ -1,10 +1,14 @@
+import asyncio
+
 import pytest
 from fastapi import status
 from fastapi.testclient import TestClient
 
 from apps.accounts.faker.data import FakeUser
 from apps.accounts.models import User
+from apps.accounts.services.user import UserManager
 from apps.core.base_test_case import BaseTestCase
+from apps.core.services.cache import CacheManager
 from apps.main import app
 from apps.products.faker.data import FakeProduct
 from apps.products.services import ProductService
@@ -22,9 +26,11 @@ class VariantTestBase(BaseTestCase):
     def setup_class(cls):
         cls.client = TestClient(app)
         DatabaseManager.create_test_database()
+        CacheManager.set_backend(None)
+        asyncio.run(UserManager.cache.clear())
 
         # --- create an admin ---
-        cls.admin, access_token = FakeUser.populate_admin()
+        cls.admin, access_token = asyncio.run(FakeUser.populate_admin())
         cls.admin_authorization = {"Authorization": f"Bearer {access_token}"}
 
     @classmethod
@@ -43,7 +49,7 @@ class TestRetrieveVariants(VariantTestBase):
         """
 
         # --- create a product with variant ---
-        _, product = FakeProduct.populate_product_with_options(get_product_obj=False)
+        _, product = asyncio.run(FakeProduct.populate_product_with_options(get_product_obj=False))
         variant = product['variants'][0]
 
         response = self.client.get(f"{self.variants_endpoint}{variant['variant_id']}")
@@ -68,7 +74,7 @@ class TestRetrieveVariants(VariantTestBase):
         """
 
         # --- create a product with variants ---
-        _, product = FakeProduct.populate_product_with_options(get_product_obj=False)
+        _, product = asyncio.run(FakeProduct.populate_product_with_options(get_product_obj=False))
         variants = product['variants']
 
         variants_len = len(variants)
@@ -92,6 +98,19 @@ class TestRetrieveVariants(VariantTestBase):
             assert variant['updated_at'] == expected['updated_at']
             self.assert_datetime_format(expected['created_at'])
 
+    def test_list_product_variants_not_modified(self):
+        """
+        Test revalidate the variants of a product with their ETag.
+        """
+
+        _, product = asyncio.run(FakeProduct.populate_product_with_options(get_product_obj=False))
+        endpoint = f"/products/{product['product_id']}/variants"
+
+        etag = self.client.get(endpoint).headers['etag']
+        response = self.client.get(endpoint, headers={'If-None-Match': etag})
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.content == b''
+
 
 class TestUpdateVariants(VariantTestBase):
     """
@@ -109,9 +128,9 @@ class TestUpdateVariants(VariantTestBase):
         """
 
         # --- create product ---
-        _, product = FakeProduct.populate_product_with_options()
-        variants = ProductService.retrieve_variants(product.id)
-        before_update = ProductService.retrieve_variant(variants[0]['variant_id'])
+        _, product = asyncio.run(FakeProduct.populate_product_with_options())
+        variants = asyncio.run(ProductService.retrieve_variants(product.id))
+        before_update = asyncio.run(ProductService.retrieve_variant(variants[0]['variant_id']))
 
         response = self.client.put(f"{self.variants_endpoint}{before_update['variant_id']}", json=payload,
                                    headers=self.admin_authorization)
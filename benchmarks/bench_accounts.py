@@ -0,0 +1,59 @@
+import pytest
+
+from apps.accounts.faker.data import FakeUser
+from apps.accounts.services.authenticate import AccountService
+from apps.accounts.services.token import TokenService
+from apps.accounts.services.user import UserManager
+
+
+@pytest.mark.benchmark(group='login')
+class TestLogin:
+    """
+    Each login hashes a password with bcrypt (`PASSWORD_HASHING['rounds']`), it's most of its time.
+    """
+
+    def test_service(self, benchmark, run, dataset):
+        user, _ = dataset['users'][0]
+        benchmark(lambda: run(AccountService.login(user.email, FakeUser.password)))
+
+    def test_asgi(self, benchmark, client, dataset):
+        user, _ = dataset['users'][1]
+
+        def login():
+            response = client.post('/accounts/login/', data={'username': user.email, 'password': FakeUser.password})
+            assert response.status_code == 200
+
+        benchmark(login)
+
+
+@pytest.mark.benchmark(group='fetch_user')
+class TestFetchUser:
+    """
+    Authenticate a request with an access token: from the cache of the users, and from the database (the cache entry
+    is removed before each round).
+    """
+
+    @staticmethod
+    def get_user(run, dataset, index: int):
+        # a new token, the logins of the other benchmarks revoke the tokens of their users
+        user, _ = dataset['users'][index]
+        return user, run(TokenService(user.id).create_access_token())
+
+    def test_service_cached(self, benchmark, run, dataset):
+        _, access_token = self.get_user(run, dataset, 2)
+        benchmark(lambda: run(TokenService.fetch_user(access_token)))
+
+    def test_service_uncached(self, benchmark, run, dataset, request):
+        user, access_token = self.get_user(run, dataset, 3)
+        benchmark.pedantic(lambda: run(TokenService.fetch_user(access_token)),
+                           setup=lambda: run(UserManager.invalidate_cached_user(user.id)),
+                           rounds=request.config.getoption('benchmark_min_rounds') * 4)
+
+    def test_asgi(self, benchmark, run, client, dataset):
+        _, access_token = self.get_user(run, dataset, 4)
+
+        def retrieve_me():
+            response = client.get('/accounts/me/', headers={'Authorization': f'Bearer {access_token}'})
+            assert response.status_code == 200
+
+        benchmark(retrieve_me)
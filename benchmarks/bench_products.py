@@ -0,0 +1,149 @@
+import io
+import random
+
+import pytest
+from fastapi import UploadFile
+from PIL import Image
+
+from apps.products.faker.data import FakeProduct
+from apps.products.services import ProductService
+
+
+def make_image() -> bytes:
+    image = io.BytesIO()
+    Image.new('RGB', (800, 600), color=(200, 120, 40)).save(image, 'PNG')
+    return image.getvalue()
+
+
+IMAGE = make_image()
+
+
+def rounds(request) -> int:
+    return request.config.getoption('benchmark_min_rounds') * 4
+
+
+@pytest.mark.benchmark(group='create_product')
+class TestCreateProduct:
+
+    def test_service(self, benchmark, run, dataset):
+        benchmark(lambda: run(ProductService.create_product(FakeProduct.get_payload())))
+
+    def test_service_with_options(self, benchmark, run, dataset):
+        benchmark(lambda: run(ProductService.create_product(FakeProduct.get_payload_with_options())))
+
+    def test_asgi(self, benchmark, client, dataset):
+        def create():
+            response = client.post('/products/', json=FakeProduct.get_payload(), headers=dataset['admin_authorization'])
+            assert response.status_code == 201
+
+        benchmark(create)
+
+    def test_asgi_with_options(self, benchmark, client, dataset):
+        def create():
+            response = client.post('/products/', json=FakeProduct.get_payload_with_options(),
+                                   headers=dataset['admin_authorization'])
+            assert response.status_code == 201
+
+        benchmark(create)
+
+
+@pytest.mark.benchmark(group='retrieve_product')
+class TestRetrieveProduct:
+    """
+    A product from the cache, and from the database (its cache entry is removed before each round).
+    """
+
+    def test_service_cached(self, benchmark, run, dataset):
+        product_id = dataset['products'][0].id
+        benchmark(lambda: run(ProductService().retrieve_product(product_id)))
+
+    def test_service_uncached(self, benchmark, run, dataset, request):
+        product_ids = [product.id for product in dataset['products']]
+        product_id = None
+
+        def setup():
+            nonlocal product_id
+            product_id = random.choice(product_ids)
+            run(ProductService.invalidate_product_cache(product_id))
+
+        benchmark.pedantic(lambda: run(ProductService().retrieve_product(product_id)), setup=setup,
+                           rounds=rounds(request))
+
+    def test_asgi_cached(self, benchmark, client, dataset):
+        product_id = dataset['products'][0].id
+        benchmark(lambda: client.get(f'/products/{product_id}'))
+
+    def test_asgi_uncached(self, benchmark, run, client, dataset, request):
+        product_ids = [product.id for product in dataset['products']]
+        product_id = None
+
+        def setup():
+            nonlocal product_id
+            product_id = random.choice(product_ids)
+            run(ProductService.invalidate_product_cache(product_id))
+
+        benchmark.pedantic(lambda: client.get(f'/products/{product_id}'), setup=setup, rounds=rounds(request))
+
+
+@pytest.mark.benchmark(group='list_products')
+class TestListProducts:
+
+    def test_service(self, benchmark, run, dataset):
+        benchmark(lambda: run(ProductService().list_products(limit=20)))
+
+    def test_asgi(self, benchmark, client, dataset):
+        benchmark(lambda: client.get('/products/', params={'limit': 20}))
+
+
+@pytest.mark.benchmark(group='update_variant')
+class TestUpdateVariant:
+
+    @staticmethod
+    def get_variant_ids(run, dataset) -> list[int]:
+        product_ids = [product.id for product in dataset['products'][:10]]
+        return [variant['variant_id'] for product_id in product_ids
+                for variant in run(ProductService.retrieve_variants(product_id))]
+
+    def test_service(self, benchmark, run, dataset):
+        variant_ids = self.get_variant_ids(run, dataset)
+        benchmark(lambda: run(ProductService.update_variant(random.choice(variant_ids),
+                                                            price=FakeProduct.get_random_price())))
+
+    def test_asgi(self, benchmark, run, client, dataset):
+        variant_ids = self.get_variant_ids(run, dataset)
+
+        def update():
+            response = client.put(f'/products/variants/{random.choice(variant_ids)}',
+                                  json={'price': FakeProduct.get_random_price()},
+                                  headers=dataset['admin_authorization'])
+            assert response.status_code == 200
+
+        benchmark(update)
+
+
+@pytest.mark.benchmark(group='create_media')
+class TestCreateMedia:
+    """
+    Attach 3 images (800x600 PNG) to a product. Through the app, the thumbnails are made in the background task of the
+    request, which the test client waits for.
+    """
+
+    def test_service(self, benchmark, run, dataset):
+        product_id = dataset['products'][1].id
+
+        def create():
+            files = [UploadFile(filename=f'image-{i}.png', file=io.BytesIO(IMAGE)) for i in range(3)]
+            run(ProductService().create_media(product_id, alt=None, files=files))
+
+        benchmark(create)
+
+    def test_asgi(self, benchmark, client, dataset):
+        product_id = dataset['products'][2].id
+
+        def create():
+            files = [('x_files', (f'image-{i}.png', io.BytesIO(IMAGE), 'image/png')) for i in range(3)]
+            response = client.post(f'/products/{product_id}/media', files=files,
+                                   headers=dataset['admin_authorization'])
+            assert response.status_code == 201
+
+        benchmark(create)
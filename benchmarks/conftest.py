@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from apps.accounts.faker.data import FakeUser
+from apps.accounts.services.user import UserManager
+from apps.core.services.cache import CacheManager
+from apps.core.services.storage import StorageManager, LocalStorage
+from apps.main import app
+from apps.products.faker.data import FakeProduct
+from config.database import DatabaseManager
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('dataset', 'Benchmark dataset')
+    group.addoption('--products', type=int, default=100, help='Number of products (with options) to seed.')
+    group.addoption('--users', type=int, default=10, help='Number of users to seed.')
+
+
+@pytest.fixture(scope='session')
+def run():
+    """
+    Run a coroutine to completion, on one event loop for the whole session.
+    """
+
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+@pytest.fixture(scope='session')
+def dataset(request, run, tmp_path_factory):
+    """
+    Seed the test database with `--products` products (each with 3 options) and `--users` users, and an admin.
+    """
+
+    DatabaseManager.create_test_database()
+    CacheManager.set_backend(None)
+    run(UserManager.cache.clear())
+    StorageManager.set_backend(LocalStorage(tmp_path_factory.mktemp('media')))
+
+    products = [run(FakeProduct.populate_product_with_options())[1]
+                for _ in range(request.config.getoption('products'))]
+    users = [run(FakeUser.populate_user()) for _ in range(request.config.getoption('users'))]
+    admin, admin_token = run(FakeUser.populate_admin())
+
+    yield {
+        'products': products,
+        'users': users,
+        'admin_authorization': {'Authorization': f'Bearer {admin_token}'}
+    }
+
+    StorageManager.set_backend(None)
+    DatabaseManager.drop_all_tables()
+
+
+@pytest.fixture(scope='session')
+def client(dataset):
+    """
+    A client of the ASGI app, the requests go through all the middlewares and the routers.
+    """
+
+    with TestClient(app) as client:
+        yield client
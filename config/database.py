@@ -1,17 +1,28 @@
+import base64
+import binascii
 import importlib
+import json
 import os
+from contextvars import ContextVar
 from operator import and_
 from pathlib import Path
+from typing import Callable
 
 from fastapi import HTTPException
-from sqlalchemy import create_engine, URL, MetaData
+from sqlalchemy import create_engine, URL, MetaData, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine, AsyncSession
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy.orm import sessionmaker, Session, Query
+from sqlalchemy.orm import sessionmaker, scoped_session, Session, Query
+from sqlalchemy.pool import NullPool, Pool
 
 from . import settings
 
 testing = False
 
+# the sessions that belong to the current HTTP request (set by `DatabaseSessionMiddleware`)
+_request_session: ContextVar[Session | None] = ContextVar("request_session", default=None)
+_request_async_session: ContextVar[AsyncSession | None] = ContextVar("request_async_session", default=None)
+
 
 class DatabaseManager:
     """
@@ -21,14 +32,23 @@ class DatabaseManager:
     tables based on SQLAlchemy models, and providing a session for performing database operations.
 
     Attributes:
-        engine (Engine): The SQLAlchemy engine for the configured database.
-        session (Session): The SQLAlchemy session for database interactions.
+        engine (Engine): The SQLAlchemy engine (with its connection pool) for the configured database.
+        session_factory (sessionmaker): Factory that opens new sessions bound to the engine.
+        session (scoped_session): Thread-local sessions, used when code runs outside an HTTP request.
+        async_engine (AsyncEngine): The SQLAlchemy async engine (aiosqlite/asyncpg) for the same database.
+        async_session_factory (async_sessionmaker): Factory that opens new async sessions.
 
     Methods:
         __init__():
-            Initializes the DatabaseManager by creating an SQLAlchemy engine and a session based on the
+            Initializes the DatabaseManager by creating an SQLAlchemy engine and a session factory based on the
             specified database configuration from the 'settings' module.
 
+        get_session():
+            Returns the session of the current request, or a thread-local session outside a request.
+
+        get_async_session():
+            Returns the async session of the current request, or a new async session outside a request.
+
         create_database_tables():
             Detects 'models.py' files in subdirectories of the 'apps' directory and creates corresponding
             database tables based on SQLAlchemy models.
@@ -43,33 +63,115 @@ class DatabaseManager:
         DatabaseManager().create_database_tables()
     """
     engine: create_engine = None
-    session: Session = None
+    session_factory: sessionmaker = None
+    session: scoped_session = None
+    async_engine: AsyncEngine = None
+    async_session_factory: async_sessionmaker = None
+
+    # called with the pool class and the type ('sync' or 'async') of each engine created here, returns the pool class
+    # to use instead, e.g. to time the checkouts (see `DatabaseMetrics.instrument`)
+    pool_class_wrapper: Callable[[type[Pool], str], type[Pool]] | None = None
 
     @classmethod
     def __init__(cls):
         """
         Initializes the DatabaseManager.
 
-        This method creates an SQLAlchemy engine and a session based on the specified database configuration
-        from the 'settings' module.
+        This method creates an SQLAlchemy engine with a connection pool and a session factory based on the
+        specified database configuration from the 'settings' module, and an async engine (with its own session
+        factory) for the same database.
         """
         global testing  # Access the global testing flag
         db_config = settings.DATABASES.copy()
         if testing:
             db_config["database"] = "test_" + db_config["database"]
 
+        # release the connections of a previous engine (e.g. when switching to the test database)
+        if cls.engine is not None:
+            cls.session.remove()
+            cls.engine.dispose()
+
+        pool_config = settings.DATABASE_POOL.copy()
+        async_config = db_config.copy()
+        async_config["drivername"] = settings.ASYNC_DATABASE_DRIVERS[db_config["drivername"]]
+
         if db_config["drivername"] == "sqlite":
             project_root = Path(__file__).parent.parent  # Assuming this is where your models are located
             db_config["database"] = os.path.join(project_root, db_config["database"])
+            async_config["database"] = db_config["database"]
 
             url = URL.create(**db_config)
-            cls.engine = create_engine(url, connect_args={"check_same_thread": False})
+            cls.engine = create_engine(url, connect_args={"check_same_thread": False}, **pool_config,
+                                       **cls.__pool_class(url, "sync"))
+
+            # aiosqlite opens a connection per session on a file database (NullPool), there is nothing to size
+            async_url = URL.create(**async_config)
+            cls.async_engine = create_async_engine(async_url, **cls.__pool_class(async_url, "async"))
         else:
             # for postgres
-            cls.engine = create_engine(URL.create(**db_config))
+            url = URL.create(**db_config)
+            cls.engine = create_engine(url, **pool_config, **cls.__pool_class(url, "sync"))
+
+            # pooled connections are bound to the event loop that opened them, tests run each request (and each
+            # `asyncio.run()`) on a new loop, so they must not reuse connections.
+            async_url = URL.create(**async_config)
+            if testing:
+                cls.async_engine = create_async_engine(async_url, **cls.__pool_class(async_url, "async", NullPool))
+            else:
+                cls.async_engine = create_async_engine(async_url, **pool_config,
+                                                       **cls.__pool_class(async_url, "async"))
+
+        cls.session_factory = sessionmaker(autocommit=False, autoflush=False, bind=cls.engine)
+        cls.session = scoped_session(cls.session_factory)
+
+        # objects are used after the session is closed, so they must keep their loaded state after a commit
+        cls.async_session_factory = async_sessionmaker(autoflush=False, expire_on_commit=False,
+                                                       bind=cls.async_engine)
 
-        session = sessionmaker(autocommit=False, autoflush=False, bind=cls.engine)
-        cls.session = session()
+    @classmethod
+    def __pool_class(cls, url: URL, engine_type: str, pool_class: type[Pool] | None = None) -> dict:
+        """
+        Get the `poolclass` argument of an engine: the pool class (by default the one of the dialect) wrapped by
+        `pool_class_wrapper`, if any.
+        """
+
+        if cls.pool_class_wrapper is None:
+            return {"poolclass": pool_class} if pool_class else {}
+        pool_class = pool_class or url.get_dialect().get_pool_class(url)
+        return {"poolclass": cls.pool_class_wrapper(pool_class, engine_type)}
+
+    @classmethod
+    def get_session(cls) -> Session:
+        """
+        Get the session to use for a database operation.
+
+        Inside an HTTP request this is the session opened by `DatabaseSessionMiddleware` for that request, so
+        concurrent requests never share a session. Outside a request (scripts, tests, demo data) a thread-local
+        session is returned.
+        """
+
+        session = _request_session.get()
+        if session is None:
+            session = cls.session()
+        return session
+
+    @classmethod
+    def get_async_session(cls) -> AsyncSession:
+        """
+        Get the async session to use for a database operation.
+
+        Inside an HTTP request this is the async session opened by `DatabaseSessionMiddleware` for that request.
+        Outside a request a new async session is returned, so concurrent tasks never share one.
+
+        Example Usage:
+            async with DatabaseManager.get_async_session() as session:
+                await session.execute(...)
+        """
+
+        session = _request_async_session.get()
+        if session is None:
+            session = cls.async_session_factory()
+        return session
 
     @classmethod
     def create_test_database(cls):
@@ -130,6 +232,38 @@ class DatabaseManager:
         return testing
 
 
+class DatabaseSessionMiddleware:
+    """
+    ASGI middleware that gives every HTTP request its own database sessions (sync and async).
+
+    The sessions are created when the request starts, are used by all `FastModel` operations made while handling
+    that request, and are closed (returning their connections to the pool) when the request ends.
+
+    Example Usage:
+        app.add_middleware(DatabaseSessionMiddleware)
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        session = DatabaseManager.session_factory()
+        async_session = DatabaseManager.async_session_factory()
+        token = _request_session.set(session)
+        async_token = _request_async_session.set(async_session)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            await async_session.close()
+            session.close()
+            _request_async_session.reset(async_token)
+            _request_session.reset(token)
+
+
 class FastModel(DeclarativeBase):
     """
     A base class for creating SQLAlchemy ORM models with built-in CRUD operations.
@@ -150,6 +284,13 @@ class FastModel(DeclarativeBase):
         filter(condition):
             Retrieve records from the database based on a given filter condition.
 
+        acreate(**kwargs), aget(pk), aget_or_404(pk), afilter(condition), afirst(condition), aupdate(pk, **kwargs),
+        adelete(instance):
+            Awaitable counterparts of the methods above, they run on the async engine and don't block the event loop.
+
+        akeyset(after, limit, condition, options):
+            Retrieve a page of records with keyset (cursor) pagination.
+
     Example Usage:
         class Product(FastModel):
             ...
@@ -159,6 +300,14 @@ class FastModel(DeclarativeBase):
 
         # Filter products based on a condition
         active_products = Product.filter(Product.status == "active")
+
+        # The same inside an async route
+        new_product = await Product.acreate(product_name="Example Product", ...)
+        active_products = await Product.afilter(Product.status == "active")
+
+        # Page through the products, 12 per page
+        products, next_cursor = await Product.akeyset(limit=12)
+        products, next_cursor = await Product.akeyset(after=next_cursor, limit=12)
     """
 
     # TODO update FastModel methods
@@ -181,7 +330,7 @@ class FastModel(DeclarativeBase):
         """
 
         instance = cls(**kwargs)
-        session = DatabaseManager.session
+        session = DatabaseManager.get_session()
         try:
             session.add(instance)
             session.commit()
@@ -205,7 +354,7 @@ class FastModel(DeclarativeBase):
             List of model instances matching the filter condition.
         """
 
-        with DatabaseManager.session as session:
+        with DatabaseManager.get_session() as session:
             query: Query = session.query(cls).filter(condition)
         return query
 
@@ -220,7 +369,7 @@ class FastModel(DeclarativeBase):
         Returns:
             The model instance with the specified primary key, or None if not found
         """
-        with DatabaseManager.session as session:
+        with DatabaseManager.get_session() as session:
             instance = session.get(cls, pk)
         return instance
 
@@ -238,7 +387,7 @@ class FastModel(DeclarativeBase):
         Raises:
             HTTPException(404): If the record is not found.
         """
-        with DatabaseManager.session as session:
+        with DatabaseManager.get_session() as session:
             instance = session.get(cls, pk)
             if not instance:
                 raise HTTPException(status_code=404, detail=f"{cls.__name__} not found")
@@ -259,7 +408,7 @@ class FastModel(DeclarativeBase):
         Raises:
             HTTPException(404): If the record is not found.
         """
-        with DatabaseManager.session as session:
+        with DatabaseManager.get_session() as session:
 
             # Retrieve the object by its primary key or raise a 404 exception
             # instance = session.query(cls).get(pk)
@@ -283,7 +432,7 @@ class FastModel(DeclarativeBase):
     @staticmethod
     def delete(instance):
 
-        with DatabaseManager.session as session:
+        with DatabaseManager.get_session() as session:
 
             # destroy
             session.delete(instance)
@@ -294,3 +443,210 @@ class FastModel(DeclarativeBase):
             except Exception:
                 session.rollback()
                 raise
+
+    # ------------------------
+    # --- Async Operations ---
+    # ------------------------
+
+    @classmethod
+    async def acreate(cls, **kwargs):
+        """
+        Create a new instance of the model, add it to the database, and commit the transaction (async).
+
+        Args:
+            **kwargs: Keyword arguments representing model attributes.
+
+        Returns:
+            The newly created model instance.
+        """
+
+        instance = cls(**kwargs)
+        async with DatabaseManager.get_async_session() as session:
+            try:
+                session.add(instance)
+                await session.commit()
+                await session.refresh(instance)
+            except Exception:
+                await session.rollback()
+                raise
+        return instance
+
+    @classmethod
+    async def afilter(cls, condition) -> list:
+        """
+        Retrieve records from the database based on a given filter condition (async).
+
+        Args:
+            condition: SQLAlchemy filter condition.
+
+        Returns:
+            List of model instances matching the filter condition.
+        """
+
+        async with DatabaseManager.get_async_session() as session:
+            result = await session.scalars(select(cls).where(condition))
+            return list(result.all())
+
+    @classmethod
+    async def afirst(cls, condition):
+        """
+        Retrieve the first record that matches a given filter condition (async).
+
+        Args:
+            condition: SQLAlchemy filter condition.
+
+        Returns:
+            The first model instance matching the filter condition, or None if not found.
+        """
+
+        async with DatabaseManager.get_async_session() as session:
+            result = await session.scalars(select(cls).where(condition).limit(1))
+            return result.first()
+
+    @classmethod
+    async def aget(cls, pk):
+        """
+        Retrieve a record by its primary key (async).
+
+        Args:
+            pk: The primary key value of the record to retrieve.
+
+        Returns:
+            The model instance with the specified primary key, or None if not found
+        """
+
+        async with DatabaseManager.get_async_session() as session:
+            instance = await session.get(cls, pk)
+        return instance
+
+    @classmethod
+    async def aget_or_404(cls, pk):
+        """
+        Retrieve a record by its primary key or raise a 404 HTTPException if not found (async).
+
+        Args:
+            pk: The primary key value of the record to retrieve.
+
+        Returns:
+            The model instance with the specified primary key.
+
+        Raises:
+            HTTPException(404): If the record is not found.
+        """
+
+        instance = await cls.aget(pk)
+        if not instance:
+            raise HTTPException(status_code=404, detail=f"{cls.__name__} not found")
+        return instance
+
+    @classmethod
+    async def aupdate(cls, pk, **kwargs):
+        """
+        Update a record by its primary key (async).
+
+        Args:
+            pk: The primary key value of the record to update.
+            **kwargs: Keyword arguments representing model attributes to update.
+
+        Returns:
+            The updated model instance.
+
+        Raises:
+            HTTPException(404): If the record is not found.
+        """
+
+        async with DatabaseManager.get_async_session() as session:
+            instance = await session.get(cls, pk)
+            if not instance:
+                raise HTTPException(status_code=404, detail=f"{cls.__name__} not found")
+
+            for key, value in kwargs.items():
+                setattr(instance, key, value)
+
+            try:
+                await session.commit()
+                await session.refresh(instance)
+            except Exception:
+                await session.rollback()
+                raise
+        return instance
+
+    @staticmethod
+    async def adelete(instance):
+        """
+        Delete a record, and the records that cascade from it (async).
+        """
+
+        async with DatabaseManager.get_async_session() as session:
+            await session.delete(instance)
+            try:
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+
+    # ------------------
+    # --- Pagination ---
+    # ------------------
+
+    @classmethod
+    async def akeyset(cls, after: str | None = None, limit: int = 12, condition=None, options: tuple = ()):
+        """
+        Retrieve a page of records with keyset (cursor) pagination, ordered by the primary key `id`.
+
+        Instead of skipping the previous rows with `OFFSET`, the page starts right after the last `id` of the
+        previous page, so the primary-key index is used and a deep page costs the same as the first one.
+
+        Args:
+            after: The opaque cursor returned with the previous page, or None for the first page.
+            limit: The maximum number of records in the page.
+            condition: Optional SQLAlchemy filter condition.
+            options: Optional loader options (e.g. `selectinload(...)`) for the records of the page.
+
+        Returns:
+            A tuple of the model instances in the page and the cursor of the next page (None on the last page).
+
+        Raises:
+            HTTPException(400): If the cursor is invalid.
+        """
+
+        query = select(cls).order_by(cls.id).limit(limit + 1).options(*options)
+        if condition is not None:
+            query = query.where(condition)
+        if after is not None:
+            query = query.where(cls.id > cls.decode_cursor(after)['id'])
+
+        async with DatabaseManager.get_async_session() as session:
+            instances = (await session.scalars(query)).all()
+
+        # one more row than the limit is loaded, just to know whether there is a next page
+        next_cursor = None
+        if len(instances) > limit:
+            instances = instances[:limit]
+            next_cursor = cls.encode_cursor({'id': instances[-1].id})
+        return list(instances), next_cursor
+
+    @staticmethod
+    def encode_cursor(values: dict) -> str:
+        """
+        Encode the position of the last record of a page into an opaque, URL-safe cursor.
+        """
+
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> dict:
+        """
+        Decode a cursor made by `encode_cursor`.
+
+        Raises:
+            HTTPException(400): If the cursor is invalid.
+        """
+
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            if not isinstance(values, dict) or not isinstance(values.get('id'), int):
+                raise ValueError
+        except (ValueError, binascii.Error):
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
+        return values
@@ -64,6 +64,31 @@ class EmailServiceConfig:
         return cls.config
 
 
+# Outbound emails: the request handlers only queue them, a background task sends them in batches of up to
+# `batch_size` over a reused SMTP connection (closed after `idle_timeout` seconds without email).
+# - security: "ssl" (SMTP over TLS, usually port 465), "starttls" (usually port 587) or "none" (e.g. a local relay).
+# - max_attempts, backoff: an email that failed with a temporary error is sent again after `backoff`, `2 * backoff`,
+#   `4 * backoff`... seconds, `max_attempts` times at most.
+EMAIL_QUEUE = {
+    "security": os.getenv("SMTP_SECURITY", "ssl"),
+    "timeout": int(os.getenv("SMTP_TIMEOUT", 30)),
+    "idle_timeout": int(os.getenv("SMTP_IDLE_TIMEOUT", 60)),
+    "batch_size": int(os.getenv("EMAIL_BATCH_SIZE", 20)),
+    "max_attempts": int(os.getenv("EMAIL_MAX_ATTEMPTS", 5)),
+    "backoff": float(os.getenv("EMAIL_RETRY_BACKOFF", 2))
+}
+
+
+# Prometheus metrics of the requests, the database queries and pools, and the uploads, served at `path`. With many
+# worker processes, set `PROMETHEUS_MULTIPROC_DIR` (see `prometheus_client`) so the metrics of all of them are served.
+METRICS = {
+    "enabled": os.getenv("METRICS_ENABLED", "True").lower() == "true",
+    "path": os.getenv("METRICS_PATH", "/metrics"),
+    "latency_buckets": (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    "size_buckets": (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+}
+
+
 # -------------------------
 # --- Database Settings ---
 # -------------------------
@@ -81,6 +106,63 @@ DATABASES = {
     "database": "fast_store.db"
 }
 
+# Drivers used by the async engine, for each `drivername` of `DATABASES`.
+ASYNC_DATABASE_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg"
+}
+
+# Connection pool, every request checks out its own session/connection from this pool.
+# - pool_size: connections kept open in the pool.
+# - max_overflow: extra connections opened when the pool is exhausted.
+# - pool_recycle: seconds after which a connection is replaced (avoid server-side timeouts).
+# - pool_pre_ping: test a connection before using it, to drop the stale ones.
+DATABASE_POOL = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "True").lower() == "true"
+}
+
+# Warn when the same statement runs many times in a query count (`QueryCounter`), a likely N+1 query.
+DEBUG_QUERIES = os.getenv("DEBUG_QUERIES", "False").lower() == "true"
+
+# ----------------------
+# --- Cache Settings ---
+# ----------------------
+
+# Cache of the read-mostly data (e.g. products).
+# - backend: "memory" (an LRU in each worker process) or "redis" (shared by all the workers).
+# - url: the redis server, used by the "redis" backend.
+# - ttl: seconds an entry lives, entries are also invalidated when their data changes.
+# - max_entries: the size of the LRU of the "memory" backend.
+CACHES = {
+    "backend": os.getenv("CACHE_BACKEND", "memory"),
+    "url": os.getenv("CACHE_URL", "redis://localhost:6379/0"),
+    "ttl": int(os.getenv("CACHE_TTL", 300)),
+    "max_entries": int(os.getenv("CACHE_MAX_ENTRIES", 1024))
+}
+
+# `Cache-Control` of the conditional GET responses (products, variants and media). Browsers and CDNs keep them, but
+# revalidate them with `If-None-Match` / `If-Modified-Since` and get a bodiless `304` if nothing has changed.
+HTTP_CACHE_CONTROL = os.getenv("HTTP_CACHE_CONTROL", "public, no-cache")
+
+# Cache of the authenticated users, in each worker process, so a request with an access token doesn't query the
+# database. An entry is invalidated when its user changes, in the worker that changes it: `ttl` (seconds) bounds how
+# long the other workers may still accept a revoked token.
+AUTH_CACHE = {
+    "ttl": int(os.getenv("AUTH_CACHE_TTL", 30)),
+    "max_entries": int(os.getenv("AUTH_CACHE_MAX_ENTRIES", 10000))
+}
+
+# Password hashing (bcrypt), off the event loop in a pool of `workers` threads per worker process.
+# - rounds: the cost of the hashes (each step doubles the time). When it changes, the hash of a user is upgraded at
+#   their next login.
+PASSWORD_HASHING = {
+    "rounds": int(os.getenv("PASSWORD_HASHING_ROUNDS", 12)),
+    "workers": int(os.getenv("PASSWORD_HASHING_WORKERS", 2))
+}
+
 # ----------------------
 # --- Media Settings ---
 # ----------------------
@@ -91,8 +173,69 @@ MEDIA_DIR = BASE_DIR / "media"
 # Ensure the "media" directory exists
 MEDIA_DIR.mkdir(parents=True, exist_ok=True)
 
+# Storage of the media files.
+# - backend: "local" (the media directory) or "s3" (any S3-compatible object storage, credentials are read by boto3
+#   from its usual environment variables).
+# - url: the base URL the files are served from (e.g. a CDN), by default the app serves the local files at `/media/`.
+# - bucket, endpoint_url, region: the S3 bucket.
+# - presigned_expires: seconds a presigned upload (a direct upload from a client to the storage) is valid.
+MEDIA_STORAGE = {
+    "backend": os.getenv("MEDIA_STORAGE_BACKEND", "local"),
+    "url": os.getenv("MEDIA_URL") or None,
+    "bucket": os.getenv("MEDIA_S3_BUCKET"),
+    "endpoint_url": os.getenv("MEDIA_S3_ENDPOINT_URL") or None,
+    "region": os.getenv("MEDIA_S3_REGION") or None,
+    "presigned_expires": int(os.getenv("MEDIA_PRESIGNED_EXPIRES", 3600))
+}
+
 # int number as MB
 MAX_FILE_SIZE = 5
+# uploads are streamed to the disk in chunks of this size (in bytes)
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# max number of files of one request (e.g. a gallery) that are saved at the same time
+MEDIA_UPLOAD_CONCURRENCY = int(os.getenv("MEDIA_UPLOAD_CONCURRENCY", 8))
+
+# Serving of the local media files (at `/media/`).
+# - accel_redirect: an internal location of the reverse proxy (e.g. "/protected-media/" in nginx) to send the files
+#   with `X-Accel-Redirect`, the app only checks the requests. By default, the app sends the files.
+# - immutable_max_age: seconds the files with a unique name (random or content hash) are cached, they never change.
+MEDIA_SERVING = {
+    "accel_redirect": os.getenv("MEDIA_ACCEL_REDIRECT") or None,
+    "immutable_max_age": int(os.getenv("MEDIA_IMMUTABLE_MAX_AGE", 365 * 24 * 60 * 60))
+}
+
+# Content-addressed storage: store each upload once, under the SHA-256 of its content (`media/blobs/...`), and share
+# it between all the media that upload the same file.
+MEDIA_CONTENT_ADDRESSED = os.getenv("MEDIA_CONTENT_ADDRESSED", "False").lower() == "true"
+
+# Sharded layout: store the files of a product in `media/products/ab/cd/{product_id}` (a hashed fan-out) instead of
+# `media/products/{product_id}`, so the `products` directory doesn't get too large to list, back up or sync. The files
+# stored before are moved with `python media_shard.py`.
+MEDIA_SHARDED_LAYOUT = os.getenv("MEDIA_SHARDED_LAYOUT", "False").lower() == "true"
+
+# Product images are resized in the background to these widths (px), in each of these formats (`None` is the format
+# of the original image), by a pool of `MEDIA_PROCESS_WORKERS` processes. Images are never upscaled.
+MEDIA_THUMBNAIL_WIDTHS = (150, 400, 1000)
+MEDIA_THUMBNAIL_FORMATS = ("webp", None)
+MEDIA_PROCESS_WORKERS = int(os.getenv("MEDIA_PROCESS_WORKERS", 2))
+
+# Garbage collector of the media files no product media references anymore (`python media_gc.py`).
+# - prefixes: the directories of the storage it scans, the only ones the app writes to.
+# - batch_size: number of files checked against the database per query.
+# - rate: max number of files deleted (or quarantined) per second, to spare the disk or the storage API.
+# - min_age: seconds a file is kept before it can be collected, so an upload that isn't saved in the database yet
+#   isn't collected.
+# - quarantine: the directory unreferenced files are moved to (instead of deleted) with `--quarantine`. The app
+#   doesn't serve it (see `MediaFiles`), a proxy or a bucket that serves the media directly must deny it too.
+MEDIA_GC = {
+    "prefixes": ("products", "blobs"),
+    "batch_size": 500,
+    "rate": float(os.getenv("MEDIA_GC_RATE", 50)),
+    "min_age": int(os.getenv("MEDIA_GC_MIN_AGE", 24 * 60 * 60)),
+    "quarantine": "quarantine"
+}
 products_list_limit = 12
+# the largest page a client can ask for with the `limit` query param
+products_list_max_limit = 100
 
 # TODO add settings to limit register new user or close register
@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from apps.attributes.models import Attribute
+from config.database import DatabaseManager, DatabaseSessionMiddleware
+
+
+class DatabaseTestBase:
+
+    @classmethod
+    def setup_class(cls):
+        DatabaseManager.create_test_database()
+
+    @classmethod
+    def teardown_class(cls):
+        DatabaseManager.drop_all_tables()
+
+
+class TestRequestSession(DatabaseTestBase):
+    """
+    Test the session-per-request model of `DatabaseSessionMiddleware`.
+    """
+
+    @classmethod
+    def setup_class(cls):
+        super().setup_class()
+        cls.sessions = []
+
+        app = FastAPI()
+        app.add_middleware(DatabaseSessionMiddleware)
+
+        @app.get('/session')
+        async def request_session():
+            session = DatabaseManager.get_session()
+            session.execute(text('SELECT 1'))
+            cls.sessions.append(session)
+            return {'session_id': id(session)}
+
+        cls.client = TestClient(app)
+
+    def test_each_request_has_its_own_session(self):
+        """
+        Test two requests never share a session, and none of them uses the thread-local session.
+        """
+
+        first = self.client.get('/session').json()['session_id']
+        second = self.client.get('/session').json()['session_id']
+
+        assert first != second
+        assert id(DatabaseManager.session()) not in (first, second)
+
+    def test_session_is_closed_after_request(self):
+        """
+        Test the request session releases its connection when the response is sent.
+        """
+
+        self.client.get('/session')
+        session = self.sessions[-1]
+        assert session.in_transaction() is False
+
+    def test_outside_request_uses_thread_local_session(self):
+        """
+        Test code running outside a request (scripts, tests) gets the thread-local session.
+        """
+
+        assert DatabaseManager.get_session() is DatabaseManager.session()
+
+
+class TestAsyncFastModel(DatabaseTestBase):
+    """
+    Test the awaitable CRUD operations of `FastModel`.
+    """
+
+    @pytest.mark.asyncio
+    async def test_async_crud(self):
+        """
+        Test create, get, filter, update and delete a record on the async engine.
+        """
+
+        attribute = await Attribute.acreate(name='color')
+        assert attribute.id > 0
+
+        assert (await Attribute.aget(attribute.id)).name == 'color'
+        assert [item.id for item in await Attribute.afilter(Attribute.name == 'color')] == [attribute.id]
+        assert (await Attribute.afirst(Attribute.name == 'color')).id == attribute.id
+
+        updated = await Attribute.aupdate(attribute.id, name='size')
+        assert updated.name == 'size'
+
+        await Attribute.adelete(updated)
+        assert await Attribute.aget(attribute.id) is None
+
+    @pytest.mark.asyncio
+    async def test_get_or_404(self):
+        """
+        Test `aget_or_404` raises a 404 when the record doesn't exist.
+        """
+
+        with pytest.raises(HTTPException) as error:
+            await Attribute.aget_or_404(999999)
+        assert error.value.status_code == 404
+
+    @pytest.mark.asyncio
+    async def test_concurrent_operations(self):
+        """
+        Test many concurrent tasks on one event loop, each of them gets its own session.
+        """
+
+        attributes = await asyncio.gather(*[Attribute.acreate(name=f'attribute-{i}') for i in range(20)])
+        assert len({attribute.id for attribute in attributes}) == 20
+
+        found = await Attribute.afilter(Attribute.name.startswith('attribute-'))
+        assert len(found) == 20
+
+
+class TestKeysetPagination(DatabaseTestBase):
+    """
+    Test the keyset (cursor) pagination of `FastModel`.
+    """
+
+    @pytest.mark.asyncio
+    async def test_page_through_records(self):
+        """
+        Test following the cursors visits every record once, in primary-key order.
+        """
+
+        created = [await Attribute.acreate(name=f'page-{i}') for i in range(7)]
+        condition = Attribute.name.startswith('page-')
+
+        pages, cursor = [], None
+        while True:
+            page, cursor = await Attribute.akeyset(after=cursor, limit=3, condition=condition)
+            pages.append([attribute.id for attribute in page])
+            if cursor is None:
+                break
+
+        assert pages == [[a.id for a in created[0:3]], [a.id for a in created[3:6]], [created[6].id]]
+
+    @pytest.mark.asyncio
+    async def test_invalid_cursor(self):
+        """
+        Test an invalid cursor raises a 400.
+        """
+
+        for cursor in ('not-a-cursor', Attribute.encode_cursor({'id': 'x'})):
+            with pytest.raises(HTTPException) as error:
+                await Attribute.akeyset(after=cursor)
+            assert error.value.status_code == 400
@@ -19,7 +19,7 @@ if __name__ == "__main__":
     RouterManager(app).import_routers()
 
     # --- Demo Users ---
-    FakeUser.populate_members()
+    asyncio.run(FakeUser.populate_members())
 
     # --- Demo Products ---
     asyncio.run(FakeProduct.populate_30_products())
@@ -0,0 +1,43 @@
+import argparse
+import asyncio
+
+from apps.core.services.media_gc import MediaGarbageCollector
+from apps.products.services import ProductService
+from config.settings import MEDIA_GC
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Delete the media files that no product media references anymore.")
+    parser.add_argument("--dry-run", action="store_true", help="only report the unreferenced files")
+    parser.add_argument("--quarantine", action="store_true",
+                        help=f"move the unreferenced files to `{MEDIA_GC['quarantine']}/` instead of deleting them")
+    parser.add_argument("--rate", type=float, default=MEDIA_GC['rate'],
+                        help="max number of files removed per second (0 for no limit)")
+    parser.add_argument("--min-age", type=int, default=MEDIA_GC['min_age'],
+                        help="seconds a file is kept before it can be collected")
+    parser.add_argument("--batch-size", type=int, default=MEDIA_GC['batch_size'],
+                        help="number of files checked against the database per query")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from config.database import DatabaseManager
+
+    # init models
+    DatabaseManager().create_database_tables()
+
+    args = parse_args()
+    collector = MediaGarbageCollector(
+        ProductService.referenced_media_keys,
+        batch_size=args.batch_size,
+        rate=args.rate,
+        min_age=args.min_age,
+        quarantine=MEDIA_GC['quarantine'] if args.quarantine else None,
+        dry_run=args.dry_run)
+    report = asyncio.run(collector.run())
+
+    print(f"scanned:   {report['scanned']} files, {report['scanned_bytes']} bytes "
+          f"({report['skipped']} too recent to collect)")
+    print(f"orphans:   {report['orphans']} files, {report['orphan_bytes']} bytes")
+    print(f"removed:   {report['removed']} files ({report['failed']} failed)")
+    print(f"reclaimed: {report['reclaimed_bytes']} bytes")
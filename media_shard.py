@@ -0,0 +1,29 @@
+import argparse
+import asyncio
+
+from apps.products.services import ProductService
+from config import settings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Move the product media files to the sharded layout (`products/ab/cd/{product_id}`).")
+    parser.add_argument("--batch-size", type=int, default=100, help="number of media moved per transaction")
+    parser.add_argument("--pause", type=float, default=0, help="seconds to wait between two batches")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from config.database import DatabaseManager
+
+    # init models
+    DatabaseManager().create_database_tables()
+
+    args = parse_args()
+    if not settings.MEDIA_SHARDED_LAYOUT:
+        print("Warning: MEDIA_SHARDED_LAYOUT is off, new uploads are still saved in `products/{product_id}`.")
+
+    report = asyncio.run(ProductService.shard_media(batch_size=args.batch_size, pause=args.pause))
+
+    print(f"moved:   {report['media']} media, {report['files']} files")
+    print(f"missing: {report['missing']} media (their file doesn't exist, they're left as they are)")